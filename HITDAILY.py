@@ -4,6 +4,7 @@ import shutil
 import subprocess
 import random
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
@@ -20,7 +21,7 @@ from webdriver_manager.chrome import ChromeDriverManager
 import logging
 from dotenv import load_dotenv
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(threadName)s - %(levelname)s - %(message)s')
 
 cplus_download_dir = os.path.abspath("downloads_cplus")
 barge_download_dir = os.path.abspath("downloads_barge")
@@ -954,25 +955,31 @@ All files OK!
     except Exception as e:
         logging.error("❌ Email ERR: %s", str(e))
         
+def run_sites_concurrently():
+    """
+    CPLUS 同 Barge 各自用獨立 driver 同下載目錄，兩條 pipeline 並行跑，等齊結果先返回。
+    """
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix='site') as executor:
+        cplus_future = executor.submit(process_cplus)
+        barge_future = executor.submit(process_barge)
+        cplus_files, house_file_count, house_button_count, cplus_driver, house_report_files = cplus_future.result()
+        barge_files, barge_driver = barge_future.result()
+    for name, driver in (('CPLUS', cplus_driver), ('Barge', barge_driver)):
+        if driver:
+            try:
+                driver.quit()
+                logging.info(f"{name} WebDriver 關閉")
+            except Exception as e:
+                logging.warning(f"{name} WebDriver 關閉失敗: {str(e)}")
+    return cplus_files, house_file_count, house_button_count, house_report_files, barge_files
+
 def main():
     load_dotenv()
     clear_download_dirs()
-    cplus_files = set()
-    house_file_count = 0
-    house_button_count = 0
-    barge_files = set()
-    cplus_driver = None
-    house_report_files = {}
-    # Process CPLUS
-    cplus_files, house_file_count, house_button_count, cplus_driver, house_report_files = process_cplus()
-    if cplus_driver:
-        cplus_driver.quit()
-        logging.info("CPLUS WebDriver 關閉")
-    # Process Barge
-    barge_files, barge_driver = process_barge()
-    if barge_driver:
-        barge_driver.quit()
-        logging.info("Barge WebDriver 關閉")
+    # CPLUS 同 Barge 並行處理，總時間由兩者相加變成取較長者
+    start_time = time.time()
+    cplus_files, house_file_count, house_button_count, house_report_files, barge_files = run_sites_concurrently()
+    logging.info(f"⏱️ CPLUS + Barge 並行完成，用時 {time.time() - start_time:.1f} 秒")
     # Check all downloaded files
     # **嚴格檢查：全齊才發**
     movement_file = get_latest_file(cplus_download_dir, 'cntrMoveLog')
@@ -3,34 +3,72 @@ import time
 import shutil
 import subprocess
 import random
-from datetime import datetime
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email.mime.text import MIMEText
-from email import encoders
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.remote.command import Command
+from selenium.webdriver.remote.switch_to import SwitchTo
 from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, JavascriptException, ElementClickInterceptedException, NoSuchElementException
+from selenium.common.exceptions import TimeoutException, JavascriptException, ElementClickInterceptedException, NoSuchElementException, StaleElementReferenceException, WebDriverException
 from webdriver_manager.chrome import ChromeDriverManager
 import logging
 from dotenv import load_dotenv
 import imaplib
 import email
 import re
-from email.header import decode_header
+import select
+import struct
+import ctypes
+import ctypes.util
+import json
+import base64
+import threading
+import queue
+import fnmatch
+import email.message
+import email.policy
+from email.utils import formatdate, make_msgid
+import tempfile
+import zipfile
+import csv
+import html
+from array import array
+from collections import Counter
+from itertools import chain, islice
+import urllib3
+import http.cookies
+import hashlib
+from cryptography.fernet import Fernet, InvalidToken
+from openpyxl import load_workbook
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+import sys
+import argparse
+import importlib.metadata
+import signal
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from email.header import decode_header, make_header
 import time
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(threadName)s - %(levelname)s - %(message)s')
 
 cplus_download_dir = os.path.abspath("downloads_cplus")
 barge_download_dir = os.path.abspath("downloads_barge")
-MAX_RETRIES = 3
 DOWNLOAD_TIMEOUT = 30  # 延長至 60 秒
+CHROME_BINARY = '/usr/bin/chromium-browser'
+HOUSEKEEP_PREFIXES = ['IE2_', 'DM1C_', 'IA17_', 'GA1_', 'IA5_', 'IA15_', 'INV-114_']  # Housekeeping 報告檔名前綴
 
 def clear_download_dirs():
     for dir_path in [cplus_download_dir, barge_download_dir]:
@@ -39,24 +77,500 @@ def clear_download_dirs():
         os.makedirs(dir_path)
         logging.info(f"創建下載目錄: {dir_path}")
 
-def setup_environment():
+# ==================== 每日運行清單（checkpoint / resume） ====================
+RUN_MANIFEST_DIR = os.path.abspath(".run_manifests")
+MANIFEST_SINGLE_REPORTS = {
+    'movement': cplus_download_dir,
+    'onhand': cplus_download_dir,
+    'barge': barge_download_dir,
+}
+
+def resume_requested():
+    """RESUME=true（或 --resume）時沿用今日清單，只補返未完成嘅報告"""
+    return os.environ.get('RESUME', 'False').lower() == 'true'
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class RunManifest:
+    """
+    每個業務日一份 JSON，記錄已成功下載嘅報告（檔名、大小、sha256）同 Email 發送時間。
+    CPLUS/Barge 兩條 thread 會同時寫，所以全部經 lock，每次記錄即寫盤（先寫 tmp 再 os.replace）。
+    """
+    def __init__(self, business_date=None):
+        self.business_date = business_date or datetime.now().strftime('%Y-%m-%d')
+        self.path = os.path.join(RUN_MANIFEST_DIR, f"{self.business_date}.json")
+        self.lock = threading.Lock()
+        self.data = {'business_date': self.business_date, 'reports': {}, 'house': {}, 'house_button_count': None, 'email_sent_at': None}
+
+    @classmethod
+    def load(cls, business_date=None):
+        manifest = cls(business_date)
+        try:
+            with open(manifest.path, encoding='utf-8') as f:
+                manifest.data.update(json.load(f))
+            logging.info(f"清單: 讀取 {manifest.business_date} 運行清單，已完成 {sorted(manifest.data['reports'])} + House {len(manifest.data['house'])} 份")
+        except FileNotFoundError:
+            logging.info(f"清單: {manifest.business_date} 未有運行清單，由頭開始")
+        except (OSError, ValueError) as e:
+            logging.warning(f"清單: 讀取失敗，由頭開始: {str(e)}")
+        return manifest
+
+    def save(self):
+        with self.lock:
+            os.makedirs(RUN_MANIFEST_DIR, exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+
+    def record(self, key, download_dir, file_name, report_name=None):
+        """記錄一份成功下載嘅報告；house 以報告名稱分開記"""
+        path = os.path.join(download_dir, file_name)
+        entry = {
+            'file': file_name,
+            'size': os.path.getsize(path),
+            'sha256': file_sha256(path),
+            'completed_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+        with self.lock:
+            if key == 'house':
+                self.data['house'][report_name] = entry
+            else:
+                self.data['reports'][key] = entry
+        self.save()
+
+    def record_files(self, key, download_dir, file_names):
+        """section 回傳一組檔案時記最新嗰個"""
+        if file_names:
+            latest = max(file_names, key=lambda f: os.path.getmtime(os.path.join(download_dir, f)))
+            self.record(key, download_dir, latest)
+
+    def set_house_button_count(self, count):
+        with self.lock:
+            self.data['house_button_count'] = count
+        self.save()
+
+    def verify(self):
+        """檔案唔見咗、大小或 hash 唔對嘅記錄會剔走，resume 時會重新下載"""
+        def valid(entry, download_dir):
+            path = os.path.join(download_dir, entry['file'])
+            return os.path.exists(path) and os.path.getsize(path) == entry['size'] and file_sha256(path) == entry['sha256']
+        with self.lock:
+            for key in list(self.data['reports']):
+                if not valid(self.data['reports'][key], MANIFEST_SINGLE_REPORTS[key]):
+                    logging.warning(f"清單: {key} 檔案 {self.data['reports'][key]['file']} 已遺失或已改動，需要重新下載")
+                    del self.data['reports'][key]
+            for report_name in list(self.data['house']):
+                if not valid(self.data['house'][report_name], cplus_download_dir):
+                    logging.warning(f"清單: House {report_name} 檔案已遺失或已改動，需要重新下載")
+                    del self.data['house'][report_name]
+        self.save()
+
+    def has(self, key):
+        with self.lock:
+            return key in self.data['reports']
+
+    def house_done(self):
+        with self.lock:
+            return set(self.data['house'])
+
+    def house_button_count(self):
+        with self.lock:
+            return self.data['house_button_count']
+
+    def house_complete(self):
+        with self.lock:
+            count = self.data['house_button_count']
+            return bool(count) and len(self.data['house']) >= count
+
+    def cplus_complete(self):
+        return self.has('movement') and self.has('onhand') and self.house_complete()
+
+    def is_complete(self):
+        return self.cplus_complete() and self.has('barge')
+
+    def house_report_files(self):
+        """轉返 check_and_send_email 用嘅 {報告名稱: {'file', 'mod_time'}} 格式"""
+        with self.lock:
+            return {name: {'file': entry['file'], 'mod_time': os.path.getmtime(os.path.join(cplus_download_dir, entry['file']))} for name, entry in self.data['house'].items()}
+
+    def files_in(self, download_dir):
+        with self.lock:
+            files = {entry['file'] for key, entry in self.data['reports'].items() if MANIFEST_SINGLE_REPORTS[key] == download_dir}
+            if download_dir == cplus_download_dir:
+                files.update(entry['file'] for entry in self.data['house'].values())
+            return files
+
+    def email_sent(self):
+        with self.lock:
+            return self.data['email_sent_at']
+
+    def mark_email_sent(self):
+        with self.lock:
+            self.data['email_sent_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.save()
+
+def prepare_download_dirs_for_resume(manifest):
+    """resume 模式唔清空下載目錄，只刪走清單以外嘅檔案（舊日子/半成品），避免下載索引揀錯"""
+    for dir_path in [cplus_download_dir, barge_download_dir]:
+        os.makedirs(dir_path, exist_ok=True)
+        keep = manifest.files_in(dir_path)
+        for file_name in os.listdir(dir_path):
+            if file_name not in keep:
+                path = os.path.join(dir_path, file_name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+        logging.info(f"Resume: 保留 {dir_path} 入面 {len(keep)} 個已完成檔案")
+
+PREFLIGHT_PACKAGES = ['selenium', 'webdriver-manager', 'urllib3', 'cryptography', 'python-dotenv']
+_warm_imap = {'listener': None}
+_warm_imap_lock = threading.Lock()
+
+def check_chrome_binary():
+    path = CHROME_BINARY if os.access(CHROME_BINARY, os.X_OK) else shutil.which(os.path.basename(CHROME_BINARY))
+    if not path:
+        raise Exception("Chromium 未安裝，請檢查 GitHub Actions YML 安裝步驟")
+    return f"{path} ({get_chrome_version(path) or '版本未知'})"
+
+def check_python_packages():
+    versions = []
+    for package in PREFLIGHT_PACKAGES:
+        try:
+            versions.append(f"{package} {importlib.metadata.version(package)}")
+        except importlib.metadata.PackageNotFoundError:
+            raise Exception(f"{package} 未安裝，請檢查 GitHub Actions YML pip 步驟")
+    return ', '.join(versions)
+
+def warm_up_imap():
+    """預先登入 Zoho IMAP，連線留俾 cplus_login 2FA 用"""
+    listener = Cplus2FAListener()
+    listener.connect()
+    with _warm_imap_lock:
+        _warm_imap['listener'] = listener
+    return f"IDLE {'支援' if listener.idle_supported else '不支援'}"
+
+def take_warm_imap_listener():
+    """攞 preflight 預先連好嘅 IMAP listener（只可以攞一次）"""
+    with _warm_imap_lock:
+        listener, _warm_imap['listener'] = _warm_imap['listener'], None
+    return listener
+
+def check_smtp_login():
+    smtp_server = os.environ.get('SMTP_SERVER', 'smtp.zoho.com')
+    smtp_port = int(os.environ.get('SMTP_PORT', 587))
+    server = smtplib.SMTP(smtp_server, smtp_port, timeout=15)
     try:
-        result = subprocess.run(['which', 'chromium-browser'], capture_output=True, text=True)
-        if result.returncode != 0:
-            raise Exception("Chromium 未安裝，請檢查 GitHub Actions YML 安裝步驟")
+        server.starttls()
+        server.login(os.environ['ZOHO_EMAIL'], os.environ['ZOHO_PASSWORD'])
+    finally:
+        server.quit()
+    return f"{smtp_server}:{smtp_port}"
+
+def check_portal(url):
+    response = urllib3.PoolManager().request('GET', url, timeout=urllib3.Timeout(connect=10, read=10), retries=urllib3.Retry(total=1, redirect=3))
+    if response.status >= 500:
+        raise Exception(f"HTTP {response.status}")
+    return f"HTTP {response.status}"
+
+def setup_environment(pool=None):
+    """
+    Preflight：喺 process 內並行檢查 Chromium、Python 套件、Zoho IMAP/SMTP 登入同兩個網站連線，
+    共用 Chrome 模式下同時等 Chrome 啟動。Chromium 或套件缺失即 raise，其餘只警告。最後輸出一行用時明細。
+    """
+    checks = {
+        'chromium': (check_chrome_binary, True),
+        'packages': (check_python_packages, True),
+        'imap': (warm_up_imap, False),
+        'smtp': (check_smtp_login, False),
+        'cplus': (lambda: check_portal(CPLUS_HOME_URL), False),
+        'barge': (lambda: check_portal(BARGE_LOGIN_URL), False),
+    }
+    if pool:
+        checks['chrome_launch'] = (lambda: pool.ensure_started() and "ready", False)
+
+    def timed(func):
+        start_time = time.time()
+        try:
+            return True, func(), time.time() - start_time
+        except Exception as e:
+            return False, str(e), time.time() - start_time
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=len(checks), thread_name_prefix='preflight') as executor:
+        futures = {name: executor.submit(timed, func) for name, (func, _) in checks.items()}
+        results = {name: future.result() for name, future in futures.items()}
+    breakdown = ' | '.join(f"{name} {'✓' if ok else '✗'} {elapsed:.2f}s" for name, (ok, _, elapsed) in results.items())
+    logging.info(f"🧪 Preflight: {breakdown} | 總用時 {time.time() - start_time:.2f}s")
+    for name, (ok, detail, _) in results.items():
+        if ok:
+            logging.info(f"Preflight {name}: {detail}")
+        elif checks[name][1]:
+            logging.error(f"環境檢查失敗: {detail}")
+            raise Exception(detail)
         else:
-            logging.info("Chromium 及 ChromeDriver 已存在，跳過安裝")
-        
-        result = subprocess.run(['pip', 'show', 'selenium'], capture_output=True, text=True)
-        if "selenium" not in result.stdout:
-            raise Exception("Selenium 未安裝，請檢查 GitHub Actions YML pip 步驟")
-        result = subprocess.run(['pip', 'show', 'webdriver-manager'], capture_output=True, text=True)
-        if "webdriver-manager" not in result.stdout:
-            raise Exception("WebDriver Manager 未安裝，請檢查 GitHub Actions YML pip 步驟")
-        logging.info("Selenium 及 WebDriver Manager 已存在，跳過安裝")
+            logging.warning(f"Preflight {name} 失敗: {detail}")
+
+# ==================== 精簡瀏覽器模式同導航/記憶體指標 ====================
+LEAN_BLOCKED_URLS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico', '*.bmp',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot', '*.mp4', '*.webm',
+    '*fonts.googleapis.com*', '*fonts.gstatic.com*', '*google-analytics.com*',
+    '*googletagmanager.com*', '*doubleclick.net*', '*hotjar.com*', '*facebook.net*'
+]
+LEAN_WINDOW_SIZE = (1366, 900)
+_nav_stats = {}
+_nav_stats_lock = threading.Lock()
+
+def lean_browser_enabled():
+    """LEAN_BROWSER=true 時封鎖圖片/字型/第三方腳本、eager 加載、固定視窗大小同限制 renderer 數量"""
+    return os.environ.get('LEAN_BROWSER', 'False').lower() == 'true'
+
+def apply_lean_profile(driver):
+    """用 DevTools URL 封鎖非必要資源（每個分頁各自設定）"""
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': LEAN_BLOCKED_URLS})
+        logging.info(f"精簡模式: 已封鎖 {len(LEAN_BLOCKED_URLS)} 類非必要資源")
     except Exception as e:
-        logging.error(f"環境檢查失敗: {e}")
-        raise
+        logging.warning(f"精簡模式: 設定 URL 封鎖失敗: {str(e)}")
+
+def wait_for_page_ready(driver, timeout=15):
+    """eager 模式下 driver.get 喺 DOMContentLoaded 就返回，呢度明確等 DOM 可用同 #root 出現"""
+    WebDriverWait(driver, timeout).until(lambda d: d.execute_script(
+        "return document.readyState !== 'loading' && !!(document.getElementById('root') || document.querySelector('app-root') || document.body);"
+    ))
+
+def navigate(driver, url):
+    """打開網址並記錄導航用時（按 host 統計），用嚟比較 normal 同 lean 模式"""
+    start_time = time.time()
+    driver.get(url)
+    wait_for_page_ready(driver)
+    elapsed = time.time() - start_time
+    host = urllib.parse.urlparse(url).netloc
+    with _nav_stats_lock:
+        _nav_stats.setdefault(host, []).append(elapsed)
+    logging.debug(f"導航 {url} 用時 {elapsed:.2f} 秒")
+    return elapsed
+
+# ==================== 節奏控制：統一記錄所有刻意延遲 ====================
+class Pacer:
+    """
+    所有刻意延遲都經呢度：有條件可等嘅用 until()（條件成立即刻返回），冇條件嘅 human-like 延遲用 pause()，
+    按 until() 量度到嘅 portal 反應時間（EWMA）自動縮放，PACING_SCALE 可以固定倍數（0 = 唔停）。
+    每條 thread 分開記睡眠、條件等待同工作秒數，結尾 log_summary() 出總結。
+    """
+    REFERENCE_LATENCY = 0.5  # portal 平均反應 0.5 秒時 pause 用返 base 延遲
+    MIN_SCALE, MAX_SCALE = 0.2, 1.5
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        fixed_scale = self._parse_fixed_scale()
+        with self.lock:
+            self.started = time.time()
+            self.latency = None
+            self.threads = {}
+            self.fixed_scale = fixed_scale
+
+    @staticmethod
+    def _parse_fixed_scale():
+        """PACING_SCALE 每次 reset 先讀一次；格式唔啱就 log 一次、改用自動縮放，唔會令每個 pause 出錯"""
+        value = os.environ.get('PACING_SCALE')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            logging.warning(f"PACING_SCALE={value!r} 唔係數字，改用自動縮放")
+            return None
+
+    def _account(self, kind, seconds):
+        name = threading.current_thread().name
+        with self.lock:
+            stats = self.threads.setdefault(name, {'sleep': 0.0, 'wait': 0.0, 'pauses': 0, 'waits': 0})
+            stats[kind] += seconds
+            stats['last'] = time.time()
+            stats['pauses' if kind == 'sleep' else 'waits'] += 1
+
+    def observe(self, seconds):
+        """記錄一次 portal 反應時間"""
+        with self.lock:
+            self.latency = seconds if self.latency is None else 0.7 * self.latency + 0.3 * seconds
+
+    def scale(self):
+        with self.lock:
+            fixed, latency = self.fixed_scale, self.latency
+        if fixed is not None:
+            return fixed
+        if latency is None:
+            return 1.0
+        return min(self.MAX_SCALE, max(self.MIN_SCALE, latency / self.REFERENCE_LATENCY))
+
+    def pause(self, label, base, jitter=0.0, scaled=True):
+        """冇條件可等嘅 human-like 延遲：base（+ 隨機 jitter）按 portal 反應縮放；scaled=False（例如重試 backoff）照原值停"""
+        delay = (base + random.uniform(0, jitter)) * (self.scale() if scaled else 1.0)
+        if delay > 0:
+            time.sleep(delay)
+        self._account('sleep', delay)
+        logging.debug(f"Pacing {label}: 停 {delay:.2f}s")
+        return delay
+
+    def until(self, driver, condition, timeout=10, label=''):
+        """條件等待：成立即刻返回，用時當作 portal 反應時間；超時照 raise TimeoutException"""
+        start_time = time.time()
+        try:
+            result = WebDriverWait(driver, timeout, poll_frequency=0.1).until(condition)
+            self.observe(time.time() - start_time)
+            return result
+        finally:
+            elapsed = time.time() - start_time
+            self._account('wait', elapsed)
+            logging.debug(f"Pacing {label}: 條件等待 {elapsed:.2f}s")
+
+    def log_summary(self):
+        with self.lock:
+            started = self.started
+            threads = dict(self.threads)
+            latency = self.latency
+        if not threads:
+            return
+        parts = []
+        for name, stats in sorted(threads.items()):
+            # 由開始計到該 thread 最後一次延遲，扣除睡眠同條件等待就係工作時間
+            total = stats['last'] - started
+            work = max(0.0, total - stats['sleep'] - stats['wait'])
+            parts.append(f"{name} 睡眠 {stats['sleep']:.1f}s/{stats['pauses']} 次, 條件等待 {stats['wait']:.1f}s/{stats['waits']} 次, 工作 {work:.1f}s")
+        latency_text = f"{latency:.2f}s" if latency is not None else "未量度"
+        logging.info(f"⏱️ Pacing: {'; '.join(parts)} | portal 反應 {latency_text}, 縮放 x{self.scale():.2f}")
+
+pacer = Pacer()
+
+# ==================== 分類重試引擎 ====================
+class SessionExpiredError(Exception):
+    """頁面跳返登入頁 / session 失效"""
+
+class DownloadNotStartedError(Exception):
+    """已點擊但無新檔案；reclick 係「只重新點擊同等下載」嘅 closure，唔使重跑成個 section"""
+    def __init__(self, message, reclick=None):
+        super().__init__(message)
+        self.reclick = reclick
+
+# 每類失敗嘅重試次數上限同 backoff 基數（秒），backoff 用 full jitter：uniform(0, min(上限, 基數 * 2^(n-1)))
+RETRY_BUDGETS = {'session': 1, 'popup': 3, 'stale': 3, 'download': 2, 'timeout': 2, 'other': 2}  # other 保持原本 MAX_RETRIES=3 次嘗試
+RETRY_BACKOFF_BASE = {'session': 0.0, 'popup': 0.3, 'stale': 0.5, 'download': 1.0, 'timeout': 1.0, 'other': 2.0}
+RETRY_BACKOFF_CAP = 8.0
+
+def classify_failure(driver, error, session_lost=None):
+    """將失敗分類：session / popup / stale / download / timeout / other"""
+    if isinstance(error, SessionExpiredError):
+        return 'session'
+    if isinstance(error, DownloadNotStartedError):
+        return 'download'
+    if isinstance(error, StaleElementReferenceException):
+        return 'stale'
+    if isinstance(error, ElementClickInterceptedException):
+        return 'popup'
+    try:
+        if session_lost and session_lost(driver):
+            return 'session'
+        if read_popup_state(driver).get('open'):
+            return 'popup'
+    except Exception as e:
+        logging.debug(f"分類失敗時檢查頁面狀態出錯: {str(e)}")
+    if isinstance(error, TimeoutException):
+        return 'timeout'
+    return 'other'
+
+def run_with_retry(label, driver, action, recoveries=None, session_lost=None, budgets=None):
+    """
+    執行 action，失敗就分類，按該類預算重試：先做最平嘅對應修復（recoveries[類別]），
+    download 類如果有 reclick 就下一次只重新點擊；超出該類預算即 raise 原本嘅錯誤。
+    driver 可以係一個回傳當前 driver 嘅函數（重登時會換 driver 嘅情況），分類時先攞。
+    """
+    budgets = budgets or RETRY_BUDGETS
+    recoveries = recoveries or {}
+    used = {}
+    attempt_fn = action
+    while True:
+        try:
+            return attempt_fn()
+        except Exception as e:
+            failure = classify_failure(driver() if callable(driver) else driver, e, session_lost)
+            used[failure] = used.get(failure, 0) + 1
+            budget = budgets.get(failure, 0)
+            if used[failure] > budget:
+                logging.error(f"{label}: [{failure}] 失敗已用盡預算 {budget} 次: {str(e)}")
+                raise
+            base = RETRY_BACKOFF_BASE.get(failure, 1.0)
+            delay = random.uniform(0, min(RETRY_BACKOFF_CAP, base * 2 ** (used[failure] - 1))) if base else 0.0
+            logging.warning(f"{label}: [{failure}] 失敗 ({used[failure]}/{budget})，{delay:.1f}s 後重試: {str(e)}")
+            if delay:
+                pacer.pause(f'{label}_{failure}_backoff', delay, scaled=False)
+            attempt_fn = action
+            if failure == 'download' and getattr(e, 'reclick', None):
+                attempt_fn = e.reclick
+            elif failure in recoveries:
+                try:
+                    recoveries[failure](e)
+                except Exception as re_e:
+                    logging.warning(f"{label}: [{failure}] 修復動作失敗: {str(re_e)}")
+
+def cplus_session_lost(driver):
+    """即時判斷 CPLUS 係咪跳返登入頁（唔等待）"""
+    return 'frontpage' in driver.current_url or bool(driver.find_elements(By.XPATH, "//*[@id='companyCode']"))
+
+def barge_session_lost(driver):
+    return 'login' in driver.current_url
+
+def get_process_tree_rss(root_pid):
+    """由 /proc 計 root_pid 同所有子孫 process 嘅 RSS（MB），非 Linux 回傳 None"""
+    try:
+        parents = {}
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                try:
+                    with open(f'/proc/{entry}/stat', encoding='utf-8') as f:
+                        # comm 可能有空格，由最後一個 ')' 之後先拆
+                        fields = f.read().rsplit(')', 1)[1].split()
+                    parents.setdefault(int(fields[1]), []).append(int(entry))
+                except (OSError, IndexError, ValueError):
+                    continue
+        total_kb = 0
+        stack = [root_pid]
+        while stack:
+            pid = stack.pop()
+            stack.extend(parents.get(pid, []))
+            try:
+                with open(f'/proc/{pid}/status', encoding='utf-8') as f:
+                    for line in f:
+                        if line.startswith('VmRSS:'):
+                            total_kb += int(line.split()[1])
+                            break
+            except OSError:
+                continue
+        return total_kb / 1024
+    except OSError:
+        return None
+
+def log_browser_metrics(driver, label):
+    """輸出導航平均用時同 Chrome process tree RSS，方便對比 LEAN_BROWSER 開關前後"""
+    profile = 'lean' if lean_browser_enabled() else 'normal'
+    try:
+        rss = get_process_tree_rss(driver.service.process.pid)
+    except AttributeError:
+        rss = None
+    with _nav_stats_lock:
+        nav = '; '.join(f"{host} {len(times)} 次 平均 {sum(times) / len(times):.2f}s" for host, times in _nav_stats.items())
+    logging.info(f"📈 {label} 瀏覽器指標 [profile={profile}]: 導航 {nav or '無'} | Chrome RSS {f'{rss:.0f} MB' if rss is not None else '未知'}")
 
 # 完整 SUB CODE: 修改 get_chrome_options 函數，調整 random.randint(800, 1440) 範圍（替換原 get_chrome_options 全部內容）
 def get_chrome_options(download_dir):
@@ -74,7 +588,14 @@ def get_chrome_options(download_dir):
         "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36"
     ]
     chrome_options.add_argument(f'--user-agent={random.choice(user_agents)}')
-    chrome_options.add_argument(f'--window-size={random.randint(1440, 2560)},{random.randint(1440, 2560)}')
+    if lean_browser_enabled():
+        # 精簡模式：固定較細視窗（render 同 screenshot 都平啲）、限制 renderer process、唔載圖片、eager 加載
+        chrome_options.add_argument(f'--window-size={LEAN_WINDOW_SIZE[0]},{LEAN_WINDOW_SIZE[1]}')
+        chrome_options.add_argument('--renderer-process-limit=2')
+        chrome_options.add_argument('--blink-settings=imagesEnabled=false')
+        chrome_options.page_load_strategy = 'eager'
+    else:
+        chrome_options.add_argument(f'--window-size={random.randint(1440, 2560)},{random.randint(1440, 2560)}')
     chrome_options.add_argument('--disable-blink-features=AutomationControlled')
     chrome_options.add_experimental_option('excludeSwitches', ['enable-automation'])
     prefs = {
@@ -82,66 +603,605 @@ def get_chrome_options(download_dir):
         "download.prompt_for_download": False,
         "safebrowsing.enabled": False
     }
+    if lean_browser_enabled():
+        prefs["profile.managed_default_content_settings.images"] = 2
     chrome_options.add_experimental_option("prefs", prefs)
-    chrome_options.binary_location = '/usr/bin/chromium-browser'
+    if network_logging_requested():
+        # DevTools 擷取模式同直接匯出都需要 performance log 攞 Network 事件
+        chrome_options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+    chrome_options.binary_location = CHROME_BINARY
     return chrome_options
 
+# inotify 常數 (Linux)，用嚟即時收到 .crdownload -> 正式檔名嘅 rename 事件
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+DOWNLOAD_EXTENSIONS = ('.csv', '.xlsx')
+
+def open_inotify_watch(download_dir):
+    """
+    開 inotify watch 監察下載目錄嘅 close-write 同 moved-to 事件，回傳 fd；非 Linux 或失敗回傳 None。
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(download_dir), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError) as e:
+        logging.debug(f"inotify 不可用，改用輪詢: {str(e)}")
+        return None
+
+def read_inotify_names(fd):
+    """讀出 inotify fd 內所有事件嘅檔名"""
+    names = []
+    try:
+        data = os.read(fd, 65536)
+    except BlockingIOError:
+        return names
+    offset = 0
+    while offset + 16 <= len(data):
+        _, _, _, length = struct.unpack_from('iIII', data, offset)
+        name = data[offset + 16:offset + 16 + length].split(b'\0', 1)[0]
+        offset += 16 + length
+        if name:
+            names.append(os.fsdecode(name))
+    return names
+
+def filter_stable_files(download_dir, files, interval=0.2):
+    """一次過量度所有候選檔案大小，等一個 interval 再量，返回大小穩定且非空嘅檔案"""
+    def sizes():
+        result = {}
+        for file in files:
+            try:
+                result[file] = os.path.getsize(os.path.join(download_dir, file))
+            except OSError:
+                result[file] = -1
+        return result
+    before = sizes()
+    time.sleep(interval)
+    after = sizes()
+    stable = [f for f in files if before[f] == after[f] and after[f] > 0]
+    for file in set(files) - set(stable):
+        logging.debug(f"檔案 {file} 大小不穩定 ({before[file]} -> {after[file]})，繼續等待...")
+    return stable
+
+def select_new_files(stable_files, prefixes):
+    """按 prefixes 過濾，無匹配返回空 set"""
+    if prefixes:
+        return set(f for f in stable_files if any(f.startswith(p) for p in prefixes))
+    return set(stable_files)
+
 def wait_for_new_file(download_dir, initial_files, timeout=20, prefixes=None):
+    fd = open_inotify_watch(download_dir)
+    if fd is None:
+        return poll_for_new_file(download_dir, initial_files, timeout, prefixes)
+    start_time = time.time()
+    try:
+        # watch 開咗先掃一次，避免錯過點擊後、watch 開始前已完成嘅檔案
+        existing = [f for f in os.listdir(download_dir) if f.endswith(DOWNLOAD_EXTENSIONS) and f not in initial_files]
+        completed = set(filter_stable_files(download_dir, existing)) if existing else set()
+        while True:
+            found = select_new_files(completed, prefixes)
+            if found:
+                logging.info(f"下載完成並穩定: {sorted(found)}")
+                return found
+            remaining = timeout - (time.time() - start_time)
+            if remaining <= 0:
+                break
+            readable, _, _ = select.select([fd], [], [], remaining)
+            if not readable:
+                continue
+            # Chrome 下載完成先 rename 做正式檔名，所以收到事件即代表完成
+            for name in read_inotify_names(fd):
+                if name.endswith(DOWNLOAD_EXTENSIONS) and name not in initial_files:
+                    try:
+                        if os.path.getsize(os.path.join(download_dir, name)) > 0:
+                            completed.add(name)
+                    except OSError:
+                        continue
+    finally:
+        os.close(fd)
+    logging.warning(f"等待 {timeout} 秒後仍無新穩定檔案，返回空集")
+    return set()
+
+def poll_for_new_file(download_dir, initial_files, timeout=20, prefixes=None):
+    """輪詢後備方案（無 inotify 時用），所有候選檔案一齊檢查大小穩定"""
     start_time = time.time()
     while time.time() - start_time < timeout:
         # 先檢查有冇下載中檔案 (.crdownload)
         downloading_files = [f for f in os.listdir(download_dir) if f.endswith('.crdownload')]
         if downloading_files:
             logging.debug(f"檢測到下載中檔案: {downloading_files}，繼續等待...")
-            time.sleep(1)
+            time.sleep(0.5)
             continue  # 如果有下載中，跳過新檔案檢查，等完成
         
         # 檢查完成檔案
-        current_files = set(f for f in os.listdir(download_dir) if f.endswith(('.csv', '.xlsx')))
+        current_files = set(f for f in os.listdir(download_dir) if f.endswith(DOWNLOAD_EXTENSIONS))
         new_files = current_files - initial_files
         
         if new_files:
-            # 確保每個新檔案大小穩定（下載完成）
-            stable_files = []
-            for file in new_files:
-                file_path = os.path.join(download_dir, file)
-                size1 = os.path.getsize(file_path)
-                time.sleep(1)  # 等 1 秒再 check 大小
-                size2 = os.path.getsize(file_path)
-                if size1 == size2 and size1 > 0:  # 大小穩定且非空
-                    stable_files.append(file)
-                else:
-                    logging.debug(f"檔案 {file} 大小不穩定 ({size1} -> {size2})，繼續等待...")
-            
-            if stable_files:
-                if prefixes:
-                    filtered_new = [f for f in stable_files if any(f.startswith(p) for p in prefixes)]
-                    if filtered_new:
-                        logging.info(f"下載完成並穩定: {filtered_new}")
-                        return set(filtered_new)
-                else:
-                    logging.info(f"下載完成並穩定: {stable_files}")
-                    return set(stable_files)
+            # 確保每個新檔案大小穩定（下載完成），一次過檢查全部
+            found = select_new_files(filter_stable_files(download_dir, list(new_files), interval=1), prefixes)
+            if found:
+                logging.info(f"下載完成並穩定: {sorted(found)}")
+                return found
         
-        time.sleep(1)  # 每秒檢查一次
+        time.sleep(0.5)
     
     logging.warning(f"等待 {timeout} 秒後仍無新穩定檔案，返回空集")
     return set()
 
+# ==================== DevTools 網絡攔截（記憶體內擷取匯出檔案） ====================
+EXPORT_MIME_TYPES = ('text/csv', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'application/octet-stream', 'application/vnd.ms-excel')
+_network_states = {}
+_network_states_lock = threading.Lock()
+_capture_settings = {}
+
+def network_capture_requested():
+    """CAPTURE_MODE=cdp 時用 DevTools 擷取匯出回應，預設 file 即用下載目錄"""
+    return os.environ.get('CAPTURE_MODE', 'file').lower() == 'cdp'
+
+def get_network_state(driver):
+    """每個 WebDriver session 一份網絡事件狀態（共用 Chrome 時各 context 共用同一份 performance log）"""
+    with _network_states_lock:
+        return _network_states.setdefault(driver.session_id, {
+            'requests': {}, 'responses': {}, 'finished': set(), 'consumed': set()
+        })
+
+def get_capture_settings(driver):
+    """擷取設定按 driver（或共用 Chrome 入面嘅 context）分開"""
+    with _network_states_lock:
+        return _capture_settings.setdefault(getattr(driver, 'lease_key', driver.session_id), {'capture': False, 'download_dir': None})
+
+def download_behavior_params(driver, **params):
+    """共用 Chrome 時下載設定只套用到該 browser context"""
+    context_id = getattr(driver, 'browser_context_id', None)
+    if context_id:
+        params['browserContextId'] = context_id
+    return params
+
+def enable_network_capture(driver, download_dir):
+    """
+    開 Network domain 並禁止 Chrome 將匯出寫入磁碟，匯出內容改由 performance log + getResponseBody 擷取。
+    """
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Browser.setDownloadBehavior', download_behavior_params(driver, behavior='deny'))
+        settings = get_capture_settings(driver)
+        settings['capture'] = True
+        settings['download_dir'] = download_dir
+        logging.info("DevTools 網絡擷取模式已啟用")
+    except Exception as e:
+        logging.warning(f"DevTools 網絡擷取啟用失敗，改用下載目錄: {str(e)}")
+
+def disable_network_capture(driver):
+    """擷取失敗時恢復正常下載到原目錄"""
+    settings = get_capture_settings(driver)
+    settings['capture'] = False
+    try:
+        driver.execute_cdp_cmd('Browser.setDownloadBehavior', download_behavior_params(driver, behavior='allow', downloadPath=settings['download_dir']))
+    except Exception as e:
+        logging.warning(f"恢復下載行為失敗: {str(e)}")
+
+def drain_network_events(driver):
+    """讀出 performance log 新事件，累積 request/response/finished 狀態"""
+    state = get_network_state(driver)
+    entries = driver.get_log('performance')
+    with _network_states_lock:
+        for entry in entries:
+            try:
+                log = json.loads(entry['message'])
+                message = log['message']
+            except (KeyError, ValueError):
+                continue
+            method = message.get('method')
+            params = message.get('params', {})
+            request_id = params.get('requestId')
+            # webview 即產生事件嘅分頁 handle，共用 Chrome 時用嚟分返屬於邊個 site
+            if method == 'Network.requestWillBeSent':
+                request = params.get('request', {})
+                state['requests'][request_id] = {
+                    'url': request.get('url'), 'method': request.get('method'),
+                    'headers': request.get('headers', {}), 'postData': request.get('postData'),
+                    'webview': log.get('webview')
+                }
+            elif method == 'Network.responseReceived':
+                response = params.get('response', {})
+                state['responses'][request_id] = {
+                    'url': response.get('url'), 'status': response.get('status'),
+                    'mimeType': response.get('mimeType', ''),
+                    'headers': {k.lower(): v for k, v in response.get('headers', {}).items()},
+                    'webview': log.get('webview')
+                }
+            elif method == 'Network.loadingFinished':
+                state['finished'].add(request_id)
+    return state
+
+def get_disposition_filename(headers):
+    """由 Content-Disposition 攞檔名（支援 filename*=UTF-8''...）"""
+    disposition = headers.get('content-disposition')
+    if not disposition or 'attachment' not in disposition.lower():
+        return None
+    msg = email.message.Message()
+    msg['content-disposition'] = disposition
+    file_name = msg.get_filename()
+    return os.path.basename(file_name) if file_name else None
+
+def capture_export_responses(driver, download_dir, initial_files, timeout=20, prefixes=None):
+    """
+    等匯出回應完成，用 Network.getResponseBody 攞 bytes，按 Content-Disposition 檔名寫入下載目錄。
+    回傳同 wait_for_new_file 一樣嘅檔名 set。body 攞唔到（已被清走、太大、或者 Chrome 當下載處理）就即刻
+    關閉擷取模式回傳空 set，由 caller 重新點擊行下載目錄路徑。
+    """
+    start_time = time.time()
+    while time.time() - start_time < timeout:
+        state = drain_network_events(driver)
+        captured = set()
+        for request_id in list(state['finished'] - state['consumed']):
+            response = state['responses'].get(request_id)
+            if not response or response['status'] != 200:
+                continue
+            owned_handles = getattr(driver, 'owned_handles', None)
+            if owned_handles is not None and response['webview'] not in owned_handles:
+                continue
+            file_name = get_disposition_filename(response['headers'])
+            if not file_name or not file_name.endswith(DOWNLOAD_EXTENSIONS) or file_name in initial_files:
+                continue
+            if prefixes and not any(file_name.startswith(p) for p in prefixes):
+                continue
+            state['consumed'].add(request_id)
+            try:
+                body = driver.execute_cdp_cmd('Network.getResponseBody', {'requestId': request_id})
+            except WebDriverException as e:
+                logging.warning(f"DevTools 攞唔到 {file_name} 嘅回應內容，本 session 改回下載目錄模式: {str(e)}")
+                disable_network_capture(driver)
+                return captured
+            data = base64.b64decode(body['body']) if body.get('base64Encoded') else body['body'].encode('utf-8')
+            if not data:
+                continue
+            temp_path = os.path.join(download_dir, file_name + '.part')
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, os.path.join(download_dir, file_name))
+            logging.info(f"DevTools 擷取匯出完成: {file_name} ({len(data)} bytes)")
+            captured.add(file_name)
+        if captured:
+            return captured
+        time.sleep(0.1)
+    logging.warning(f"DevTools 等待 {timeout} 秒後仍無匯出回應")
+    return set()
+
+def wait_for_download(driver, download_dir, initial_files, timeout=20, prefixes=None):
+    """
+    擷取模式下用 DevTools 攞匯出 bytes，否則等下載目錄出現新檔案。
+    擷取唔到（例如前端自己生成嘅 CSV）就關閉擷取模式，由 caller 重試行下載目錄路徑。
+    """
+    if get_capture_settings(driver)['capture']:
+        captured = capture_export_responses(driver, download_dir, initial_files, timeout, prefixes)
+        if not captured and get_capture_settings(driver)['capture']:
+            logging.warning("DevTools 擷取不到匯出，本 session 改回下載目錄模式")
+            disable_network_capture(driver)
+        return captured
+    return wait_for_new_file(download_dir, initial_files, timeout, prefixes)
+
+# ==================== 直接 HTTP 匯出（重用 Selenium 登入 session） ====================
+EXPORT_RECIPES_FILE = os.path.abspath("export_recipes.bin")  # Fernet 加密（同 session 快取共用 key），recipe 入面有 header
+LEGACY_EXPORT_RECIPES_FILE = os.path.abspath("export_recipes.json")
+RECIPE_DATE_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%Y/%m/%d', '%d-%m-%Y', '%Y%m%d']
+RECIPE_SKIP_HEADERS = {'cookie', 'content-length', 'host', 'connection', 'accept-encoding'}
+_recipes_lock = threading.Lock()
+
+def direct_export_requested():
+    """DIRECT_EXPORT=true 時先試直接 HTTP 匯出，失敗先行點擊路徑"""
+    return os.environ.get('DIRECT_EXPORT', 'False').lower() == 'true'
+
+def barge_api_requested():
+    """BARGE_API=true 時 Barge 先試純 HTTP 登入同下載，唔使開 Chrome"""
+    return os.environ.get('BARGE_API', 'False').lower() == 'true'
+
+def network_logging_requested():
+    """擷取模式、直接匯出或 Barge API 記錄都需要 performance log 記錄 Network 事件"""
+    return network_capture_requested() or direct_export_requested() or barge_api_requested()
+
+def load_export_recipes():
+    """解密 export_recipes.bin；冇檔、解密失敗（例如 key 換咗）當冇 recipe，下次點擊路徑會重新記錄"""
+    try:
+        with open(EXPORT_RECIPES_FILE, 'rb') as f:
+            return json.loads(get_session_cipher().decrypt(f.read()).decode('utf-8'))
+    except (OSError, ValueError, InvalidToken):
+        return {}
+    except Exception as e:
+        logging.warning(f"讀取直接匯出 recipe 失敗: {str(e)}")
+        return {}
+
+def save_export_recipe(site, section, recipe, report_name=None):
+    """加密寫入 export_recipes.bin，house 報告按報告名稱分開儲存；舊版明文 export_recipes.json 會刪走"""
+    with _recipes_lock:
+        recipes = load_export_recipes()
+        site_recipes = recipes.setdefault(site, {})
+        if report_name is None:
+            site_recipes[section] = recipe
+        else:
+            site_recipes.setdefault(section, {})[report_name] = recipe
+        with open(EXPORT_RECIPES_FILE + '.tmp', 'wb') as f:
+            f.write(get_session_cipher().encrypt(json.dumps(recipes, ensure_ascii=False).encode('utf-8')))
+        os.replace(EXPORT_RECIPES_FILE + '.tmp', EXPORT_RECIPES_FILE)
+        if os.path.exists(LEGACY_EXPORT_RECIPES_FILE):
+            os.remove(LEGACY_EXPORT_RECIPES_FILE)
+
+def templatize_dates(text, now=None):
+    """將最近 7 日嘅日期字串換成 {{date:-N:FMT}} 佔位符，重播時填返當日日期"""
+    if not text:
+        return text
+    now = now or datetime.now()
+    for days_ago in range(7):
+        day = now - timedelta(days=days_ago)
+        for fmt in RECIPE_DATE_FORMATS:
+            text = text.replace(day.strftime(fmt), f"{{{{date:-{days_ago}:{fmt}}}}}")
+    return text
+
+def render_dates(text, now=None):
+    """templatize_dates 嘅反向：佔位符填返今日為基準嘅日期"""
+    if not text:
+        return text
+    now = now or datetime.now()
+    return re.sub(r'\{\{date:-(\d+):([^}]+)\}\}', lambda m: (now - timedelta(days=int(m.group(1)))).strftime(m.group(2)), text)
+
+def read_browser_storage(driver):
+    """讀出 localStorage 同 sessionStorage，key 加 local:/session: 前綴"""
+    return driver.execute_script("""
+        var out = {};
+        [['local:', window.localStorage], ['session:', window.sessionStorage]].forEach(function(pair) {
+            for (var i = 0; i < pair[1].length; i++) {
+                var key = pair[1].key(i);
+                out[pair[0] + key] = pair[1].getItem(key);
+            }
+        });
+        return out;
+    """) or {}
+
+def snapshot_browser_session(driver):
+    """一次過攞 cookies、storage 同 user agent，俾其他 thread 用（WebDriver 本身唔係 thread-safe）"""
+    return {
+        'cookies': {c['name']: c['value'] for c in driver.get_cookies()},
+        'storage': read_browser_storage(driver),
+        'user_agent': driver.execute_script("return navigator.userAgent;")
+    }
+
+def find_export_request(state, file_names):
+    """喺已記錄 Network 事件入面搵產生指定檔案嘅 request id"""
+    fallback = None
+    for request_id, response in state['responses'].items():
+        if request_id not in state['requests'] or response['status'] != 200:
+            continue
+        file_name = get_disposition_filename(response['headers'])
+        if file_name and file_name in file_names:
+            return request_id, file_name
+        if not file_name and response['mimeType'] in EXPORT_MIME_TYPES:
+            fallback = (request_id, None)
+    return fallback or (None, None)
+
+def build_export_recipe(driver, request, file_name):
+    """
+    將一個已記錄嘅 request 轉成 recipe：日期變佔位符、記低 token 喺 storage 嘅位置同由 cookie 帶出嘅 header。
+    Authorization token 喺 storage 搵唔到就回傳 None（唔會將 token 原文寫入 recipe）。
+    """
+    session = snapshot_browser_session(driver)
+    headers = {}
+    cookie_headers = {}
+    auth = None
+    for name, value in request['headers'].items():
+        if name.lower() in RECIPE_SKIP_HEADERS:
+            continue
+        if name.lower() == 'authorization':
+            for key, stored in session['storage'].items():
+                if stored and value.endswith(stored):
+                    auth = {'header': name, 'storage_key': key, 'prefix': value[:len(value) - len(stored)]}
+                    break
+            if not auth:
+                return None
+            continue
+        cookie_name = next((c for c, v in session['cookies'].items() if v and v == value), None)
+        if cookie_name:
+            cookie_headers[name] = cookie_name
+            continue
+        headers[name] = value
+    return {
+        'method': request['method'],
+        'url': templatize_dates(request['url']),
+        'headers': headers,
+        'cookie_headers': cookie_headers,
+        'auth': auth,
+        'body': templatize_dates(request['postData']),
+        'file_name': templatize_dates(file_name),
+        'recorded_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+def record_export_recipe(driver, site, section, file_names, report_name=None):
+    """點擊下載成功後，由 Network 事件抽出匯出 request 存做 recipe，下次直接重播"""
+    try:
+        state = drain_network_events(driver)
+        request_id, disposition_name = find_export_request(state, set(file_names))
+        if not request_id:
+            logging.debug(f"{site} {section}: 搵唔到匯出 request（可能係前端生成），唔記錄直接匯出")
+            return
+        request = state['requests'][request_id]
+        recipe = build_export_recipe(driver, request, disposition_name or sorted(file_names)[0])
+        if not recipe:
+            logging.info(f"{site} {section}: Authorization token 唔喺 storage，唔記錄直接匯出")
+            return
+        save_export_recipe(site, section, recipe, report_name)
+        logging.info(f"{site} {section}: 已記錄直接匯出 request {request['method']} {request['url']}")
+    except Exception as e:
+        logging.warning(f"{site} {section}: 記錄直接匯出 request 失敗: {str(e)}")
+
+def build_recipe_headers(recipe, session):
+    """按 recipe 同當前 session 組合 headers（cookie、token、cookie 帶出嘅 header）"""
+    headers = dict(recipe['headers'])
+    headers['User-Agent'] = session['user_agent']
+    headers['Cookie'] = '; '.join(f"{k}={v}" for k, v in session['cookies'].items())
+    for header, cookie_name in recipe.get('cookie_headers', {}).items():
+        if cookie_name in session['cookies']:
+            headers[header] = session['cookies'][cookie_name]
+    auth = recipe.get('auth')
+    if auth:
+        token = session['storage'].get(auth.get('storage_key'))
+        if token:
+            headers[auth['header']] = auth['prefix'] + token
+    return headers
+
+def run_export_recipe(http_pool, recipe, session, download_dir):
+    """
+    重播一個匯出 request，成功就寫檔並回傳檔名；HTML 回應（通常係登入頁）或非 200 當失敗。
+    """
+    body = render_dates(recipe.get('body'))
+    response = http_pool.request(
+        recipe['method'], render_dates(recipe['url']),
+        body=body.encode('utf-8') if body else None,
+        headers=build_recipe_headers(recipe, session),
+        timeout=urllib3.Timeout(connect=10, read=120),
+        retries=False
+    )
+    content_type = response.headers.get('Content-Type', '')
+    if response.status != 200 or not response.data or 'text/html' in content_type:
+        raise Exception(f"直接匯出回應異常: HTTP {response.status}, {content_type}, {len(response.data)} bytes")
+    file_name = get_disposition_filename({k.lower(): v for k, v in response.headers.items()}) or render_dates(recipe['file_name'])
+    temp_path = os.path.join(download_dir, file_name + '.part')
+    with open(temp_path, 'wb') as f:
+        f.write(response.data)
+    os.replace(temp_path, os.path.join(download_dir, file_name))
+    logging.info(f"直接匯出完成: {file_name} ({len(response.data)} bytes)")
+    return file_name
+
+def run_cplus_direct_exports(driver, download_dir, manifest=None):
+    """
+    用已記錄嘅 CPLUS recipes 並行直接匯出 movement/onhand/house（清單已完成嘅跳過）。
+    回傳 {'movement': set, 'onhand': set, 'house': {報告名稱: {'file', 'mod_time'}}, 'house_button_count': int, 'house_complete': bool}，
+    失敗嘅 section 唔會出現。house 先讀今日真實表格（按鈕數同報告名稱），有 recipe 嘅報告直接匯出，
+    'house' 只包含成功嗰啲；冇 recipe 或者失敗嘅由 caller 用點擊路徑補返。
+    """
+    recipes = load_export_recipes().get('cplus', {})
+    if not recipes:
+        logging.info("CPLUS: 未有直接匯出 recipe，今次行點擊路徑並記錄")
+        return {}
+    session = snapshot_browser_session(driver)
+    http_pool = urllib3.PoolManager(num_pools=2, maxsize=8)
+    jobs = []
+    done_reports = manifest.house_done() if manifest else set()
+    for section in ('movement', 'onhand'):
+        if section in recipes and not (manifest and manifest.has(section)):
+            jobs.append((section, None, recipes[section]))
+    house_recipes = recipes.get('house', {})
+    house_names = None
+    if house_recipes and not (manifest and manifest.house_complete()):
+        # 按鈕數同報告名稱要由今日表格攞，唔可以信 recipe 數或者之前記錄嘅表格
+        house_names = read_house_table(driver)
+        if house_names is None:
+            logging.info("CPLUS house: 讀唔到今日表格，按鈕數未知，成個 section 行點擊路徑")
+        else:
+            missing = [name for name in house_names if name not in house_recipes and name not in done_reports]
+            if missing:
+                logging.info(f"CPLUS house: 今日表格 {len(house_names)} 份報告入面 {len(missing)} 份未有 recipe，之後用點擊路徑補: {missing}")
+            for report_name in house_names:
+                if report_name in house_recipes and report_name not in done_reports:
+                    jobs.append(('house', report_name, house_recipes[report_name]))
+    results = {}
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=8, thread_name_prefix='export') as executor:
+        futures = {executor.submit(run_export_recipe, http_pool, recipe, session, download_dir): (section, report_name) for section, report_name, recipe in jobs}
+        for future, (section, report_name) in futures.items():
+            try:
+                file_name = future.result()
+            except Exception as e:
+                logging.warning(f"CPLUS {section} {report_name or ''}: 直接匯出失敗，之後用點擊路徑: {str(e)}")
+                continue
+            if section == 'house':
+                mod_time = os.path.getmtime(os.path.join(download_dir, file_name))
+                results.setdefault('house', {})[report_name] = {'file': file_name, 'mod_time': mod_time}
+            else:
+                results[section] = {file_name}
+    http_pool.clear()
+    # house：成功嘅報告照用，全部報告（連清單已完成）都齊先當 section 完成
+    if house_names is not None:
+        exported = set(results.get('house', {}))
+        results['house_button_count'] = len(house_names)
+        results['house_complete'] = all(name in exported or name in done_reports for name in house_names)
+    logging.info(f"CPLUS: 直接匯出完成 {sorted(results)}，用時 {time.time() - start_time:.1f} 秒")
+    return results
+
+def read_house_table(driver):
+    """開 Housekeeping 頁面 snapshot 一次，回傳今日表格嘅報告名稱（同 process_cplus_house 一樣嘅後備名稱）；讀唔到回傳 None"""
+    try:
+        navigate(driver, "https://cplus.hit.com.hk/app/#/report/housekeepReport")
+        snapshot = take_house_snapshot(driver, min_rows=6, timeout=30)
+    except Exception as e:
+        logging.warning(f"CPLUS house: 讀取今日表格失敗: {str(e)}")
+        return None
+    if not snapshot['buttons']:
+        return None
+    return [button['name'] or f"Unknown Report {i+1}" for i, button in enumerate(snapshot['buttons'])]
+
 # 完整 sub code: 修改 handle_popup 函數，加記錄彈出內容（替換原 handle_popup）
-def handle_popup(driver, wait):
+POPUP_XPATH = "//div[contains(text(), 'System Error') or contains(@class, 'MuiDialog-container') or contains(@class, 'MuiDialog') and not(@aria-label='menu')]"
+POPUP_WATCHER_JS = """
+var xpath = arguments[0];
+var w = window.__hitPopupWatcher;
+if (!w) {
+    w = window.__hitPopupWatcher = {open: false, seen: 0, text: '', pending: false};
+    var scan = function () {
+        w.pending = false;
+        var el = document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+        var open = !!(el && el.isConnected);
+        if (open && !w.open) { w.seen += 1; w.text = (el.innerText || '').slice(0, 500); }
+        w.open = open;
+    };
+    new MutationObserver(function () {
+        if (!w.pending) { w.pending = true; setTimeout(scan, 50); }
+    }).observe(document.documentElement, {childList: true, subtree: true, attributes: true, attributeFilter: ['class', 'style']});
+    scan();
+}
+return {open: w.open, seen: w.seen, text: w.text};
+"""
+
+def read_popup_state(driver):
+    """讀 MutationObserver 記錄嘅彈出視窗狀態（每頁第一次叫會自動注入 watcher），即時返回唔使等"""
     try:
-        popup = WebDriverWait(driver, 3).until(
-            EC.presence_of_element_located((By.XPATH, "//div[contains(text(), 'System Error') or contains(@class, 'MuiDialog-container') or contains(@class, 'MuiDialog') and not(@aria-label='menu')]"))
-        )
-        popup_text = popup.text  # 記錄彈出內容
-        logging.info(f"檢測到彈出視窗，內容: {popup_text}")
+        return driver.execute_script(POPUP_WATCHER_JS, POPUP_XPATH) or {}
+    except Exception as e:
+        logging.debug(f"讀取彈出視窗狀態失敗: {str(e)}")
+        return {}
+
+POPUP_SETTLE_SECONDS = 1.0  # 點擊後等彈出視窗出現嘅上限（watcher 有約 50ms debounce）
+
+def handle_popup(driver, wait, settle=0.0, download_started=None):
+    """
+    有彈出視窗就關閉。settle > 0 時（啱啱點擊完）最多等 settle 秒：彈出視窗出現、
+    watcher 嘅 seen 有變或者 download_started() 成立先決定，唔會因為 debounce 未 scan 就當冇彈窗。
+    """
+    state = read_popup_state(driver)
+    seen = state.get('seen', 0)
+    deadline = time.time() + settle
+    while not state.get('open') and time.time() < deadline:
+        if download_started and download_started():
+            break
+        time.sleep(0.1)
+        state = read_popup_state(driver)
+        if state.get('seen', 0) != seen:
+            break
+    if not state.get('open'):
+        logging.debug("無彈出視窗檢測到")
+        return
+    try:
+        logging.info(f"檢測到彈出視窗，內容: {state.get('text', '')}")
         close_button = wait.until(
             EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Close') or contains(text(), 'OK') or contains(text(), 'Cancel') or contains(@class, 'MuiButton') and not(@aria-label='menu')]"))
         )
-        wait.until(EC.visibility_of(close_button))
         driver.execute_script("arguments[0].scrollIntoView(true);", close_button)
-        time.sleep(0.5)
         close_button.click()
         logging.info("已點擊關閉按鈕")
         WebDriverWait(driver, 3).until(
@@ -149,7 +1209,7 @@ def handle_popup(driver, wait):
         )
         logging.info("彈出視窗已消失")
     except TimeoutException:
-        logging.debug("無彈出視窗檢測到")
+        logging.warning("彈出視窗未能喺時限內關閉")
     except ElementClickInterceptedException as e:
         logging.warning(f"關閉彈出視窗失敗: {str(e)}")
         driver.save_screenshot("popup_close_failure.png")
@@ -158,87 +1218,384 @@ def handle_popup(driver, wait):
     except Exception as e:
         logging.error(f"處理彈出視窗意外錯誤: {str(e)}")
 
-def get_cplus_2fa_code_from_zoho(max_wait=60):
+CPLUS_2FA_SENDER = "paklun@XXXXXX.com.hk"
+CPLUS_2FA_PATTERN = re.compile(r'Cplus - (\d{6}) is your verification code')
+
+class Cplus2FAListener:
     """
-    從 Zoho Mail 讀取最新 Cplus 2FA code（只讀 Subject）
+    持久 Zoho IMAP 連線：LOGIN 前記低 INBOX 最高 UID，之後用 IDLE（唔支援就 UID SEARCH 輪詢）等新郵件，
+    只 FETCH Subject header，UID 唔大過基線嘅舊 code 一律唔用。
     """
-    load_dotenv()
-    zoho_email = os.environ.get('ZOHO_EMAIL')
-    zoho_password = os.environ.get('ZOHO_PASSWORD')  # 建議用 App Password
-    
-    if not zoho_email or not zoho_password:
-        logging.error("缺少 ZOHO_EMAIL 或 ZOHO_PASSWORD")
+    def __init__(self):
+        self.mail = None
+        self.baseline_uid = 0
+        self.idle_supported = False
+
+    def connect(self):
+        load_dotenv()
+        zoho_email = os.environ.get('ZOHO_EMAIL')
+        zoho_password = os.environ.get('ZOHO_PASSWORD')  # 建議用 App Password
+        if not zoho_email or not zoho_password:
+            raise Exception("缺少 ZOHO_EMAIL 或 ZOHO_PASSWORD")
+        self.mail = imaplib.IMAP4_SSL("imap.zoho.com", 993)
+        self.mail.login(zoho_email, zoho_password)
+        self.mail.select("INBOX")
+        self.idle_supported = 'IDLE' in self.mail.capabilities
+
+    def mark_baseline(self):
+        """記低而家 INBOX 最高 UID（UIDNEXT - 1），之後只接受更新嘅郵件"""
+        status, data = self.mail.status("INBOX", "(UIDNEXT)")
+        match = re.search(rb'UIDNEXT (\d+)', data[0]) if status == "OK" else None
+        self.baseline_uid = int(match.group(1)) - 1 if match else 0
+        logging.info(f"2FA: IMAP 基線 UID = {self.baseline_uid} (IDLE {'支援' if self.idle_supported else '不支援'})")
+
+    def start(self):
+        self.connect()
+        self.mark_baseline()
+        return self
+
+    def fetch_new_code(self):
+        """UID SEARCH 基線之後嘅 HIT 郵件，由新到舊只讀 Subject 搵 code"""
+        status, data = self.mail.uid('SEARCH', None, f'UID {self.baseline_uid + 1}:*', f'FROM "{CPLUS_2FA_SENDER}"')
+        if status != "OK" or not data[0]:
+            return None
+        # UID n:* 喺無新郵件時都會返最後一封，要再過濾
+        uids = sorted((int(u) for u in data[0].split() if int(u) > self.baseline_uid), reverse=True)
+        for uid in uids:
+            status, msg_data = self.mail.uid('FETCH', str(uid), '(BODY.PEEK[HEADER.FIELDS (SUBJECT)])')
+            for part in msg_data:
+                if not isinstance(part, tuple):
+                    continue
+                msg = email.message_from_bytes(part[1])
+                subject = str(make_header(decode_header(msg["Subject"]))) if msg["Subject"] else ""
+                match = CPLUS_2FA_PATTERN.search(subject)
+                if match:
+                    return match.group(1)
         return None
 
-    start_time = time.time()
-    while time.time() - start_time < max_wait:
+    def line_ready(self):
+        """
+        imaplib 經 self.mail.file（BufferedReader）讀，跟 "+ idling" 一齊到嘅 EXISTS 可能已經喺 buffer，
+        select socket 會睇唔到；暫時轉 non-blocking peek 一下（buffer 空就順手試讀 socket）。
+        """
+        sock = self.mail.sock
+        previous = sock.gettimeout()
         try:
-            mail = imaplib.IMAP4_SSL("imap.zoho.com", 993)
-            mail.login(zoho_email, zoho_password)
-            mail.select("inbox")
-
-            # 搜尋 HIT 寄件人
-            status, messages = mail.search(None, 'FROM "paklun@XXXXXX.com.hk"')
-            if status == "OK" and messages[0]:
-                email_ids = messages[0].split()
-                latest_id = email_ids[-1]
-
-                status, msg_data = mail.fetch(latest_id, "(RFC822)")
-                raw_email = msg_data[0][1]
-                msg = email.message_from_bytes(raw_email)
-
-                subject = ""
-                if msg["Subject"]:
-                    subject, encoding = decode_header(msg["Subject"])[0]
-                    if isinstance(subject, bytes):
-                        subject = subject.decode(encoding or "utf-8")
-
-                # 提取 code
-                match = re.search(r'Cplus - (\d{6}) is your verification code', subject)
-                if match:
-                    code = match.group(1)
-                    logging.info(f"✅ 成功讀取 2FA Code: {code}")
-                    mail.logout()
+            sock.settimeout(0.0)
+            return bool(self.mail.file.peek(1))
+        except (OSError, ValueError):
+            return False
+        finally:
+            sock.settimeout(previous)
+
+    def idle(self, timeout):
+        """IDLE 等伺服器推送 EXISTS，收到回傳 True，超時回傳 False"""
+        tag = self.mail._new_tag()
+        self.mail.send(tag + b' IDLE\r\n')
+        # "+ idling" 之前伺服器可能先送 untagged 回應（例如 SEARCH 同 IDLE 之間到咗嘅 "* N EXISTS"）
+        got_mail = False
+        while True:
+            line = self.mail.readline()
+            if line.startswith(b'+'):
+                break
+            if not line or line.startswith(tag):
+                raise imaplib.IMAP4.abort(f"IMAP IDLE 未被接受: {line!r}")
+            got_mail = got_mail or b'EXISTS' in line
+        deadline = time.time() + timeout
+        try:
+            while not got_mail and time.time() < deadline:
+                # buffer / SSL 層已有資料就唔使 select
+                if not self.line_ready():
+                    readable, _, _ = select.select([self.mail.sock], [], [], max(0, deadline - time.time()))
+                    if not readable:
+                        break
+                line = self.mail.readline()
+                if not line or b'EXISTS' in line:
+                    got_mail = bool(line)
+                    break
+        finally:
+            self.mail.send(b'DONE\r\n')
+            while True:
+                line = self.mail.readline()
+                if not line or line.startswith(tag):
+                    break
+        return got_mail
+
+    def wait_for_code(self, max_wait=90):
+        start_time = time.time()
+        reconnects = 0
+        while time.time() - start_time < max_wait:
+            try:
+                code = self.fetch_new_code()
+                if code:
+                    logging.info(f"✅ 成功讀取 2FA Code: {code}，用時 {time.time() - start_time:.1f} 秒")
                     return code
+                remaining = max_wait - (time.time() - start_time)
+                if self.idle_supported:
+                    self.idle(min(remaining, 60))
+                else:
+                    time.sleep(min(1, max(0, remaining)))
+            except (imaplib.IMAP4.abort, OSError) as e:
+                # 連線斷咗先重連一次，基線 UID 保持不變
+                if reconnects >= 1:
+                    logging.error(f"2FA: IMAP 連線再次中斷: {e}")
+                    break
+                reconnects += 1
+                logging.warning(f"2FA: IMAP 連線中斷，重新連線: {e}")
+                self.connect()
+        logging.error("等待 2FA email 超時")
+        return None
 
-            mail.logout()
+    def close(self):
+        try:
+            if self.mail:
+                self.mail.logout()
         except Exception as e:
-            logging.warning(f"讀取 Zoho Mail 失敗: {e}")
+            logging.debug(f"2FA: IMAP 登出失敗: {e}")
+        self.mail = None
 
-        time.sleep(3)  # 每 3 秒 check 一次
+def get_cplus_2fa_code_from_zoho(max_wait=60, listener=None):
+    """
+    從 Zoho Mail 讀取最新 Cplus 2FA code（只讀 Subject）。
+    應喺點擊 LOGIN 前開好 listener 傳入，咁基線之前嘅舊 code 唔會被用。
+    """
+    own_listener = listener is None
+    try:
+        if own_listener:
+            listener = Cplus2FAListener().start()
+        return listener.wait_for_code(max_wait)
+    except Exception as e:
+        logging.warning(f"讀取 Zoho Mail 失敗: {e}")
+        return None
+    finally:
+        if listener:
+            listener.close()
 
-    logging.error("等待 2FA email 超時")
-    return None
+# ==================== 加密 Session 快取（跳過登入同 2FA） ====================
+SESSION_CACHE_DIR = os.path.abspath(".session_cache")
+CPLUS_HOME_URL = "https://cplus.hit.com.hk/frontpage/#/"
+BARGE_LOGIN_URL = "https://barge.oneport.com/login"
+
+def session_cache_enabled():
+    """SESSION_CACHE=true 時將登入後 cookies/storage 加密存檔，下次先試還原"""
+    return os.environ.get('SESSION_CACHE', 'False').lower() == 'true'
+
+def get_session_cipher():
+    """優先用 SESSION_CACHE_KEY（Fernet key），否則由登入密碼 PBKDF2 推導"""
+    key = os.environ.get('SESSION_CACHE_KEY')
+    if key:
+        return Fernet(key.encode('utf-8'))
+    secret = (os.environ.get('SITE_PASSWORD', '') + os.environ.get('BARGE_PASSWORD', '') + os.environ.get('ZOHO_PASSWORD', '')).encode('utf-8')
+    if not secret:
+        raise Exception("缺少 SESSION_CACHE_KEY 同登入密碼，無法加密 session")
+    derived = hashlib.pbkdf2_hmac('sha256', secret, b'hitdaily-session-cache', 200000)
+    return Fernet(base64.urlsafe_b64encode(derived))
+
+def save_browser_session(driver, site):
+    """加密儲存當前頁面 domain 嘅 cookies 同 localStorage/sessionStorage"""
+    try:
+        data = {
+            'cookies': driver.get_cookies(),
+            'storage': read_browser_storage(driver),
+            'saved_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+        os.makedirs(SESSION_CACHE_DIR, exist_ok=True)
+        path = os.path.join(SESSION_CACHE_DIR, f"{site}.bin")
+        with open(path + '.tmp', 'wb') as f:
+            f.write(get_session_cipher().encrypt(json.dumps(data).encode('utf-8')))
+        os.replace(path + '.tmp', path)
+        logging.info(f"{site}: Session 已加密儲存 ({len(data['cookies'])} cookies, {len(data['storage'])} storage)")
+    except Exception as e:
+        logging.warning(f"{site}: 儲存 session 失敗: {str(e)}")
+
+def restore_browser_session(driver, site, origin_url, probe):
+    """
+    解密 session 快取，先開 origin 頁面設定 cookies/storage，再用 probe 檢查係咪仍然登入。
+    成功回傳 True；無快取、過期或解密失敗回傳 False，由 caller 行完整登入。
+    """
+    path = os.path.join(SESSION_CACHE_DIR, f"{site}.bin")
+    if not os.path.exists(path):
+        logging.info(f"{site}: 無 session 快取，需要完整登入")
+        return False
+    try:
+        with open(path, 'rb') as f:
+            data = json.loads(get_session_cipher().decrypt(f.read()).decode('utf-8'))
+    except (InvalidToken, ValueError, OSError) as e:
+        logging.warning(f"{site}: Session 快取無法解密，需要完整登入: {str(e)}")
+        return False
+    start_time = time.time()
+    navigate(driver, origin_url)
+    now = time.time()
+    for cookie in data['cookies']:
+        if cookie.get('expiry') and cookie['expiry'] < now:
+            continue
+        cookie = {k: v for k, v in cookie.items() if k in ('name', 'value', 'path', 'domain', 'secure', 'httpOnly', 'expiry', 'sameSite')}
+        try:
+            driver.add_cookie(cookie)
+        except Exception as e:
+            logging.debug(f"{site}: 還原 cookie {cookie.get('name')} 失敗: {str(e)}")
+    driver.execute_script("""
+        var items = arguments[0];
+        Object.keys(items).forEach(function(key) {
+            var store = key.indexOf('local:') === 0 ? window.localStorage : window.sessionStorage;
+            store.setItem(key.substring(key.indexOf(':') + 1), items[key]);
+        });
+    """, data['storage'])
+    if probe(driver):
+        logging.info(f"✅ {site}: Session 快取有效（儲存於 {data['saved_at']}），跳過登入，用時 {time.time() - start_time:.1f} 秒")
+        return True
+    logging.info(f"{site}: Session 快取已過期，需要完整登入")
+    return False
+
+def probe_cplus_session(driver):
+    """開 Container Movement Log，表單出現即代表 session 有效"""
+    navigate(driver, "https://cplus.hit.com.hk/app/#/enquiry/ContainerMovementLog")
+    try:
+        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.XPATH, "//*[@id='root']/div/div[2]//form")))
+        return True
+    except TimeoutException:
+        return False
+
+def probe_barge_session(driver):
+    """開 downloadReport，無跳轉去登入頁且 Report Type 出現即代表 session 有效"""
+    navigate(driver, "https://barge.oneport.com/downloadReport")
+    try:
+        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.XPATH, "//mat-form-field[.//mat-label[contains(text(), 'Report Type')]]")))
+        return 'login' not in driver.current_url
+    except TimeoutException:
+        return False
+
+# ==================== Locator 競速解析（單一 JS poll，按歷史勝出次數排序） ====================
+LOCATOR_STATS_FILE = os.path.abspath("locator_stats.json")
+_locator_stats_lock = threading.Lock()
+RACE_LOCATORS_JS = """
+var locators = arguments[0], clickable = arguments[1], timeoutMs = arguments[2];
+var done = arguments[arguments.length - 1];
+function find(loc) {
+    var el = loc[0] === 'xpath'
+        ? document.evaluate(loc[1], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue
+        : document.querySelector(loc[1]);
+    if (el && clickable) {
+        var rect = el.getBoundingClientRect(), style = window.getComputedStyle(el);
+        var button = el.closest('button') || el;
+        if (!rect.width || !rect.height || style.visibility === 'hidden' || button.disabled) {
+            return null;
+        }
+    }
+    return el;
+}
+var start = Date.now();
+(function poll() {
+    for (var i = 0; i < locators.length; i++) {
+        var el = null;
+        try { el = find(locators[i]); } catch (e) { el = null; }
+        if (el) { done([i, el]); return; }
+    }
+    if (Date.now() - start >= timeoutMs) { done(null); return; }
+    setTimeout(poll, 100);
+})();
+"""
+
+POOL_ASYNC_SLICE = 1.0  # 共用 Chrome 時每次 async poll script 最長幾秒，段與段之間放返 pool 鎖
+
+def run_polling_script(driver, script, args, timeout, satisfied):
+    """
+    行一個自己 poll 到 timeoutMs（最後一個參數）嘅 async script。共用 Chrome 時 pool 鎖（同 ChromeDriver 本身）
+    會鎖住成個指令，所以拆成每段 POOL_ASYNC_SLICE 秒，satisfied(result) 成立或者總時間到先停，
+    段與段之間另一個 site 嘅 thread 可以用 Chrome。
+    """
+    if getattr(driver, 'pool', None) is None:
+        driver.set_script_timeout(max(30, timeout + 10))
+        return driver.execute_async_script(script, *args, int(timeout * 1000))
+    deadline = time.time() + timeout
+    driver.set_script_timeout(POOL_ASYNC_SLICE + 10)
+    while True:
+        slice_seconds = max(0.0, min(POOL_ASYNC_SLICE, deadline - time.time()))
+        result = driver.execute_async_script(script, *args, int(slice_seconds * 1000))
+        if satisfied(result) or time.time() >= deadline:
+            return result
+
+def load_locator_stats():
+    try:
+        with open(LOCATOR_STATS_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def record_locator_win(step, locator):
+    """記錄某步驟邊個 locator 勝出，下次排先"""
+    with _locator_stats_lock:
+        stats = load_locator_stats()
+        key = f"{locator[0]}={locator[1]}"
+        stats.setdefault(step, {})[key] = stats.get(step, {}).get(key, 0) + 1
+        try:
+            # 先寫 tmp 再 os.replace，中途斷咗都唔會留低半份 JSON
+            tmp_path = LOCATOR_STATS_FILE + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(stats, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, LOCATOR_STATS_FILE)
+        except OSError as e:
+            logging.debug(f"儲存 locator 統計失敗: {str(e)}")
+
+def resolve_locator(driver, step, locators, timeout=10, clickable=False):
+    """
+    喺一個 execute_async_script 入面每 100ms 同時試晒所有候選 locator（支援 XPATH/CSS），邊個先出現就用邊個；
+    同一輪多個命中時按歷史勝出次數排先。回傳 (element, locator)，全部超時 raise TimeoutException。
+    """
+    step_stats = load_locator_stats().get(step, {})
+    ordered = sorted(locators, key=lambda loc: -step_stats.get(f"{loc[0]}={loc[1]}", 0))
+    result = run_polling_script(driver, RACE_LOCATORS_JS, ([list(loc) for loc in ordered], clickable), timeout, bool)
+    if not result:
+        raise TimeoutException(f"{step}: {len(locators)} 個 locator 喺 {timeout} 秒內都搵唔到")
+    index, element = result
+    record_locator_win(step, ordered[index])
+    logging.debug(f"{step}: 使用 locator {ordered[index]}")
+    return element, ordered[index]
 
 def cplus_login(driver, wait):
     logging.info("CPLUS: 嘗試打開網站 https://cplus.hit.com.hk/frontpage/#/")
-    driver.get("https://cplus.hit.com.hk/frontpage/#/")
-    time.sleep(2)
+    navigate(driver, "https://cplus.hit.com.hk/frontpage/#/")
 
     # 點擊登入前按鈕
     login_button_pre = wait.until(EC.element_to_be_clickable(
         (By.XPATH, "//*[@id='root']/div/div[1]/header/div/div[4]/button/span[1]")))
     ActionChains(driver).move_to_element(login_button_pre).click().perform()
     logging.info("CPLUS: 登錄前按鈕點擊成功")
-    time.sleep(2)
 
-    # 輸入 COMPANY CODE
-    company_code_field = wait.until(EC.presence_of_element_located((By.XPATH, "//*[@id='companyCode']")))
+    # 輸入 COMPANY CODE（等登入表單出現）
+    company_code_field = pacer.until(driver, EC.presence_of_element_located((By.XPATH, "//*[@id='companyCode']")), 10, 'cplus_login_form')
     company_code_field.send_keys("CKL")
     logging.info("CPLUS: COMPANY CODE 輸入完成")
-    time.sleep(1)
+    pacer.pause('cplus_typing', 0.3, 0.4)
 
     # 輸入 USER ID
     user_id_field = driver.find_element(By.XPATH, "//*[@id='userId']")
     user_id_field.send_keys("KEN")
     logging.info("CPLUS: USER ID 輸入完成")
-    time.sleep(1)
+    pacer.pause('cplus_typing', 0.3, 0.4)
 
     # 輸入 PASSWORD
     password_field = driver.find_element(By.XPATH, "//*[@id='passwd']")
     password_field.send_keys(os.environ.get('SITE_PASSWORD'))
     logging.info("CPLUS: PASSWORD 輸入完成")
-    time.sleep(1)
+    pacer.pause('cplus_typing', 0.3, 0.4)
+
+    # 點擊 LOGIN 前先開好 IMAP 連線同記低基線 UID，之前嘅舊 code 唔會被用
+    listener = take_warm_imap_listener()
+    try:
+        if listener:
+            listener.mark_baseline()
+        else:
+            listener = Cplus2FAListener().start()
+    except Exception as e:
+        logging.warning(f"CPLUS: 2FA IMAP 預先連線失敗，點擊前重新連線: {e}")
+        if listener:
+            listener.close()
+        listener = None
+        try:
+            listener = Cplus2FAListener().start()
+        except Exception as e:
+            logging.warning(f"CPLUS: 2FA IMAP 重新連線都失敗，點擊後再試: {e}")
 
     # 點擊 LOGIN 按鈕
     login_button = driver.find_element(By.XPATH, "//*[@id='root']/div/div[1]/header/div/div[4]/div[2]/div/div/form/button/span[1]")
@@ -246,7 +1603,7 @@ def cplus_login(driver, wait):
     logging.info("CPLUS: 已點擊 LOGIN，等待 2FA email...")
 
     # ==================== 新增 2FA 處理 ====================
-    code = get_cplus_2fa_code_from_zoho(max_wait=90)
+    code = get_cplus_2fa_code_from_zoho(max_wait=90, listener=listener)
     if not code:
         driver.save_screenshot("2fa_code_not_found.png")
         raise Exception("CPLUS: 無法讀取 2FA Code")
@@ -261,13 +1618,10 @@ def cplus_login(driver, wait):
         (By.XPATH, "//input[contains(@class, 'MuiInputBase-input') and string-length(@value) <= 6]")
     ]
 
-    for locator in code_locators:
-        try:
-            code_input = WebDriverWait(driver, 8).until(EC.presence_of_element_located(locator))
-            if code_input:
-                break
-        except:
-            continue
+    try:
+        code_input, _ = resolve_locator(driver, 'cplus_2fa_input', code_locators, timeout=8)
+    except TimeoutException:
+        code_input = None
 
     if not code_input:
         driver.save_screenshot("2fa_input_field_not_found.png")
@@ -278,8 +1632,7 @@ def cplus_login(driver, wait):
     code_input.clear()
     code_input.send_keys(code)
     logging.info("CPLUS: 2FA Code 已輸入")
-
-    time.sleep(1)
+    pacer.pause('cplus_typing', 0.3, 0.4)
 
     # 點擊 Verify / Submit 按鈕
     verify_button = None
@@ -289,13 +1642,10 @@ def cplus_login(driver, wait):
         (By.CSS_SELECTOR, "button.MuiButton-containedPrimary")
     ]
 
-    for locator in verify_locators:
-        try:
-            verify_button = WebDriverWait(driver, 6).until(EC.element_to_be_clickable(locator))
-            if verify_button:
-                break
-        except:
-            continue
+    try:
+        verify_button, _ = resolve_locator(driver, 'cplus_2fa_verify', verify_locators, timeout=6, clickable=True)
+    except TimeoutException:
+        verify_button = None
 
     if verify_button:
         try:
@@ -308,122 +1658,114 @@ def cplus_login(driver, wait):
         logging.warning("CPLUS: 搵唔到 Verify 按鈕，嘗試直接按 Enter")
         code_input.send_keys(Keys.ENTER)
 
-    time.sleep(4)
+    # 等 2FA 輸入框消失（驗證完成跳頁），唔再固定等 4 秒
+    try:
+        pacer.until(driver, EC.invisibility_of_element(code_input), 15, 'cplus_2fa_submit')
+    except TimeoutException:
+        logging.warning("CPLUS: 2FA 輸入框 15 秒後仍然存在，繼續檢查登入狀態")
 
     # 檢查登入是否成功
     try:
         wait.until(EC.presence_of_element_located((By.XPATH, "//*[@id='root']/div/div[1]/header/div/div[4]/button/span[1]")))
         logging.info("✅ CPLUS: 登入成功（已通過 2FA）")
+        if session_cache_enabled():
+            save_browser_session(driver, 'cplus')
     except TimeoutException:
         driver.save_screenshot("login_after_2fa_failed.png")
         with open("login_after_2fa_failed.html", "w", encoding="utf-8") as f:
             f.write(driver.page_source)
         raise Exception("CPLUS: 登入失敗（2FA 後）")
 
-def simulate_user_activity(driver):
-    ActionChains(driver).move_by_offset(random.randint(-50, 50), random.randint(-50, 50)).perform()
-    driver.execute_script("window.scrollBy(0, 100);")
-    time.sleep(random.uniform(1, 3))
-
 def process_cplus_movement(driver, wait, initial_files):
     logging.info("CPLUS: 直接前往 Container Movement Log...")
-    driver.get("https://cplus.hit.com.hk/app/#/enquiry/ContainerMovementLog")
-    time.sleep(1)
+    navigate(driver, "https://cplus.hit.com.hk/app/#/enquiry/ContainerMovementLog")
     wait.until(EC.presence_of_element_located((By.XPATH, "//*[@id='root']")))
     WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.XPATH, "//*[@id='root']/div/div[2]//form")))
     logging.info("CPLUS: Container Movement Log 頁面加載完成")
 
     logging.info("CPLUS: 點擊 Search...")
     local_initial = initial_files.copy()
+    search_locators = [
+        (By.XPATH, "//*[@id='root']/div/div[2]/div/div/div[3]/div/div[1]/div/form/div[2]/div/div[4]/button"),
+        (By.XPATH, "//button[contains(@class, 'MuiButtonBase-root') and .//span[contains(text(), 'Search')]]"),
+        (By.XPATH, "//button[contains(text(), 'Search')]")
+    ]
     for attempt in range(2):
         try:
-            search_button = WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.XPATH, "//*[@id='root']/div/div[2]/div/div/div[3]/div/div[1]/div/form/div[2]/div/div[4]/button")))
+            search_button, locator = resolve_locator(driver, 'movement_search', search_locators, timeout=10, clickable=True)
             ActionChains(driver).move_to_element(search_button).click().perform()
-            logging.info("CPLUS: Search 按鈕點擊成功")
+            logging.info(f"CPLUS: Search 按鈕點擊成功 (locator: {locator[1]})")
             break
         except TimeoutException:
-            logging.debug(f"CPLUS: Search 按鈕未找到，嘗試備用定位 {attempt+1}/2...")
-            try:
-                search_button = WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.XPATH, "//button[contains(@class, 'MuiButtonBase-root') and .//span[contains(text(), 'Search')]]")))
-                ActionChains(driver).move_to_element(search_button).click().perform()
-                logging.info("CPLUS: 備用 Search 按鈕 1 點擊成功")
-                break
-            except TimeoutException:
-                logging.debug(f"CPLUS: 備用 Search 按鈕 1 失敗，嘗試備用定位 2 (嘗試 {attempt+1}/2)...")
-                try:
-                    search_button = WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Search')]")))
-                    ActionChains(driver).move_to_element(search_button).click().perform()
-                    logging.info("CPLUS: 備用 Search 按鈕 2 點擊成功")
-                    break
-                except TimeoutException:
-                    logging.debug(f"CPLUS: 備用 Search 按鈕 2 失敗 (嘗試 {attempt+1}/2)")
-                    driver.save_screenshot("movement_search_failure.png")
-                    with open("movement_search_failure.html", "w", encoding="utf-8") as f:
-                        f.write(driver.page_source)
+            logging.debug(f"CPLUS: 所有 Search 按鈕定位失敗 (嘗試 {attempt+1}/2)")
+            driver.save_screenshot("movement_search_failure.png")
+            with open("movement_search_failure.html", "w", encoding="utf-8") as f:
+                f.write(driver.page_source)
     else:
         raise Exception("CPLUS: Container Movement Log Search 按鈕點擊失敗")
 
-    simulate_user_activity(driver)
+    pacer.pause('movement_search', 1.0, 1.0)
 
-    logging.info("CPLUS: 點擊 Download...")
-    for attempt in range(2):
-        try:
-            download_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//*[@id='root']/div/div[2]/div/div/div[3]/div/div[2]/div/div[2]/div/div[1]/div[1]/button")))
-            ActionChains(driver).move_to_element(download_button).click().perform()
-            logging.info("CPLUS: Download 按鈕點擊成功")
-            time.sleep(0.5)
+    def click_download_and_wait():
+        """點擊 Download 並等待檔案；無觸發下載時重試引擎只會重跑呢一步"""
+        logging.info("CPLUS: 點擊 Download...")
+        for attempt in range(2):
             try:
-                driver.execute_script("arguments[0].click();", download_button)
-                logging.debug("CPLUS: Download 按鈕 JavaScript 點擊成功")
-            except Exception as js_e:
-                logging.debug(f"CPLUS: Download 按鈕 JavaScript 點擊失敗: {str(js_e)}")
-            time.sleep(0.5)
-            break
-        except Exception as e:
-            logging.debug(f"CPLUS: Download 按鈕點擊失敗 (嘗試 {attempt+1}/2): {str(e)}")
-            driver.save_screenshot("movement_download_failure.png")
-            with open("movement_download_failure.html", "w", encoding="utf-8") as f:
-                f.write(driver.page_source)
-            time.sleep(0.5)
-    else:
-        raise Exception("CPLUS: Container Movement Log Download 按鈕點擊失敗")
+                download_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//*[@id='root']/div/div[2]/div/div/div[3]/div/div[2]/div/div[2]/div/div[1]/div[1]/button")))
+                ActionChains(driver).move_to_element(download_button).click().perform()
+                logging.info("CPLUS: Download 按鈕點擊成功")
+                pacer.pause('movement_download', 0.5)
+                try:
+                    driver.execute_script("arguments[0].click();", download_button)
+                    logging.debug("CPLUS: Download 按鈕 JavaScript 點擊成功")
+                except Exception as js_e:
+                    logging.debug(f"CPLUS: Download 按鈕 JavaScript 點擊失敗: {str(js_e)}")
+                break
+            except Exception as e:
+                logging.debug(f"CPLUS: Download 按鈕點擊失敗 (嘗試 {attempt+1}/2): {str(e)}")
+                driver.save_screenshot("movement_download_failure.png")
+                with open("movement_download_failure.html", "w", encoding="utf-8") as f:
+                    f.write(driver.page_source)
+                pacer.pause('movement_download_retry', 0.5)
+        else:
+            raise Exception("CPLUS: Container Movement Log Download 按鈕點擊失敗")
 
-    new_files = wait_for_new_file(cplus_download_dir, local_initial)
-    if new_files:
-        logging.info(f"CPLUS: Container Movement Log 下載完成，檔案位於: {cplus_download_dir}")
-        filtered_files = {f for f in new_files if "cntrMoveLog" in f}
-        for file in filtered_files:
-            logging.info(f"CPLUS: 新下載檔案: {file}")
-        if not filtered_files:
-            logging.warning("CPLUS: 未下載預期檔案 (cntrMoveLog.xlsx)，記錄頁面狀態...")
+        new_files = wait_for_download(driver, cplus_download_dir, local_initial)
+        if new_files:
+            logging.info(f"CPLUS: Container Movement Log 下載完成，檔案位於: {cplus_download_dir}")
+            filtered_files = {f for f in new_files if "cntrMoveLog" in f}
+            for file in filtered_files:
+                logging.info(f"CPLUS: 新下載檔案: {file}")
+            if not filtered_files:
+                logging.warning("CPLUS: 未下載預期檔案 (cntrMoveLog.xlsx)，記錄頁面狀態...")
+                driver.save_screenshot("movement_download_failure.png")
+                with open("movement_download_failure.html", "w", encoding="utf-8") as f:
+                    f.write(driver.page_source)
+                raise Exception("CPLUS: Container Movement Log 未下載預期檔案")
+            return filtered_files
+        else:
+            logging.warning("CPLUS: Container Movement Log 未觸發新文件下載，記錄頁面狀態...")
             driver.save_screenshot("movement_download_failure.png")
             with open("movement_download_failure.html", "w", encoding="utf-8") as f:
                 f.write(driver.page_source)
-            raise Exception("CPLUS: Container Movement Log 未下載預期檔案")
-        return filtered_files
-    else:
-        logging.warning("CPLUS: Container Movement Log 未觸發新文件下載，記錄頁面狀態...")
-        driver.save_screenshot("movement_download_failure.png")
-        with open("movement_download_failure.html", "w", encoding="utf-8") as f:
-            f.write(driver.page_source)
-        raise Exception("CPLUS: Container Movement Log 未觸發新文件下載")
+            raise DownloadNotStartedError("CPLUS: Container Movement Log 未觸發新文件下載", reclick=click_download_and_wait)
+
+    return click_download_and_wait()
 
 def process_cplus_onhand(driver, wait, initial_files):
     logging.info("CPLUS: 前往 OnHandContainerList 頁面...")
-    driver.get("https://cplus.hit.com.hk/app/#/enquiry/OnHandContainerList")
-    time.sleep(1)
+    navigate(driver, "https://cplus.hit.com.hk/app/#/enquiry/OnHandContainerList")
     wait.until(EC.presence_of_element_located((By.XPATH, "//*[@id='root']")))
     # 加: 檢查 JS 執行或相容問題
     try:
-        # 檢查 document.readyState 是否 complete（JS 載入完成）
+        # 檢查 document.readyState（eager 模式下 interactive 已代表 DOM 可用）
         js_state = driver.execute_script("return document.readyState;")
-        if js_state != "complete":
-            logging.warning("CPLUS OnHand: JS 未完全執行，狀態: {js_state}，嘗試等待...")
-            time.sleep(5)
-            # 再檢查
-            js_state = driver.execute_script("return document.readyState;")
-            if js_state != "complete":
-                raise Exception("CPLUS OnHand: JS 執行失敗，狀態: {js_state}")
+        if js_state not in ("interactive", "complete"):
+            logging.warning(f"CPLUS OnHand: JS 未完全執行，狀態: {js_state}，嘗試等待...")
+            try:
+                pacer.until(driver, lambda d: d.execute_script("return document.readyState;") in ("interactive", "complete"), 5, 'onhand_ready_state')
+            except TimeoutException:
+                raise Exception(f"CPLUS OnHand: JS 執行失敗，狀態: {driver.execute_script('return document.readyState;')}")
 
         try:
             wait.until_not(EC.visibility_of_element_located((By.TAG_NAME, "noscript")))
@@ -436,37 +1778,26 @@ def process_cplus_onhand(driver, wait, initial_files):
             # 試 refresh 解決
             logging.warning("CPLUS OnHand: 嘗試刷新頁面解決 JS 問題...")
             driver.refresh()
-            time.sleep(3)
             try:
                 wait.until_not(EC.visibility_of_element_located((By.TAG_NAME, "noscript")))
             except TimeoutException:
                 raise Exception("CPLUS OnHand: JS 執行或相容問題，noscript 仍可見")
-        time.sleep(5)
         try:
-            extended_wait = WebDriverWait(driver, 10)
             search_element_locators = [
                 (By.XPATH, "//button//span[contains(text(), 'Search')]"),  # 原有
                 (By.CSS_SELECTOR, "button.MuiButton-containedPrimary span.MuiButton-label"),  # 備用 CSS，基於 Material-UI
                 (By.XPATH, "//button[contains(@class, 'MuiButtonBase-root') and .//span[contains(text(), 'Search')]]")  # 另一備用
             ]
-            found = False
-            for locator in search_element_locators:
-                try:
-                    extended_wait.until(EC.presence_of_element_located(locator))
-                    logging.info(f"CPLUS OnHand: 渲染元素存在（使用 locator: {locator}），JS 執行正常")
-                    found = True
-                    break
-                except TimeoutException:
-                    logging.debug(f"CPLUS OnHand: 備用 locator {locator} 未找到，試下一個...")
-            if not found:
-                raise TimeoutException("All locators failed")  # 觸發下一個 except
+            # 所有 locator 同時競速，全部超時會 raise TimeoutException 觸發下一個 except
+            # 原本固定等 5 秒再等 10 秒，而家直接等渲染元素出現（上限 15 秒）
+            _, locator = resolve_locator(driver, 'onhand_render', search_element_locators, timeout=15)
+            logging.info(f"CPLUS OnHand: 渲染元素存在（使用 locator: {locator}），JS 執行正常")
         except TimeoutException:
             # 新加：如果超時，嘗試刷新頁面再檢查
             logging.warning("CPLUS OnHand: 渲染元素未出現，嘗試刷新頁面...")
             driver.refresh()
-            time.sleep(5)
             try:
-                extended_wait.until(EC.presence_of_element_located((By.XPATH, "//button//span[contains(text(), 'Search')]")))
+                pacer.until(driver, EC.presence_of_element_located((By.XPATH, "//button//span[contains(text(), 'Search')]")), 15, 'onhand_render_refresh')
                 logging.info("CPLUS OnHand: 刷新後渲染元素存在，JS 執行正常")
             except TimeoutException:
                 # 新加 debug 部分：儲存 screenshot 同 page_source
@@ -482,123 +1813,159 @@ def process_cplus_onhand(driver, wait, initial_files):
     logging.info("CPLUS: OnHandContainerList 頁面加載完成")
     logging.info("CPLUS: 點擊 Search...")
     local_initial = initial_files.copy()
+    onhand_search_locators = [
+        (By.XPATH, "//*[@id='root']/div/div[2]/div/div/div/div[3]/div/div[1]/form/div[1]/div[24]/div[2]/button/span[1]"),
+        (By.XPATH, "//button[contains(@class, 'MuiButtonBase-root') and .//span[contains(text(), 'Search')]]"),
+        (By.CSS_SELECTOR, "button.MuiButton-contained span.MuiButton-label")
+    ]
     try:
-        search_button_onhand = WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.XPATH, "//*[@id='root']/div/div[2]/div/div/div/div[3]/div/div[1]/form/div[1]/div[24]/div[2]/button/span[1]")))
-        time.sleep(0.5)
+        search_button_onhand, locator = resolve_locator(driver, 'onhand_search', onhand_search_locators, timeout=10, clickable=True)
         ActionChains(driver).move_to_element(search_button_onhand).click().perform()
-        logging.info("CPLUS: Search 按鈕點擊成功")
+        logging.info(f"CPLUS: Search 按鈕點擊成功 (locator: {locator[1]})")
     except TimeoutException:
-        logging.debug("CPLUS: Search 按鈕未找到，嘗試備用定位...")
-        try:
-            search_button_onhand = WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.XPATH, "//button[contains(@class, 'MuiButtonBase-root') and .//span[contains(text(), 'Search')]]")))
-            time.sleep(0.5)
-            ActionChains(driver).move_to_element(search_button_onhand).click().perform()
-            logging.info("CPLUS: 備用 Search 按鈕 1 點擊成功")
-        except TimeoutException:
-            logging.debug("CPLUS: 備用 Search 按鈕 1 失敗，嘗試第三備用定位...")
-            try:
-                search_button_onhand = WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.CSS_SELECTOR, "button.MuiButton-contained span.MuiButton-label")))
-                time.sleep(0.5)
-                ActionChains(driver).move_to_element(search_button_onhand).click().perform()
-                logging.info("CPLUS: 第三備用 Search 按鈕點擊成功")
-            except TimeoutException:
-                logging.error("CPLUS: 所有 Search 按鈕定位失敗，記錄頁面狀態...")
-                driver.save_screenshot("onhand_search_failure.png")
-                with open("onhand_search_failure.html", "w", encoding="utf-8") as f:
+        logging.error("CPLUS: 所有 Search 按鈕定位失敗，記錄頁面狀態...")
+        driver.save_screenshot("onhand_search_failure.png")
+        with open("onhand_search_failure.html", "w", encoding="utf-8") as f:
+            f.write(driver.page_source)
+        raise Exception("CPLUS: OnHandContainerList Search 按鈕點擊失敗")
+    pacer.pause('onhand_search', 1.0, 1.0)
+    def export_csv_and_wait():
+        """點擊 Export → Export as CSV 並等待檔案；無觸發下載時重試引擎只會重跑呢一步"""
+        logging.info("CPLUS: 點擊 Export...")
+        export_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//*[@id='root']/div/div[2]/div/div/div/div[3]/div/div/div[2]/div[1]/div[1]/div/div/div[4]/div/div/span[1]/button")))
+        ActionChains(driver).move_to_element(export_button).click().perform()
+        logging.info("CPLUS: Export 按鈕點擊成功")
+        logging.info("CPLUS: 點擊 Export as CSV...")
+        export_csv_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//li[contains(@class, 'MuiMenuItem-root') and text()='Export as CSV']")))
+        ActionChains(driver).move_to_element(export_csv_button).click().perform()
+        logging.info("CPLUS: Export as CSV 按鈕點擊成功")
+        new_files = wait_for_download(driver, cplus_download_dir, local_initial)
+        if new_files:
+            logging.info(f"CPLUS: OnHandContainerList 下載完成，檔案位於: {cplus_download_dir}")
+            filtered_files = {f for f in new_files if "data_" in f}
+            for file in filtered_files:
+                logging.info(f"CPLUS: 新下載檔案: {file}")
+            if not filtered_files:
+                logging.warning("CPLUS: 未下載預期檔案 (data_*.csv)，記錄頁面狀態...")
+                driver.save_screenshot("onhand_download_failure.png")
+                with open("onhand_download_failure.html", "w", encoding="utf-8") as f:
                     f.write(driver.page_source)
-                raise Exception("CPLUS: OnHandContainerList Search 按鈕點擊失敗")
-    time.sleep(0.5)
-    simulate_user_activity(driver)
-    logging.info("CPLUS: 點擊 Export...")
-    export_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//*[@id='root']/div/div[2]/div/div/div/div[3]/div/div/div[2]/div[1]/div[1]/div/div/div[4]/div/div/span[1]/button")))
-    ActionChains(driver).move_to_element(export_button).click().perform()
-    logging.info("CPLUS: Export 按鈕點擊成功")
-    time.sleep(0.5)
-    logging.info("CPLUS: 點擊 Export as CSV...")
-    export_csv_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//li[contains(@class, 'MuiMenuItem-root') and text()='Export as CSV']")))
-    ActionChains(driver).move_to_element(export_csv_button).click().perform()
-    logging.info("CPLUS: Export as CSV 按鈕點擊成功")
-    time.sleep(0.5)
-    new_files = wait_for_new_file(cplus_download_dir, local_initial)
-    if new_files:
-        logging.info(f"CPLUS: OnHandContainerList 下載完成，檔案位於: {cplus_download_dir}")
-        filtered_files = {f for f in new_files if "data_" in f}
-        for file in filtered_files:
-            logging.info(f"CPLUS: 新下載檔案: {file}")
-        if not filtered_files:
-            logging.warning("CPLUS: 未下載預期檔案 (data_*.csv)，記錄頁面狀態...")
+                raise Exception("CPLUS: OnHandContainerList 未下載預期檔案")
+            return filtered_files
+        else:
+            logging.warning("CPLUS: OnHandContainerList 未觸發新文件下載，記錄頁面狀態...")
             driver.save_screenshot("onhand_download_failure.png")
             with open("onhand_download_failure.html", "w", encoding="utf-8") as f:
                 f.write(driver.page_source)
-            raise Exception("CPLUS: OnHandContainerList 未下載預期檔案")
-        return filtered_files
-    else:
-        logging.warning("CPLUS: OnHandContainerList 未觸發新文件下載，記錄頁面狀態...")
-        driver.save_screenshot("onhand_download_failure.png")
-        with open("onhand_download_failure.html", "w", encoding="utf-8") as f:
-            f.write(driver.page_source)
-        raise Exception("CPLUS: OnHandContainerList 未觸發新文件下載")
+            raise DownloadNotStartedError("CPLUS: OnHandContainerList 未觸發新文件下載", reclick=export_csv_and_wait)
+
+    return export_csv_and_wait()
+
+HOUSE_SNAPSHOT_JS = """
+var minRows = arguments[0], timeoutMs = arguments[1];
+var done = arguments[arguments.length - 1];
+var start = Date.now();
+function snapshot() {
+    var rows = Array.from(document.querySelectorAll('table.MuiTable-root tbody tr'));
+    var buttons = [];
+    rows.forEach(function (row) {
+        var cells = row.querySelectorAll('td');
+        Array.from(row.querySelectorAll('td:nth-child(4) div button')).forEach(function (btn) {
+            if (btn.disabled) { btn.removeAttribute('data-hit-idx'); return; }
+            btn.setAttribute('data-hit-idx', buttons.length);
+            buttons.push({name: cells.length > 2 ? cells[2].innerText.trim() : '', text: row.innerText});
+        });
+    });
+    if (!buttons.length) {
+        Array.from(document.querySelectorAll("button[title='Excel']")).forEach(function (btn) {
+            if (btn.disabled) { return; }
+            var row = btn.closest('tr'), cells = row ? row.querySelectorAll('td') : [];
+            btn.setAttribute('data-hit-idx', buttons.length);
+            buttons.push({name: cells.length > 2 ? cells[2].innerText.trim() : '', text: row ? row.innerText : ''});
+        });
+    }
+    var filled = rows.some(function (row) { return row.innerText.trim(); });
+    return {rows: rows.length, filled: filled, buttons: buttons};
+}
+(function poll() {
+    var snap = snapshot();
+    if ((snap.rows >= minRows && snap.filled && snap.buttons.length) || Date.now() - start >= timeoutMs) {
+        done(snap);
+        return;
+    }
+    setTimeout(poll, 200);
+})();
+"""
+HOUSE_CLICK_JS = """
+var btn = document.querySelector("button[data-hit-idx='" + arguments[0] + "']");
+if (!btn || !btn.isConnected || btn.disabled) { return false; }
+btn.scrollIntoView({block: 'center'});
+btn.click();
+return true;
+"""
+
+def take_house_snapshot(driver, min_rows=6, timeout=30):
+    """
+    一次 execute_async_script 攞晒 Housekeeping 表格：行數、每個可用 Excel 按鈕同佢所屬行嘅報告名稱，
+    順手幫按鈕打上 data-hit-idx，之後點擊直接用 index，唔使再 find_elements。
+    """
+    snapshot = run_polling_script(driver, HOUSE_SNAPSHOT_JS, (min_rows,), timeout,
+                                  lambda snap: bool(snap and snap['rows'] >= min_rows and snap['filled'] and snap['buttons']))
+    return snapshot or {'rows': 0, 'filled': False, 'buttons': []}
+
+def house_button_index(buttons, name, occurrence=0):
+    """
+    喺（刷新後嘅）snapshot 按報告名稱搵按鈕 index：刷新後 data-hit-idx 係按可用按鈕次序重新編號，
+    可用按鈕有變 index 就會對錯行。同名報告按出現次序揀；搵唔到回傳 None。
+    """
+    matches = [i for i, button in enumerate(buttons) if button['name'] == name]
+    return matches[occurrence] if occurrence < len(matches) else None
+
+def name_occurrences(buttons):
+    """每個按鈕係同名報告入面第幾個（配合 house_button_index）"""
+    seen = {}
+    occurrences = []
+    for button in buttons:
+        occurrences.append(seen.get(button['name'], 0))
+        seen[button['name']] = occurrences[-1] + 1
+    return occurrences
 
-def process_cplus_house(driver, wait, initial_files):
+def click_house_button(driver, index):
+    """按 snapshot index 點擊 Excel 按鈕；返回 False 代表表格已重新渲染（snapshot 過時）"""
+    return bool(driver.execute_script(HOUSE_CLICK_JS, index))
+
+def process_cplus_house(driver, wait, initial_files, done_reports=None):
     logging.info("CPLUS: 前往 Housekeeping Reports 頁面...")
-    driver.get("https://cplus.hit.com.hk/app/#/report/housekeepReport")
+    navigate(driver, "https://cplus.hit.com.hk/app/#/report/housekeepReport")
     wait.until(EC.presence_of_element_located((By.XPATH, "//*[@id='root']")))
     logging.info("CPLUS: Housekeeping Reports 頁面加載完成")
     
-    def wait_for_table_and_buttons(load_retry_max=3):
-        """共用函數：等待表格加載同 Excel 按鈕出現"""
-        success_load = False
+    def load_table_snapshot(load_retry_max=3):
+        """共用函數：等待表格（至少 6 行，預期報告數）同 Excel 按鈕出現，唔夠先刷新頁面"""
+        snapshot = None
         for load_retry in range(load_retry_max):
-            try:
-                # 等待表格行出現，並檢查至少 6 行（預期報告數）
-                rows = WebDriverWait(driver, 30).until(EC.presence_of_all_elements_located((By.XPATH, "//table[contains(@class, 'MuiTable-root')]//tbody//tr")))
-                if len(rows) < 6 or all(not row.text.strip() for row in rows):
-                    logging.debug(f"表格數據不足或空 (現在 {len(rows)} 行 < 預期 6)，刷新頁面重試...")
-                    driver.refresh()
-                    # 再等待
-                    rows = WebDriverWait(driver, 30).until(EC.presence_of_all_elements_located((By.XPATH, "//table[contains(@class, 'MuiTable-root')]//tbody//tr")))
-                    if len(rows) < 6:
-                        logging.warning("刷新後表格數據仍不足，記錄頁面狀態...")
-                        driver.save_screenshot("house_load_failure.png")
-                        with open("house_load_failure.html", "w", encoding="utf-8") as f:
-                            f.write(driver.page_source)
-                        break  # 不 raise，繼續
-                logging.info("CPLUS: 表格加載完成")
-                success_load = True
-                break
-            except TimeoutException:
-                logging.warning(f"CPLUS: 表格未加載 (重試 {load_retry+1}/{load_retry_max})，嘗試刷新頁面...")
+            snapshot = take_house_snapshot(driver, min_rows=6, timeout=30)
+            if snapshot['rows'] >= 6 and snapshot['filled'] and snapshot['buttons']:
+                logging.info(f"CPLUS: 表格加載完成 ({snapshot['rows']} 行, {len(snapshot['buttons'])} 個 Excel 按鈕)")
+                return snapshot
+            logging.warning(f"CPLUS: 表格數據不足 (現在 {snapshot['rows']} 行, {len(snapshot['buttons'])} 個按鈕) (重試 {load_retry+1}/{load_retry_max})，刷新頁面重試...")
+            if load_retry < load_retry_max - 1:
                 driver.refresh()
-        if not success_load:
-            logging.error("CPLUS: Housekeeping Reports 表格加載失敗3次，繼續其他邏輯...")
-        
-        logging.info("CPLUS: 等待 Excel 按鈕出現...")
-        try:
-            WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.XPATH, "//table[contains(@class, 'MuiTable-root')]//tbody//tr//td[4]/div/button[not(@disabled)]")))
-            logging.info("CPLUS: Excel 按鈕已出現")
-        except TimeoutException:
-            logging.warning("CPLUS: Excel 按鈕未出現，記錄狀態...")
-            driver.save_screenshot("house_button_wait_failure.png")
-            with open("house_button_wait_failure.html", "w", encoding="utf-8") as f:
-                f.write(driver.page_source)
+        logging.error(f"CPLUS: Housekeeping Reports 表格加載失敗 {load_retry_max} 次，繼續其他邏輯...")
+        driver.save_screenshot("house_load_failure.png")
+        with open("house_load_failure.html", "w", encoding="utf-8") as f:
+            f.write(driver.page_source)
+        return snapshot
     
     # 初始等待
-    wait_for_table_and_buttons()
+    snapshot = load_table_snapshot()
     
     logging.info("CPLUS: 定位並點擊所有 Excel 下載按鈕...")
     local_initial = initial_files.copy()
     new_files = set()
     report_files = {}  # 儲存報告名稱與 {'file': file_name, 'mod_time': mod_time} 的映射
-    # 使用與等待一致的XPATH定位按鈕
-    button_locator = "//table[contains(@class, 'MuiTable-root')]//tbody//tr//td[4]/div/button[not(@disabled)]"
-    buttons = driver.find_elements(By.XPATH, button_locator)
-    total_buttons = len(buttons)
-    logging.info(f"CPLUS: 搵到 {total_buttons} 個 Excel 下載按鈕 (使用穩定XPATH)")
-    if total_buttons == 0:
-        logging.debug("CPLUS: 未找到 Excel 按鈕，嘗試備用CSS...")
-        buttons = driver.find_elements(By.CSS_SELECTOR, "button[title='Excel']")  # 保留原備用
-        total_buttons = len(buttons)
-        logging.info(f"CPLUS: 備用CSS找到 {total_buttons} 個 Excel 下載按鈕")
+    total_buttons = len(snapshot['buttons'])
+    logging.info(f"CPLUS: 搵到 {total_buttons} 個 Excel 下載按鈕 (表格 snapshot)")
     if total_buttons == 0:
         logging.warning("CPLUS: 定位失敗，找到0個按鈕，記錄debug資訊...")
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -607,157 +1974,564 @@ def process_cplus_house(driver, wait, initial_files):
             f.write(driver.page_source)
     # 每個按鈕前清視窗
     handle_popup(driver, wait)
-    housekeep_prefixes = ['IE2_', 'DM1C_', 'IA17_', 'GA1_', 'IA5_', 'IA15_', 'INV-114_']  # 用於過濾
+    housekeep_prefixes = HOUSEKEEP_PREFIXES  # 用於過濾
+    # 多分頁並行模式 (HOUSE_PARALLEL_TABS > 1)
+    report_names = [button['name'] or f"Unknown Report {i+1}" for i, button in enumerate(snapshot['buttons'])]  # 後備名稱，避免 key error
+    # resume 模式：清單入面已完成嘅報告唔使再撳
+    done_reports = done_reports or set()
+    skip_indexes = {i for i, name in enumerate(report_names) if name in done_reports}
+    if skip_indexes:
+        logging.info(f"CPLUS: 清單顯示 {len(skip_indexes)} 份 Housekeeping 報告已完成，只下載其餘 {total_buttons - len(skip_indexes)} 份")
+    house_tabs = int(os.environ.get('HOUSE_PARALLEL_TABS', 1))
+    if house_tabs > 1 and total_buttons - len(skip_indexes) > 1:
+        new_files, report_files = download_house_reports_in_tabs(driver, initial_files, total_buttons, min(house_tabs, total_buttons), housekeep_prefixes, skip_indexes)
+        logging.info(f"CPLUS: Housekeeping Reports 並行下載完成，共 {len(new_files)} 個文件，預期 {total_buttons} 個")
+        return new_files, len(new_files), total_buttons, report_files
+    occurrences = name_occurrences(snapshot['buttons'])
+    current = {'buttons': snapshot['buttons']}  # 最近一次 snapshot 嘅按鈕，刷新後用報告名稱重新對 index
+
+    def refresh_snapshot(error):
+        """按鈕失效代表表格重新渲染：刷新頁面再 snapshot 一次"""
+        driver.refresh()
+        refreshed = load_table_snapshot(load_retry_max=2)
+        current['buttons'] = refreshed['buttons']
+        if len(refreshed['buttons']) < total_buttons:
+            logging.warning(f"CPLUS: 按鈕數不足 (現在 {len(refreshed['buttons'])} < 預期 {total_buttons})，等待再試...")
+
     for i in range(total_buttons):
-        success = False
-        for retry in range(3):  # 加重試 3 次每個按鈕
-            try:
-                # 【重要】每次 loop 都重新搵一次所有按鈕，避免元素失效
-                current_buttons = driver.find_elements(By.XPATH, button_locator)
-                if len(current_buttons) < total_buttons:
-                    logging.warning(f"CPLUS: 按鈕數不足 (現在 {len(current_buttons)} < 預期 {total_buttons})，等待再試...")
-                    wait_for_table_and_buttons(load_retry_max=1)  # 快速重試一次等待
-                    continue  # 跳過本次 retry
-                btn = current_buttons[i]
-                # 捲動到該按鈕位置，確保佢喺畫面內
-                driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", btn)
-                time.sleep(1)  # 等待滾動完成，避免點擊失敗
-                try:
-                    report_name = driver.find_element(By.XPATH, f"//table[contains(@class, 'MuiTable-root')]//tbody//tr[{i+1}]//td[3]").text
-                    logging.info(f"CPLUS: 準備點擊第 {i+1} 個 Excel 按鈕，報告名稱: {report_name}")
-                except:
-                    logging.debug(f"CPLUS: 無法獲取第 {i+1} 個按鈕的報告名稱")
-                    report_name = f"Unknown Report {i+1}"  # 後備名稱，避免 key error
-                # 執行點擊
-                driver.execute_script("arguments[0].click();", btn)
-                logging.info(f"CPLUS: 第 {i+1} 個 Excel 按鈕點擊成功")
-                time.sleep(0.5)  # 加小延遲等待彈出
-                # 等待下載或彈窗處理 (保留你原本處理彈窗嘅 code)
-                handle_popup(driver, wait)
-                temp_new = wait_for_new_file(cplus_download_dir, local_initial, timeout=20, prefixes=housekeep_prefixes)  # 20s
-                if temp_new:
-                    file_name = temp_new.pop()
-                    logging.info(f"CPLUS: 第 {i+1} 個按鈕下載新文件: {file_name}")
-                    local_initial.add(file_name)
-                    new_files.add(file_name)
-                    file_path = os.path.join(cplus_download_dir, file_name)
-                    mod_time = os.path.getmtime(file_path)
-                    # 如果報告已存在，選最新，並優先無 (1) 的
-                    if report_name in report_files:
-                        old_file = report_files[report_name]['file']
-                        old_mod = report_files[report_name]['mod_time']
-                        if mod_time > old_mod or (' (' not in file_name and ' (' in old_file):
-                            report_files[report_name] = {'file': file_name, 'mod_time': mod_time}
-                    else:
-                        report_files[report_name] = {'file': file_name, 'mod_time': mod_time}
-                    success = True
-                    # 加: 成功後刷新頁面，重置狀態
-                    logging.info(f"CPLUS: 第 {i+1} 個下載成功，刷新頁面重置狀態...")
-                    driver.refresh()
-                    # 新加：刷新後重新等待表格同按鈕，確保下一個 loop 穩定（無固定 sleep）
-                    wait_for_table_and_buttons(load_retry_max=2)  # 減到2次，避免太長
-                    break
-                else:
-                    logging.warning(f"CPLUS: 第 {i+1} 個按鈕未觸發新文件下載 (重試 {retry+1}/3)")
-                    time.sleep(1)
-                time.sleep(3)  # 給予時間反應
-            except IndexError as ie:
-                logging.error(f"CPLUS: 第 {i+1} 個按鈕處理出錯 (IndexError): {str(ie)} - 可能按鈕列表不足")
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                driver.save_screenshot(f"house_index_error_{i+1}_{retry+1}_{timestamp}.png")
-                with open(f"house_index_error_{i+1}_{retry+1}_{timestamp}.html", "w", encoding="utf-8") as f:
-                    f.write(driver.page_source)
-                handle_popup(driver, wait)  # 失敗時再清視窗
-                time.sleep(2)  # 等再試
-            except Exception as e:
-                logging.error(f"CPLUS: 第 {i+1} 個按鈕處理出錯: {str(e)}")
-                handle_popup(driver, wait)  # 失敗時再清視窗
-                time.sleep(1)
-                if retry == 2:  # 最後一次記錄 debug
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    driver.save_screenshot(f"house_button_failure_{i+1}_{timestamp}.png")
-                    with open(f"house_button_failure_{i+1}_{timestamp}.html", "w", encoding="utf-8") as f:
-                        f.write(driver.page_source)
-        if not success:
-            logging.warning(f"CPLUS: 第 {i+1} 個 Excel 下載按鈕經過 3 次重試失敗")
+        if i in skip_indexes:
             continue
+        report_name = report_names[i]
+
+        def click_and_wait():
+            logging.info(f"CPLUS: 準備點擊第 {i+1} 個 Excel 按鈕，報告名稱: {report_name}")
+            index = house_button_index(current['buttons'], snapshot['buttons'][i]['name'], occurrences[i])
+            if index is None:
+                raise StaleElementReferenceException(f"CPLUS: 刷新後表格搵唔到報告 {report_name} 嘅可用按鈕")
+            # 捲動同點擊喺同一次 execute_script 完成；按鈕唔見咗代表表格重新渲染
+            if not click_house_button(driver, index):
+                raise StaleElementReferenceException(f"CPLUS: 第 {i+1} 個按鈕已失效（表格重新渲染）")
+            logging.info(f"CPLUS: 第 {i+1} 個 Excel 按鈕點擊成功")
+            # 等待下載或彈窗處理（短暫等彈窗出現，下載開始咗就唔使等）
+            handle_popup(driver, wait, POPUP_SETTLE_SECONDS,
+                         lambda: any(f not in local_initial for f in os.listdir(cplus_download_dir)))
+            temp_new = wait_for_download(driver, cplus_download_dir, local_initial, timeout=20, prefixes=housekeep_prefixes)  # 20s
+            if not temp_new:
+                raise DownloadNotStartedError(f"CPLUS: 第 {i+1} 個按鈕未觸發新文件下載")
+            return temp_new
+
+        try:
+            # 無觸發下載直接重新點擊、彈窗先關、按鈕失效先刷新，每類有自己嘅重試預算
+            temp_new = run_with_retry(
+                f"CPLUS Housekeeping 第 {i+1} 個按鈕", driver, click_and_wait,
+                recoveries={
+                    'popup': lambda e: handle_popup(driver, wait),
+                    'stale': refresh_snapshot,
+                    'other': lambda e: handle_popup(driver, wait),
+                },
+                session_lost=cplus_session_lost,
+                budgets=dict(RETRY_BUDGETS, session=0))
+        except Exception as e:
+            logging.warning(f"CPLUS: 第 {i+1} 個 Excel 下載按鈕重試預算用盡仍失敗: {str(e)}")
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            driver.save_screenshot(f"house_button_failure_{i+1}_{timestamp}.png")
+            with open(f"house_button_failure_{i+1}_{timestamp}.html", "w", encoding="utf-8") as f:
+                f.write(driver.page_source)
+            if isinstance(e, SessionExpiredError) or cplus_session_lost(driver):
+                raise  # session 冇咗，交返俾 section 層重新登入
+            continue
+        file_name = temp_new.pop()
+        logging.info(f"CPLUS: 第 {i+1} 個按鈕下載新文件: {file_name}")
+        local_initial.add(file_name)
+        new_files.add(file_name)
+        file_path = os.path.join(cplus_download_dir, file_name)
+        mod_time = os.path.getmtime(file_path)
+        # 如果報告已存在，選最新，並優先無 (1) 的
+        if report_name in report_files:
+            old_file = report_files[report_name]['file']
+            old_mod = report_files[report_name]['mod_time']
+            if mod_time > old_mod or (' (' not in file_name and ' (' in old_file):
+                report_files[report_name] = {'file': file_name, 'mod_time': mod_time}
+        else:
+            report_files[report_name] = {'file': file_name, 'mod_time': mod_time}
     if new_files:
         logging.info(f"CPLUS: Housekeeping Reports 下載完成，共 {len(new_files)} 個文件，預期 {total_buttons} 個")
         if len(new_files) != total_buttons:
             logging.warning(f"CPLUS: 下載數 {len(new_files)} 不等於按鈕數 {total_buttons}，但繼續抽取現有檔案")  # 不 raise，繼續
     return new_files, len(new_files), total_buttons, report_files  # 無 new_files 也繼續
         
-def process_cplus():
+def download_house_reports_in_tabs(driver, initial_files, total_buttons, tab_count, prefixes, skip_indexes=()):
+    """
+    同一個已登入 session 開多個分頁，每個分頁負責部分 Excel 按鈕，一輪內各分頁齊齊點擊，
+    下載喺瀏覽器並行進行，再按檔名前綴/點擊次序對返報告名稱。
+    回傳 (new_files, report_files)，格式同順序模式一樣。
+    """
+    main_handle = driver.current_window_handle
+    page_url = driver.current_url
+    # 一次過讀晒每個按鈕嘅報告名稱同整行文字（用嚟對檔名前綴）
+    buttons = take_house_snapshot(driver, min_rows=6, timeout=30)['buttons']
+    report_names = [buttons[i]['name'] if i < len(buttons) and buttons[i]['name'] else f"Unknown Report {i+1}" for i in range(total_buttons)]
+    row_texts = [buttons[i]['text'] if i < len(buttons) else '' for i in range(total_buttons)]
+    occurrences = name_occurrences(buttons)
+    tab_buttons = {main_handle: buttons}  # 每個分頁最近一次 snapshot；reload 後要重新 snapshot
+
+    # 開額外分頁（window.open 唔會 block，各分頁同時加載）
+    existing_handles = set(driver.window_handles)
+    for _ in range(tab_count - 1):
+        driver.execute_script("window.open(arguments[0], '_blank');", page_url)
+    WebDriverWait(driver, 10).until(lambda d: len(d.window_handles) >= len(existing_handles) + tab_count - 1)
+    handles = [main_handle] + [h for h in driver.window_handles if h not in existing_handles]
+    logging.info(f"CPLUS: Housekeeping 並行模式，共 {len(handles)} 個分頁處理 {total_buttons} 個按鈕")
+
+    local_initial = initial_files.copy()
+    new_files = set()
+    report_files = {}
+    attempts = {i: 0 for i in range(total_buttons)}
+    pending = [i for i in range(total_buttons) if i not in skip_indexes]
+    try:
+        while pending:
+            # 每個分頁一輪攞一個按鈕
+            batch = []
+            for handle in handles:
+                if not pending:
+                    break
+                batch.append((handle, pending.pop(0)))
+            clicked = []
+            for handle, i in batch:
+                attempts[i] += 1
+                try:
+                    driver.switch_to.window(handle)
+                    # 分頁第一次用或者 reload 後先 snapshot（幫按鈕打 index），再按報告名稱對返 index 點擊
+                    if handle not in tab_buttons:
+                        tab_buttons[handle] = take_house_snapshot(driver, min_rows=6, timeout=30)['buttons']
+                    index = house_button_index(tab_buttons[handle], buttons[i]['name'], occurrences[i]) if i < len(buttons) else None
+                    if index is None or not click_house_button(driver, index):
+                        tab_buttons.pop(handle, None)
+                        raise Exception("按鈕已失效（表格重新渲染）")
+                    logging.info(f"CPLUS: 分頁 {handles.index(handle)+1} 點擊第 {i+1} 個 Excel 按鈕，報告名稱: {report_names[i]}")
+                    clicked.append((handle, i))
+                except Exception as e:
+                    logging.warning(f"CPLUS: 分頁 {handles.index(handle)+1} 點擊第 {i+1} 個按鈕失敗 (嘗試 {attempts[i]}/3): {str(e)}")
+                    handle_popup(driver, WebDriverWait(driver, 10))
+                    if attempts[i] < 3:
+                        pending.append(i)
+
+            # 等今輪所有下載完成
+            arrived = []
+            deadline = time.time() + 20
+            while len(arrived) < len(clicked) and time.time() < deadline:
+                temp_new = wait_for_download(driver, cplus_download_dir, local_initial, timeout=max(1, deadline - time.time()), prefixes=prefixes)
+                if not temp_new:
+                    break
+                for file_name in sorted(temp_new):
+                    local_initial.add(file_name)
+                    new_files.add(file_name)
+                    arrived.append(file_name)
+
+            # 對返報告名稱：優先用檔名前綴喺該行文字搵，否則按點擊次序
+            unassigned = [i for _, i in clicked]
+            for file_name in arrived:
+                code = next((p.rstrip('_') for p in prefixes if file_name.startswith(p)), None)
+                match = next((i for i in unassigned if code and code in row_texts[i]), None)
+                if match is None and unassigned:
+                    match = unassigned[0]
+                if match is None:
+                    continue
+                unassigned.remove(match)
+                mod_time = os.path.getmtime(os.path.join(cplus_download_dir, file_name))
+                report_files[report_names[match]] = {'file': file_name, 'mod_time': mod_time}
+                logging.info(f"CPLUS: 第 {match+1} 個按鈕下載新文件: {file_name}")
+
+            # 未到嘅按鈕重新排隊，並清理該分頁嘅彈出視窗
+            for handle, i in clicked:
+                if i in unassigned:
+                    logging.warning(f"CPLUS: 第 {i+1} 個按鈕未觸發新文件下載 (嘗試 {attempts[i]}/3)")
+                    driver.switch_to.window(handle)
+                    handle_popup(driver, WebDriverWait(driver, 10))
+                    if attempts[i] < 3:
+                        pending.append(i)
+            # 所有分頁非阻塞刷新，下一輪前並行重新加載
+            if pending:
+                for handle, _ in clicked:
+                    driver.switch_to.window(handle)
+                    driver.execute_script("location.reload();")
+                    tab_buttons.pop(handle, None)  # reload 後 data-hit-idx 冇咗
+    finally:
+        for handle in handles[1:]:
+            try:
+                driver.switch_to.window(handle)
+                driver.close()
+            except Exception as e:
+                logging.debug(f"CPLUS: 關閉分頁失敗: {str(e)}")
+        driver.switch_to.window(main_handle)
+    return new_files, report_files
+
+# ==================== 共用 Chrome：browser pool 同 driver 路徑快取 ====================
+DRIVER_CACHE_FILE = os.path.abspath(".driver_cache.json")
+
+def browser_pool_enabled():
+    """BROWSER_POOL=true 時兩個網站共用一個 Chrome，各自用隔離 browser context"""
+    return os.environ.get('BROWSER_POOL', 'False').lower() == 'true'
+
+def get_chrome_version(binary=CHROME_BINARY):
+    try:
+        result = subprocess.run([binary, '--version'], capture_output=True, text=True, timeout=10)
+        return result.stdout.strip() or None
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+def major_version(version_text):
+    """'Chromium 126.0.6478.126' / 'ChromeDriver 126.0.6478.126 (...)' → '126'"""
+    match = re.search(r'(\d+)\.\d+', version_text or '')
+    return match.group(1) if match else None
+
+def get_chromedriver_version(path):
+    try:
+        result = subprocess.run([path, '--version'], capture_output=True, text=True, timeout=10)
+        return result.stdout.strip() or None
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+def get_chrome_service():
+    """
+    用快取或 PATH 嘅 chromedriver，但要 major 版本同 Chrome 一樣先用；
+    對唔上或者檢查唔到就交俾 Selenium Manager (Service()) 揀啱版本。
+    """
+    chrome_version = get_chrome_version()
+    chrome_major = major_version(chrome_version)
+    if not chrome_major:
+        return Service(), chrome_version
+    try:
+        with open(DRIVER_CACHE_FILE, encoding='utf-8') as f:
+            cache = json.load(f)
+        path = cache.get('chromedriver', '')
+        if cache.get('chrome_version') == chrome_version and cache.get('driver_major') == chrome_major and os.access(path, os.X_OK):
+            logging.debug(f"使用快取 chromedriver: {path}")
+            return Service(executable_path=path), chrome_version
+    except (OSError, ValueError):
+        pass
+    path = shutil.which('chromedriver')
+    if path and major_version(get_chromedriver_version(path)) == chrome_major:
+        return Service(executable_path=path), chrome_version
+    if path:
+        logging.info(f"PATH chromedriver 版本同 Chrome {chrome_major} 唔夾，交俾 Selenium Manager")
+    return Service(), chrome_version
+
+def save_chrome_service(driver, chrome_version):
+    """成功開到 Chrome 之後先記低 chromedriver 路徑（同 major 版本）俾下次直接用"""
+    try:
+        path = driver.service.path
+        driver_major = major_version(get_chromedriver_version(path)) if path and os.path.exists(path) else None
+        if driver_major and driver_major == major_version(chrome_version):
+            with open(DRIVER_CACHE_FILE + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump({'chrome_version': chrome_version, 'chromedriver': path, 'driver_major': driver_major}, f)
+            os.replace(DRIVER_CACHE_FILE + '.tmp', DRIVER_CACHE_FILE)
+    except Exception as e:
+        logging.debug(f"儲存 chromedriver 路徑失敗: {str(e)}")
+
+def launch_chrome(download_dir):
+    service, chrome_version = get_chrome_service()
+    try:
+        driver = webdriver.Chrome(service=service, options=get_chrome_options(download_dir))
+    except WebDriverException as e:
+        if not getattr(service, 'path', None):  # 已經係 Selenium Manager
+            raise
+        # 快取/PATH 嘅 chromedriver 開唔到（例如 session not created），清走快取交俾 Selenium Manager
+        logging.warning(f"chromedriver {service.path} 開唔到 Chrome，改用 Selenium Manager: {str(e)}")
+        if os.path.exists(DRIVER_CACHE_FILE):
+            os.remove(DRIVER_CACHE_FILE)
+        driver = webdriver.Chrome(service=Service(), options=get_chrome_options(download_dir))
+    save_chrome_service(driver, chrome_version)
+    return driver
+
+class ContextDriver(webdriver.Chrome):
+    """
+    共用 BrowserPool 嘅 Chrome session，但只操作自己 browser context 入面嘅分頁：
+    每個指令前喺 pool 鎖內切換到自己分頁，所以兩個 site 可以喺唔同 thread 並行使用。
+    鎖會包住成個指令（ChromeDriver 本身都係一個 session 一次行一個指令），所以長嘅 async poll script
+    要經 run_polling_script 拆細，唔好一次過 block 另一個 site 幾十秒。
+    """
+    def __init__(self, pool, lease_key, handle, browser_context_id):
+        # 唔行父類 __init__（唔開新 Chrome），直接沿用 pool driver 嘅 session 狀態
+        self.__dict__.update(pool.driver.__dict__)
+        self._switch_to = SwitchTo(self)
+        self.pool = pool
+        self.lease_key = lease_key
+        self.handle = handle
+        self.browser_context_id = browser_context_id
+        self.owned_handles = {handle}
+
+    def execute(self, driver_command, params=None):
+        with self.pool.lock:
+            if driver_command == Command.SWITCH_TO_WINDOW:
+                response = super().execute(driver_command, params)
+                self.handle = params['handle']
+                if self.handle != self.pool.initial_handle:
+                    self.owned_handles.add(self.handle)
+                self.pool.current_handle = self.handle
+                return response
+            if self.pool.current_handle != self.handle:
+                super().execute(Command.SWITCH_TO_WINDOW, {'handle': self.handle})
+                self.pool.current_handle = self.handle
+            response = super().execute(driver_command, params)
+            if driver_command == Command.CLOSE:
+                self.pool.current_handle = None
+            elif driver_command == Command.W3C_GET_WINDOW_HANDLES:
+                # 新開分頁（window.open）屬於同一 context，記低佢哋
+                self.adopt_handles(response.get('value', []))
+            return response
+
+    def adopt_handles(self, handles):
+        """
+        只認自己 context 入面新開嘅分頁；Chrome 啟動時嘅預設視窗同其他 site 嘅分頁一律唔認，
+        否則 release 時會連共用視窗一齊關。
+        """
+        new = [h for h in handles if h not in self.owned_handles and h not in self.pool.foreign_handles(self)]
+        if not new:
+            return
+        if self.browser_context_id:
+            targets = self.execute_cdp_cmd('Target.getTargets', {}).get('targetInfos', [])
+            in_context = {t['targetId'] for t in targets if t.get('browserContextId') == self.browser_context_id}
+            new = [h for h in new if h in in_context]
+        self.owned_handles.update(new)
+
+    def quit(self):
+        self.pool.release(self)
+
+class BrowserPool:
+    """
+    一個 Chrome 行晒兩個網站：lease() 為每個 site 開隔離 browser context（獨立 cookie 同下載目錄）。
+    prewarm() 可以喺 preflight 期間背景啟動 Chrome。
+    """
+    def __init__(self):
+        self.driver = None
+        self.lock = threading.RLock()
+        self.current_handle = None
+        self.initial_handle = None  # Chrome 啟動時預設 context 嘅視窗，唔分俾任何 site
+        self.leases = []
+        self.launch_thread = None
+        self.launch_error = None
+
+    def launch(self):
+        try:
+            start_time = time.time()
+            self.driver = launch_chrome(cplus_download_dir)
+            self.current_handle = self.initial_handle = self.driver.current_window_handle
+            logging.info(f"BrowserPool: 共用 Chrome 啟動完成，用時 {time.time() - start_time:.1f} 秒")
+        except Exception as e:
+            self.launch_error = e
+
+    def prewarm(self):
+        if self.launch_thread is None:
+            self.launch_thread = threading.Thread(target=self.launch, name='chrome-prewarm', daemon=True)
+            self.launch_thread.start()
+        return self
+
+    def ensure_started(self):
+        self.prewarm()
+        self.launch_thread.join()
+        if self.launch_error:
+            raise self.launch_error
+        return self.driver
+
+    def foreign_handles(self, lease):
+        """唔屬於 lease 嘅分頁：其他 site 嘅分頁同 Chrome 預設視窗"""
+        return set().union({self.initial_handle} - {None}, *[other.owned_handles for other in self.leases if other is not lease])
+
+    def lease(self, site, download_dir):
+        """開一個隔離 context 分頁俾 site 用；唔支援 context 就退回普通新視窗 + 該分頁下載目錄"""
+        driver = self.ensure_started()
+        with self.lock:
+            context_id = None
+            handle = None
+            try:
+                context_id = driver.execute_cdp_cmd('Target.createBrowserContext', {'disposeOnDetach': False})['browserContextId']
+                # 每個 context 用 Target.createTarget 開自己嘅分頁，唔會用 Chrome 預設視窗
+                target_id = driver.execute_cdp_cmd('Target.createTarget', {'url': 'about:blank', 'browserContextId': context_id})['targetId']
+                if target_id in driver.window_handles and target_id != self.initial_handle:
+                    handle = target_id
+                    driver.execute_cdp_cmd('Browser.setDownloadBehavior', {'behavior': 'allow', 'browserContextId': context_id, 'downloadPath': download_dir})
+            except Exception as e:
+                logging.warning(f"BrowserPool: {site} 建立隔離 context 失敗，改用普通視窗: {str(e)}")
+            if handle is None:
+                if context_id:
+                    try:
+                        driver.execute_cdp_cmd('Target.disposeBrowserContext', {'browserContextId': context_id})
+                    except Exception as e:
+                        logging.debug(f"BrowserPool: 釋放 context 失敗: {str(e)}")
+                context_id = None
+                driver.switch_to.new_window('window')
+                handle = driver.current_window_handle
+                driver.execute_cdp_cmd('Page.setDownloadBehavior', {'behavior': 'allow', 'downloadPath': download_dir})
+            self.current_handle = None
+            lease = ContextDriver(self, f"{driver.session_id}:{site}", handle, context_id)
+            self.leases.append(lease)
+        if lean_browser_enabled():
+            apply_lean_profile(lease)
+        if network_capture_requested():
+            enable_network_capture(lease, download_dir)
+        lease.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+        logging.info(f"BrowserPool: {site} 已分配分頁 {handle} (context: {context_id or 'default'})")
+        return lease
+
+    def release(self, lease):
+        """關閉 lease 嘅分頁同 context（唔影響另一個 site）"""
+        with self.lock:
+            for handle in list(lease.owned_handles - {self.initial_handle}):
+                try:
+                    self.driver.execute_cdp_cmd('Target.closeTarget', {'targetId': handle})
+                except Exception as e:
+                    logging.debug(f"BrowserPool: 關閉分頁 {handle} 失敗: {str(e)}")
+            if lease.browser_context_id:
+                try:
+                    self.driver.execute_cdp_cmd('Target.disposeBrowserContext', {'browserContextId': lease.browser_context_id})
+                except Exception as e:
+                    logging.debug(f"BrowserPool: 釋放 context 失敗: {str(e)}")
+            self.current_handle = None
+            if lease in self.leases:
+                self.leases.remove(lease)
+
+    def close(self):
+        if self.launch_thread:
+            self.launch_thread.join()
+        if self.driver:
+            try:
+                self.driver.quit()
+                logging.info("BrowserPool: 共用 Chrome 已關閉")
+            except Exception as e:
+                logging.warning(f"BrowserPool: 關閉 Chrome 失敗: {str(e)}")
+        self.driver = None
+
+def start_site_driver(download_dir):
+    """啟動一個 site 用嘅 Chrome driver（擷取模式、隱藏 webdriver 標記）"""
+    driver = launch_chrome(download_dir)
+    if lean_browser_enabled():
+        apply_lean_profile(driver)
+    if network_capture_requested():
+        enable_network_capture(driver, download_dir)
+    driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+    return driver
+
+def process_cplus(pool=None, manifest=None):
     driver = None
     downloaded_files = set()
     initial_files = set(os.listdir(cplus_download_dir))
     house_file_count = 0
     house_button_count = 0
     house_report_files = {} # 移出循環，累積跨重試
+    if manifest:
+        # resume：清單已完成嘅報告直接沿用
+        house_report_files = manifest.house_report_files()
+        house_file_count = len(house_report_files)
+        house_button_count = manifest.house_button_count() or 0
+        downloaded_files.update(manifest.files_in(cplus_download_dir))
+        if manifest.cplus_complete():
+            logging.info("CPLUS: 清單顯示今日所有 CPLUS 報告已完成，唔使開瀏覽器同登入")
+            return downloaded_files, house_file_count, house_button_count, None, house_report_files
     try:
-        driver = webdriver.Chrome(options=get_chrome_options(cplus_download_dir))
+        driver = pool.lease('cplus', cplus_download_dir) if pool else start_site_driver(cplus_download_dir)
         logging.info("CPLUS WebDriver 初始化成功")
-        driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
         wait = WebDriverWait(driver, 10)
-        cplus_login(driver, wait)
+        if not (session_cache_enabled() and restore_browser_session(driver, 'cplus', CPLUS_HOME_URL, probe_cplus_session)):
+            cplus_login(driver, wait)
         sections = [
             ('movement', process_cplus_movement),
             ('onhand', process_cplus_onhand),
             ('house', process_cplus_house)
         ]
+        # 直接 HTTP 匯出：成功嘅 section 唔使再開頁面點擊
+        direct_results = {}
+        if direct_export_requested():
+            direct_results = run_cplus_direct_exports(driver, cplus_download_dir, manifest)
+            for section_name in ('movement', 'onhand'):
+                if section_name in direct_results:
+                    downloaded_files.update(direct_results[section_name])
+                    initial_files.update(direct_results[section_name])
+                    if manifest:
+                        manifest.record_files(section_name, cplus_download_dir, direct_results[section_name])
+            if 'house_button_count' in direct_results:
+                house_button_count = direct_results['house_button_count']  # 今日表格嘅按鈕數，唔係 recipe 數
+                if manifest:
+                    manifest.set_house_button_count(house_button_count)
+            if direct_results.get('house'):
+                # 成功嘅先記低（部分失敗都要），點擊路徑只補其餘報告，唔會將呢啲檔當新下載
+                house_report_files.update(direct_results['house'])
+                house_files = {info['file'] for info in direct_results['house'].values()}
+                downloaded_files.update(house_files)
+                initial_files.update(house_files)
+                house_file_count = len(house_report_files)
+                if manifest:
+                    for report_name, info in direct_results['house'].items():
+                        manifest.record('house', cplus_download_dir, info['file'], report_name)
         for section_name, section_func in sections:
-            success = False
-            for attempt in range(MAX_RETRIES):
-                try:
-                    # 加: 在每個 attempt 前檢查 session
-                    try:
-                        wait.until(EC.presence_of_element_located((By.XPATH, "//*[@id='root']/div/div[1]/header/div/div[4]/button/span[1]"))) # 用戶按鈕元素
-                        logging.info(f"CPLUS {section_name}: Session 有效，繼續")
-                    except TimeoutException:
-                        logging.warning(f"CPLUS {section_name}: Session 失效或 cookie 問題，重新登入...")
-                        cplus_login(driver, wait) # 自動重新登入
-                        # 加記錄，幫助 debug
-                        driver.save_screenshot(f"session_failure_{section_name}_attempt{attempt+1}.png")
-                        with open(f"session_failure_{section_name}_attempt{attempt+1}.html", "w", encoding="utf-8") as f:
-                            f.write(driver.page_source)
-                    # 修改: 加延遲同刷新，避免載入崩潰
-                    if section_name == 'movement':
-                        time.sleep(0.5) # 減到0.5s
-                    if section_name != 'house':
-                        new_files = section_func(driver, wait, initial_files)
-                    else:
-                        new_files, this_file_count, this_button_count, this_report_files = section_func(driver, wait, initial_files)
-                        # 合併 report_files，選最新
-                        for report_name, this_info in this_report_files.items():
-                            if report_name in house_report_files:
-                                if this_info['mod_time'] > house_report_files[report_name]['mod_time']:
-                                    house_report_files[report_name] = this_info
-                            else:
-                                house_report_files[report_name] = this_info
-                        house_file_count = this_file_count
-                        house_button_count = this_button_count
-                    downloaded_files.update(new_files)
-                    initial_files.update(new_files)
-                    success = True
-                    break
-                except Exception as e:
-                    logging.error(f"CPLUS {section_name} 嘗試 {attempt+1}/{MAX_RETRIES} 失敗: {str(e)}")
-                    if attempt < MAX_RETRIES - 1:
-                        time.sleep(0.5) # 減到0.5s
-                        # 修改: 加刷新頁面或重新導航，避免內部崩潰殘留
-                        try:
-                            driver.refresh()
-                        except:
-                            pass
-            if not success:
-                logging.error(f"CPLUS {section_name} 經過 {MAX_RETRIES} 次嘗試失敗") # 不 raise，繼續抽取現有檔案
+            if section_name in ('movement', 'onhand') and section_name in direct_results or section_name == 'house' and direct_results.get('house_complete'):
+                logging.info(f"CPLUS {section_name}: 已由直接匯出完成，跳過頁面操作")
+                continue
+            if manifest and (manifest.has(section_name) or (section_name == 'house' and manifest.house_complete())):
+                logging.info(f"CPLUS {section_name}: 清單顯示已完成，跳過")
+                continue
+            def run_section():
+                # 即時檢查 session（唔等待），失效就交俾重試引擎重新登入
+                if cplus_session_lost(driver):
+                    raise SessionExpiredError(f"CPLUS {section_name}: Session 失效或 cookie 問題")
+                if section_name != 'house':
+                    return section_func(driver, wait, initial_files), 0, 0, {}
+                return section_func(driver, wait, initial_files, (manifest.house_done() if manifest else set()) | set(direct_results.get('house', {})))
+
+            def relogin(error):
+                driver.save_screenshot(f"session_failure_{section_name}.png")
+                with open(f"session_failure_{section_name}.html", "w", encoding="utf-8") as f:
+                    f.write(driver.page_source)
+                cplus_login(driver, wait)
+
+            try:
+                new_files, this_file_count, this_button_count, this_report_files = run_with_retry(
+                    f"CPLUS {section_name}", driver, run_section,
+                    recoveries={
+                        'session': relogin,
+                        'popup': lambda e: handle_popup(driver, wait),
+                        'stale': lambda e: driver.refresh(),
+                        'other': lambda e: driver.refresh(),
+                    },
+                    session_lost=cplus_session_lost)
+            except Exception as e:
+                logging.error(f"CPLUS {section_name} 重試預算用盡仍失敗: {str(e)}") # 不 raise，繼續抽取現有檔案
+                continue
+            if section_name == 'house':
+                # 合併 report_files，選最新
+                for report_name, this_info in this_report_files.items():
+                    if report_name in house_report_files:
+                        if this_info['mod_time'] > house_report_files[report_name]['mod_time']:
+                            house_report_files[report_name] = this_info
+                    else:
+                        house_report_files[report_name] = this_info
+                house_file_count = len(house_report_files)
+                house_button_count = this_button_count
+                if manifest:
+                    for report_name, this_info in this_report_files.items():
+                        manifest.record('house', cplus_download_dir, this_info['file'], report_name)
+                    manifest.set_house_button_count(this_button_count)
+            elif manifest:
+                manifest.record_files(section_name, cplus_download_dir, new_files)
+            if direct_export_requested():
+                if section_name != 'house':
+                    record_export_recipe(driver, 'cplus', section_name, new_files)
+                else:
+                    for report_name, this_info in this_report_files.items():
+                        record_export_recipe(driver, 'cplus', section_name, {this_info['file']}, report_name)
+            downloaded_files.update(new_files)
+            initial_files.update(new_files)
         return downloaded_files, house_file_count, house_button_count, driver, house_report_files
     except Exception as e:
         logging.error(f"CPLUS 總錯誤: {str(e)}")
         return downloaded_files, house_file_count, house_button_count, driver, house_report_files
     finally:
         try:
-            if driver:
+            if driver and session_cache_enabled():
+                # 登出會令伺服器 session 失效，快取模式保留 session 俾下次用
+                save_browser_session(driver, 'cplus')
+                logging.info("CPLUS: Session 快取模式，唔登出")
+            elif driver:
                 logging.info("CPLUS: 嘗試登出...")
                 logout_menu_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//*[@id='root']/div/div[1]/header/div/div[4]/button/span[1]")))
                 logout_menu_button.click()
@@ -765,7 +2539,6 @@ def process_cplus():
                 logout_option = wait.until(EC.element_to_be_clickable((By.XPATH, "//li[contains(text(), 'Logout')]")))
                 logout_option.click()
                 logging.info("CPLUS: Logout 選項點擊成功")
-                time.sleep(1) # 等待視窗出現
                 close_success = False
                 for retry in range(3):
                     try:
@@ -777,7 +2550,7 @@ def process_cplus():
                     except Exception as ce:
                         logging.warning(f"CPLUS: CLOSE 按鈕點擊失敗 (重試 {retry+1}/3): {str(ce)}")
                         handle_popup(driver, wait)
-                        time.sleep(0.5)
+                        pacer.pause('cplus_logout_retry', 0.5)
                 if not close_success:
                     logging.error("CPLUS: CLOSE 按鈕經過 3 次重試失敗，記錄狀態...")
                     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -787,40 +2560,163 @@ def process_cplus():
         except Exception as e:
             logging.error(f"CPLUS: 登出失敗: {str(e)}")
             
+# ==================== Barge 純 HTTP 客戶端 ====================
+BARGE_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+def find_json_path(obj, token, path=None):
+    """喺 JSON 物件入面搵等於 token 嘅字串值，回傳 key/index 路徑"""
+    path = path or []
+    if isinstance(obj, str):
+        return path if obj and token.endswith(obj) and len(obj) >= 16 else None
+    items = obj.items() if isinstance(obj, dict) else enumerate(obj) if isinstance(obj, list) else []
+    for key, value in items:
+        found = find_json_path(value, token, path + [key])
+        if found is not None:
+            return found
+    return None
+
+def get_json_path(obj, path):
+    for key in path:
+        obj = obj[key]
+    return obj
+
+def parse_set_cookies(headers):
+    """由 urllib3 回應嘅 Set-Cookie 抽 name=value"""
+    cookies = {}
+    for value in headers.getlist('Set-Cookie'):
+        jar = http.cookies.SimpleCookie()
+        try:
+            jar.load(value)
+        except http.cookies.CookieError:
+            continue
+        cookies.update({name: morsel.value for name, morsel in jar.items()})
+    return cookies
+
+def capture_barge_login_response(driver):
+    """
+    barge_login 之後即刻搵含密碼嘅登入 request 同攞佢回應 body（頁面跳轉後 body 就攞唔到）。
+    """
+    password = os.environ.get('BARGE_PASSWORD', '123456')
+    try:
+        state = drain_network_events(driver)
+        for request_id, request in state['requests'].items():
+            if request['method'] == 'POST' and request['postData'] and password in request['postData'] and request_id in state['finished']:
+                body = driver.execute_cdp_cmd('Network.getResponseBody', {'requestId': request_id})
+                text = base64.b64decode(body['body']).decode('utf-8') if body.get('base64Encoded') else body['body']
+                state['barge_login'] = {'request': request, 'response': json.loads(text)}
+                logging.info(f"Barge: 已擷取登入 request {request['url']}")
+                return
+        logging.debug("Barge: 搵唔到登入 request")
+    except Exception as e:
+        logging.warning(f"Barge: 擷取登入回應失敗: {str(e)}")
+
+def record_barge_api_recipes(driver, file_names):
+    """
+    瀏覽器下載成功後，記錄登入 recipe（密碼變 {{password}}）同下載 recipe，
+    並喺登入回應 JSON 搵出下載 request 用嘅 token 位置。
+    """
+    try:
+        state = drain_network_events(driver)
+        login = state.get('barge_login')
+        request_id, disposition_name = find_export_request(state, set(file_names))
+        if not login or not request_id:
+            logging.debug("Barge: 登入或下載 request 未齊，唔記錄 API recipe")
+            return
+        password = os.environ.get('BARGE_PASSWORD', '123456')
+        login_request = login['request']
+        login_recipe = {
+            'method': login_request['method'],
+            'url': login_request['url'],
+            'headers': {k: v for k, v in login_request['headers'].items() if k.lower() not in RECIPE_SKIP_HEADERS},
+            'body': login_request['postData'].replace(password, '{{password}}')
+        }
+        download_recipe = build_export_recipe(driver, state['requests'][request_id], disposition_name or sorted(file_names)[0])
+        auth = download_recipe.get('auth')
+        if auth:
+            token = state['requests'][request_id]['headers'][auth['header']]
+            token_path = find_json_path(login['response'], token)
+            if token_path is None:
+                logging.debug("Barge: 登入回應入面搵唔到 token，唔記錄 API recipe")
+                return
+            auth['login_path'] = token_path
+            auth['prefix'] = token[:len(token) - len(get_json_path(login['response'], token_path))]
+        save_export_recipe('barge', 'login', login_recipe)
+        save_export_recipe('barge', 'download', download_recipe)
+        logging.info("Barge: 已記錄 API 登入及下載 recipe")
+    except Exception as e:
+        logging.warning(f"Barge: 記錄 API recipe 失敗: {str(e)}")
+
+def run_barge_api_download(download_dir):
+    """
+    唔開 Chrome：HTTP 登入 barge.oneport.com，由登入回應攞 token/cookie，再直接下載 Container Detail 報告。
+    回傳下載檔名 set，失敗 raise。
+    """
+    recipes = load_export_recipes().get('barge', {})
+    if 'login' not in recipes or 'download' not in recipes:
+        raise Exception("Barge: 未有 API recipe，需要瀏覽器路徑先記錄一次")
+    login_recipe = recipes['login']
+    download_recipe = recipes['download']
+    http_pool = urllib3.PoolManager(num_pools=1, maxsize=2)
+    try:
+        password = os.environ.get('BARGE_PASSWORD', '123456')
+        headers = dict(login_recipe['headers'])
+        headers['User-Agent'] = BARGE_USER_AGENT
+        response = http_pool.request(
+            login_recipe['method'], login_recipe['url'],
+            body=login_recipe['body'].replace('{{password}}', password).encode('utf-8'),
+            headers=headers, timeout=urllib3.Timeout(connect=10, read=30), retries=False
+        )
+        if response.status != 200:
+            raise Exception(f"Barge: API 登入失敗 HTTP {response.status}")
+        session = {'cookies': parse_set_cookies(response.headers), 'storage': {}, 'user_agent': BARGE_USER_AGENT}
+        auth = download_recipe.get('auth')
+        if auth and 'login_path' in auth:
+            token = get_json_path(json.loads(response.data.decode('utf-8')), auth['login_path'])
+            download_recipe = dict(download_recipe, auth={'header': auth['header'], 'value': auth['prefix'] + token})
+        logging.info("Barge: API 登入成功")
+        file_name = run_export_recipe(http_pool, download_recipe, session, download_dir)
+        return {file_name}
+    finally:
+        http_pool.clear()
+
 def barge_login(driver, wait):
     logging.info("Barge: 嘗試打開網站 https://barge.oneport.com/login...")
-    driver.get("https://barge.oneport.com/login")
+    navigate(driver, "https://barge.oneport.com/login")
     logging.info(f"Barge: 網站已成功打開，當前 URL: {driver.current_url}")
-    time.sleep(3)
 
     logging.info("Barge: 輸入 COMPANY ID...")
     company_id_field = wait.until(EC.presence_of_element_located((By.XPATH, "//input[contains(@id, 'mat-input') and @placeholder='Company ID' or contains(@id, 'mat-input-0')]")))
     company_id_field.send_keys("CKL")
     logging.info("Barge: COMPANY ID 輸入完成")
-    time.sleep(1)
+    pacer.pause('barge_typing', 0.3, 0.4)
 
     logging.info("Barge: 輸入 USER ID...")
     user_id_field = driver.find_element(By.XPATH, "//input[contains(@id, 'mat-input') and @placeholder='User ID' or contains(@id, 'mat-input-1')]")
     user_id_field.send_keys("barge")
     logging.info("Barge: USER ID 輸入完成")
-    time.sleep(1)
+    pacer.pause('barge_typing', 0.3, 0.4)
 
     logging.info("Barge: 輸入 PW...")
     password_field = driver.find_element(By.XPATH, "//input[contains(@id, 'mat-input') and @placeholder='Password' or contains(@id, 'mat-input-2')]")
     password_field.send_keys(os.environ.get('BARGE_PASSWORD', '123456'))
     logging.info("Barge: PW 輸入完成")
-    time.sleep(1)
+    pacer.pause('barge_typing', 0.3, 0.4)
 
     logging.info("Barge: 點擊 LOGIN 按鈕...")
     login_button_barge = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'LOGIN') or contains(@class, 'mat-raised-button')]")))
     ActionChains(driver).move_to_element(login_button_barge).click().perform()
     logging.info("Barge: LOGIN 按鈕點擊成功")
-    time.sleep(3)
+    # 等離開登入頁，唔再固定等 3 秒
+    try:
+        pacer.until(driver, lambda d: 'login' not in d.current_url, 15, 'barge_login_submit')
+    except TimeoutException:
+        logging.warning(f"Barge: 點擊 LOGIN 後 15 秒仍停留喺 {driver.current_url}")
+    if session_cache_enabled():
+        save_browser_session(driver, 'barge')
 
 def process_barge_download(driver, wait, initial_files):
     logging.info("Barge: 直接前往 https://barge.oneport.com/downloadReport...")
-    driver.get("https://barge.oneport.com/downloadReport")
-    time.sleep(3)
+    navigate(driver, "https://barge.oneport.com/downloadReport")
     wait.until(EC.presence_of_element_located((By.TAG_NAME, "body")))
     logging.info("Barge: downloadReport 頁面加載完成")
 
@@ -828,67 +2724,96 @@ def process_barge_download(driver, wait, initial_files):
     report_type_trigger = wait.until(EC.element_to_be_clickable((By.XPATH, "//mat-form-field[.//mat-label[contains(text(), 'Report Type')]]//div[contains(@class, 'mat-select-trigger')]")))
     ActionChains(driver).move_to_element(report_type_trigger).click().perform()
     logging.info("Barge: Report Type 選擇開始")
-    time.sleep(2)
 
     logging.info("Barge: 點擊 Container Detail...")
     container_detail_option = wait.until(EC.element_to_be_clickable((By.XPATH, "//mat-option//span[contains(text(), 'Container Detail')]")))
     ActionChains(driver).move_to_element(container_detail_option).click().perform()
     logging.info("Barge: Container Detail 點擊成功")
-    time.sleep(2)
+    # 等下拉選單收起先撳 Download
+    try:
+        pacer.until(driver, EC.invisibility_of_element_located((By.XPATH, "//mat-option")), 10, 'barge_report_type')
+    except TimeoutException:
+        logging.warning("Barge: Report Type 下拉選單未收起，照樣嘗試 Download")
 
-    logging.info("Barge: 點擊 Download...")
-    local_initial = initial_files.copy()
-    download_button_barge = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[span[text()='Download']]")))
-    ActionChains(driver).move_to_element(download_button_barge).click().perform()
-    logging.info("Barge: Download 按鈕點擊成功")
+    def click_download_and_wait():
+        """點擊 Download 並等待檔案；無觸發下載時重試引擎只會重跑呢一步"""
+        logging.info("Barge: 點擊 Download...")
+        local_initial = initial_files.copy()
+        download_button_barge = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[span[text()='Download']]")))
+        ActionChains(driver).move_to_element(download_button_barge).click().perform()
+        logging.info("Barge: Download 按鈕點擊成功")
 
-    new_files = wait_for_new_file(barge_download_dir, local_initial)
-    if new_files:
-        logging.info(f"Barge: Container Detail 下載完成，檔案位於: {barge_download_dir}")
-        filtered_files = {f for f in new_files if "ContainerDetailReport" in f}
-        for file in filtered_files:
-            logging.info(f"Barge: 新下載檔案: {file}")
-        if not filtered_files:
-            logging.warning("Barge: 未下載預期檔案 (ContainerDetailReport*.csv)，記錄頁面狀態...")
+        new_files = wait_for_download(driver, barge_download_dir, local_initial)
+        if new_files:
+            logging.info(f"Barge: Container Detail 下載完成，檔案位於: {barge_download_dir}")
+            filtered_files = {f for f in new_files if "ContainerDetailReport" in f}
+            for file in filtered_files:
+                logging.info(f"Barge: 新下載檔案: {file}")
+            if not filtered_files:
+                logging.warning("Barge: 未下載預期檔案 (ContainerDetailReport*.csv)，記錄頁面狀態...")
+                driver.save_screenshot("barge_download_failure.png")
+                raise Exception("Barge: Container Detail 未下載預期檔案")
+            return filtered_files
+        else:
+            logging.warning("Barge: Container Detail 未觸發新文件下載，記錄頁面狀態...")
             driver.save_screenshot("barge_download_failure.png")
-            raise Exception("Barge: Container Detail 未下載預期檔案")
-        return filtered_files
-    else:
-        logging.warning("Barge: Container Detail 未觸發新文件下載，記錄頁面狀態...")
-        driver.save_screenshot("barge_download_failure.png")
-        raise Exception("Barge: Container Detail 未觸發新文件下載")
+            raise DownloadNotStartedError("Barge: Container Detail 未觸發新文件下載", reclick=click_download_and_wait)
+
+    return click_download_and_wait()
 
-def process_barge():
+def process_barge(pool=None, manifest=None):
     driver = None
     downloaded_files = set()
     initial_files = set(os.listdir(barge_download_dir))
+    if manifest and manifest.has('barge'):
+        logging.info("Barge: 清單顯示今日報告已完成，跳過")
+        return manifest.files_in(barge_download_dir), None
+    if barge_api_requested():
+        try:
+            start_time = time.time()
+            new_files = run_barge_api_download(barge_download_dir)
+            if any("ContainerDetailReport" in f for f in new_files):
+                logging.info(f"Barge: API 下載完成 {sorted(new_files)}，用時 {time.time() - start_time:.1f} 秒，唔使開 Chrome")
+                if manifest:
+                    manifest.record_files('barge', barge_download_dir, {f for f in new_files if "ContainerDetailReport" in f})
+                return new_files, None
+            logging.warning(f"Barge: API 下載檔名不符預期 {sorted(new_files)}，改用瀏覽器")
+        except Exception as e:
+            logging.warning(f"Barge: API 下載失敗，改用瀏覽器: {str(e)}")
     try:
-        driver = webdriver.Chrome(options=get_chrome_options(barge_download_dir))
+        driver = pool.lease('barge', barge_download_dir) if pool else start_site_driver(barge_download_dir)
         logging.info("Barge WebDriver 初始化成功")
-        driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
         wait = WebDriverWait(driver, 10)
-        barge_login(driver, wait)
-        success = False
-        for attempt in range(MAX_RETRIES):
-            try:
-                new_files = process_barge_download(driver, wait, initial_files)
-                downloaded_files.update(new_files)
-                initial_files.update(new_files)
-                success = True
-                break
-            except Exception as e:
-                logging.error(f"Barge 下載嘗試 {attempt+1}/{MAX_RETRIES} 失敗: {str(e)}")
-                if attempt < MAX_RETRIES - 1:
-                    time.sleep(5)
-        if not success:
-            logging.error(f"Barge 下載經過 {MAX_RETRIES} 次嘗試失敗")
+        if not (session_cache_enabled() and restore_browser_session(driver, 'barge', BARGE_LOGIN_URL, probe_barge_session)):
+            barge_login(driver, wait)
+        if barge_api_requested():
+            capture_barge_login_response(driver)
+        try:
+            new_files = run_with_retry(
+                "Barge", driver, lambda: process_barge_download(driver, wait, initial_files),
+                recoveries={
+                    'session': lambda e: barge_login(driver, wait),
+                    'other': lambda e: driver.refresh(),
+                },
+                session_lost=barge_session_lost)
+            if barge_api_requested():
+                record_barge_api_recipes(driver, new_files)
+            if manifest:
+                manifest.record_files('barge', barge_download_dir, new_files)
+            downloaded_files.update(new_files)
+            initial_files.update(new_files)
+        except Exception as e:
+            logging.error(f"Barge 下載重試預算用盡仍失敗: {str(e)}")
         return downloaded_files, driver
     except Exception as e:
         logging.error(f"Barge 總錯誤: {str(e)}")
         return downloaded_files, driver
     finally:
         try:
-            if driver:
+            if driver and session_cache_enabled():
+                save_browser_session(driver, 'barge')
+                logging.info("Barge: Session 快取模式，唔登出")
+            elif driver:
                 logging.info("Barge: 點擊工具欄進行登出...")
                 success_logout = False
                 for retry in range(2):  # 加重試 2 次
@@ -896,7 +2821,6 @@ def process_barge():
                         # 點擊工具欄
                         logout_toolbar_barge = WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.XPATH, "//*[@id='main-toolbar']/button[4]/span[1]")))
                         driver.execute_script("arguments[0].scrollIntoView(true);", logout_toolbar_barge)
-                        time.sleep(1)
                         driver.execute_script("arguments[0].click();", logout_toolbar_barge)
                         logging.info("Barge: 工具欄點擊成功")
                         
@@ -904,7 +2828,6 @@ def process_barge():
                         logout_span_xpath = "//div[contains(@class, 'mat-menu-panel')]//button//span[contains(text(), 'Logout')]"
                         logout_button_barge = WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.XPATH, logout_span_xpath)))
                         driver.execute_script("arguments[0].scrollIntoView(true);", logout_button_barge)
-                        time.sleep(1)
                         driver.execute_script("arguments[0].click();", logout_button_barge)
                         logging.info("Barge: Logout 選項點擊成功")
                         
@@ -920,7 +2843,6 @@ def process_barge():
                             backup_logout_xpath = "//button[.//span[contains(text(), 'Logout')]]"
                             logout_button_barge = WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.XPATH, backup_logout_xpath)))
                             driver.execute_script("arguments[0].scrollIntoView(true);", logout_button_barge)
-                            time.sleep(1)
                             driver.execute_script("arguments[0].click();", logout_button_barge)
                             logging.info("Barge: 備用 Logout 選項點擊成功")
                             
@@ -941,174 +2863,934 @@ def process_barge():
         except Exception as e:
             logging.error(f"Barge: 登出總失敗: {str(e)}")
 
-def get_latest_file(download_dir, pattern):
+REPORT_EXTENSIONS = ('.csv', '.xlsx')
+DUPLICATE_COPY_PATTERN = re.compile(r'\s?\(\d+\)(?=\.[^.]+$)')
+
+class DownloadIndex:
+    """
+    一次 os.scandir 掃晒下載目錄，記低每個報告檔嘅 size、mtime 同 sha256，之後所有階段（檢查、Email）都查呢個索引，唔再掃磁碟。
+    同一個檔名（去咗 "(n)" 後綴）嘅副本，內容一樣就按 hash 併返落原檔；內容唔同先當係另一次下載，揀最新。
+    唔同檔名嘅檔案就算內容一樣都唔會合併（例如兩份報告啱啱好一樣）。
+    """
+    def __init__(self):
+        self.entries = {}  # (dir, file) -> {'dir', 'file', 'size', 'mtime', 'sha256', 'duplicates'}
+        self.aliases = {}  # 被合併嘅副本 (dir, file) -> 保留嘅檔名
+
+    @classmethod
+    def build(cls, dirs=None):
+        index = cls()
+        start_time = time.time()
+        for dir_path in dirs or [cplus_download_dir, barge_download_dir]:
+            if not os.path.isdir(dir_path):
+                continue
+            by_copy = {}  # (去咗 "(n)" 嘅檔名, sha256) -> 副本
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    if not entry.is_file() or not entry.name.endswith(REPORT_EXTENSIONS):
+                        continue
+                    stat = entry.stat()
+                    info = {'dir': dir_path, 'file': entry.name, 'size': stat.st_size, 'mtime': stat.st_mtime,
+                            'sha256': file_sha256(entry.path), 'duplicates': []}
+                    by_copy.setdefault((DUPLICATE_COPY_PATTERN.sub('', entry.name), info['sha256']), []).append(info)
+            for copies in by_copy.values():
+                # 同內容：優先保留冇 "(n)" 嘅原檔名，再揀最早嗰個
+                copies.sort(key=lambda c: (bool(DUPLICATE_COPY_PATTERN.search(c['file'])), c['mtime']))
+                kept = copies[0]
+                for duplicate in copies[1:]:
+                    kept['duplicates'].append(duplicate['file'])
+                    index.aliases[(dir_path, duplicate['file'])] = kept['file']
+                    logging.info(f"下載索引: {duplicate['file']} 內容同 {kept['file']} 一樣，當作重複副本")
+                index.entries[(dir_path, kept['file'])] = kept
+        logging.info(f"下載索引: {len(index.entries)} 個報告檔（合併 {len(index.aliases)} 個重複副本），用時 {time.time() - start_time:.2f}s")
+        return index
+
+    def latest(self, download_dir, pattern):
+        """取匹配 pattern 嘅最新報告檔（重複副本已合併，內容唔同嘅就揀最新 mtime）"""
+        candidates = [e for (d, f), e in self.entries.items() if d == download_dir and pattern in f]
+        if not candidates:
+            return None
+        latest = max(candidates, key=lambda e: e['mtime'])
+        logging.info(f"✅ 選最新 [{pattern}]: {latest['file']}")
+        return latest['file']
+
+    def resolve(self, download_dir, file_name):
+        """將被合併嘅副本檔名轉返保留嘅檔名"""
+        return self.aliases.get((download_dir, file_name), file_name)
+
+    def get(self, download_dir, file_name):
+        return self.entries.get((download_dir, self.resolve(download_dir, file_name)))
+
+    def files(self):
+        return sorted(f for _, f in self.entries)
+
+# ==================== 報告解析（串流讀取、欄位投影、摘要統計） ====================
+REPORT_STATS_KEYS = ('movement', 'onhand', 'barge')  # 只解析呢幾份，Housekeeping 報告格式唔一，照舊只夾附件
+PARSE_CHUNK_ROWS = 5000  # 每次攞幾多行入欄位陣列
+HEADER_SCAN_ROWS = 20  # xlsx 表頭上面可能有標題行，喺頭幾行搵最似表頭嗰行
+# 欄位投影：正規化表頭（細階、去符號）→ 統計欄位，其他欄位一律唔讀入記憶體
+REPORT_STAT_FIELDS = {
+    'container': ('cntrno', 'containerno', 'containernumber', 'cntrnumber', 'container', 'cntr'),
+    'status': ('status', 'cntrstatus', 'containerstatus', 'movestatus', 'movementstatus', 'movetype', 'movementtype', 'event'),
+    'operator': ('lineoperator', 'line', 'lineopr', 'opr', 'operator', 'lineid', 'shippingline', 'lo'),
+    'size_type': ('sizetype', 'sztp', 'szty', 'sizeandtype', 'isocode', 'iso', 'equipmenttype', 'eqptype'),
+    'size': ('size', 'sz', 'cntrsize', 'containersize'),
+    'type': ('type', 'tp', 'ty', 'cntrtype', 'containertype'),
+    'full_empty': ('fe', 'fullempty', 'fullorempty', 'ef', 'emptyfull', 'fm', 'ladenempty', 'le', 'cntrfe'),
+}
+FULL_EMPTY_VALUES = {'F': 'F', 'FULL': 'F', 'FCL': 'F', 'LCL': 'F', 'L': 'F', 'LADEN': 'F',
+                     'E': 'E', 'M': 'E', 'MT': 'E', 'EMPTY': 'E', 'EMP': 'E'}
+
+def report_stats_enabled():
+    """REPORT_STATS=false 時唔解析報告，Email 表格只列檔名"""
+    return (os.environ.get('REPORT_STATS') or 'True').lower() == 'true'  # workflow 冇設 vars 時係空字串，當預設開
+
+def normalize_header(value):
+    return re.sub(r'[^a-z0-9]', '', str(value).lower()) if value is not None else ''
+
+def match_header(row):
+    """表頭行 → {統計欄位: 欄位位置}；每個欄位位置只用一次，按別名次序優先"""
+    headers = [normalize_header(cell) for cell in row]
+    positions, used = {}, set()
+    for field, aliases in REPORT_STAT_FIELDS.items():
+        for alias in aliases:
+            if alias in headers and headers.index(alias) not in used:
+                positions[field] = headers.index(alias)
+                used.add(positions[field])
+                break
+    return positions
+
+def iter_report_rows(file_path):
+    """逐行讀報告：xlsx 用 openpyxl read-only row iterator，CSV 用 csv.reader，都唔會成個檔讀入記憶體"""
+    if file_path.lower().endswith('.xlsx'):
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            for row in workbook.active.iter_rows(values_only=True):
+                yield row
+        finally:
+            workbook.close()
+    else:
+        with open(file_path, newline='', encoding='utf-8-sig', errors='replace') as f:
+            for row in csv.reader(f):
+                yield row
+
+class ColumnarTable:
+    """
+    投影後嘅欄位按列存：每欄一個唯一值清單 + array('I') 代碼，營運商、尺寸呢類重複值只存一次，
+    十幾萬行都只係每欄幾百 KB。
+    """
+    def __init__(self, positions):
+        self.positions = positions
+        self.values = {field: [] for field in positions}
+        self.lookup = {field: {} for field in positions}
+        self.codes = {field: array('I') for field in positions}
+        self.rows = 0
+
+    def append_chunk(self, rows):
+        for row in rows:
+            if not any(cell not in (None, '') for cell in row):
+                continue
+            self.rows += 1
+            for field, pos in self.positions.items():
+                value = row[pos] if pos < len(row) else None
+                value = '' if value is None else str(value).strip().upper()
+                code = self.lookup[field].get(value)
+                if code is None:
+                    code = self.lookup[field][value] = len(self.values[field])
+                    self.values[field].append(value)
+                self.codes[field].append(code)
+
+    def counts(self, field):
+        """欄位值 → 行數（唔計空值）"""
+        if field not in self.codes:
+            return Counter()
+        values = self.values[field]
+        return Counter({values[code]: n for code, n in Counter(self.codes[field]).items() if values[code]})
+
+    def pair_counts(self, first, second):
+        """兩欄合併計數，例如 size + type → 40HC"""
+        if first not in self.codes or second not in self.codes:
+            return Counter()
+        first_values, second_values = self.values[first], self.values[second]
+        pairs = Counter(zip(self.codes[first], self.codes[second]))
+        counts = Counter()
+        for (a, b), n in pairs.items():
+            if first_values[a] or second_values[b]:
+                counts[first_values[a] + second_values[b]] += n
+        return counts
+
+def find_header_row(head):
+    """頭幾行入面認到最多統計欄位嗰行當表頭；一個都認唔到就用第一行非空行"""
+    header_at = next((i for i, row in enumerate(head) if any(cell not in (None, '') for cell in row)), 0)
+    positions = {}
+    for i, row in enumerate(head):
+        matched = match_header(row)
+        if len(matched) > len(positions):
+            header_at, positions = i, matched
+    return header_at, positions
+
+def parse_report(file_path):
+    """串流解析一份報告，回傳 ColumnarTable（搵唔到表頭時 positions 係空，只計行數）"""
+    rows = iter_report_rows(file_path)
+    try:
+        head = list(islice(rows, HEADER_SCAN_ROWS))
+        header_at, positions = find_header_row(head)
+        table = ColumnarTable(positions)
+        table.append_chunk(head[header_at + 1:])
+        for chunk in iter(lambda: list(islice(rows, PARSE_CHUNK_ROWS)), []):
+            table.append_chunk(chunk)
+        return table
+    finally:
+        rows.close()
+
+def summarize_table(table):
+    full_empty = Counter()
+    for value, n in table.counts('full_empty').items():
+        full_empty[FULL_EMPTY_VALUES.get(value, value)] += n
+    return {
+        'rows': table.rows,
+        'containers': len(table.counts('container')) if 'container' in table.positions else None,
+        'full_empty': full_empty,
+        'operator': table.counts('operator'),
+        'size_type': table.counts('size_type') or table.pair_counts('size', 'type'),
+        'status': table.counts('status'),
+    }
+
+def summarize_reports(reports):
+    """reports: [(report_key, category, label, dir, file)] → {report_key: 摘要}；解析失敗只記 log，唔阻 Email"""
+    stats = {}
+    for report_key, _, _, dir_path, file_name in reports:
+        if report_key not in REPORT_STATS_KEYS or not file_name:
+            continue
+        start_time = time.time()
+        try:
+            table = parse_report(os.path.join(dir_path, file_name))
+            stats[report_key] = summarize_table(table)
+            logging.info("📊 解析 %s: %s 行，欄位 %s，用時 %.2fs", file_name, table.rows,
+                         ', '.join(table.positions) or '(搵唔到表頭)', time.time() - start_time)
+        except Exception as e:
+            logging.warning(f"📊 解析 {file_name} 失敗，表格只列檔名: {str(e)}")
+    return stats
+
+def format_report_stats(summary, top=5):
+    """摘要 → 一行文字，每類只列最多 top 個"""
+    def top_counts(counter):
+        items = counter.most_common(top)
+        text = ', '.join(f"{value} {n:,}" for value, n in items)
+        return text + (f", +{len(counter) - top} more" if len(counter) > top else '')
+    parts = [f"Rows {summary['rows']:,}" + (f" / Containers {summary['containers']:,}" if summary['containers'] is not None else '')]
+    for field, title in (('full_empty', 'F/E'), ('operator', 'Line'), ('size_type', 'Size/Type'), ('status', 'Status')):
+        if summary[field]:
+            parts.append(f"{title}: {top_counts(summary[field])}")
+    return ' | '.join(parts)
+
+# ==================== 報告歷史歸檔（Parquet + zstd，按日期/報告分區） ====================
+ARCHIVE_DIR = os.path.abspath("report_archive")
+ARCHIVE_MANIFEST_FILE = os.path.join(ARCHIVE_DIR, "manifest.json")
+ARCHIVE_RETAIN_DAYS = 400  # 超過呢個日數嘅分區會刪走，控制 workflow cache 大小
+
+def report_archive_enabled():
+    """REPORT_ARCHIVE=false 時唔歸檔"""
+    return (os.environ.get('REPORT_ARCHIVE') or 'True').lower() == 'true'  # workflow 冇設 vars 時係空字串，當預設開
+
+def archive_partition_name(report_key):
+    """house:IA17 → house_IA17，用做目錄名"""
+    return re.sub(r'[^A-Za-z0-9_-]', '_', report_key)
+
+def load_archive_manifest():
+    """{'partitions': {'<日期>/<報告>': {'date', 'report', 'path', 'source', 'sha256', 'rows', 'columns', 'bytes', 'archived_at'}}}"""
+    try:
+        with open(ARCHIVE_MANIFEST_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'partitions': {}}
+
+def save_archive_manifest(manifest):
+    tmp_path = ARCHIVE_MANIFEST_FILE + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, ARCHIVE_MANIFEST_FILE)
+
+def archive_column_names(header):
+    """表頭 → Parquet 欄名：空白表頭用 column_<n>，重複嘅加 _<n>"""
+    names = []
+    for i, cell in enumerate(header):
+        name = str(cell).strip() if cell not in (None, '') else f"column_{i + 1}"
+        base, n = name, 1
+        while name in names:
+            n += 1
+            name = f"{base}_{n}"
+        names.append(name)
+    return names
+
+def write_report_parquet(file_path, out_path):
     """
-    取匹配pattern最新file：**優先冇'(1)'括號**，再最新mod_time。
+    串流讀報告（同解析共用 row iterator），每 PARSE_CHUNK_ROWS 行寫一個 zstd row group；
+    所有欄位存做字串，唔同日子報告格式有變都唔會撞 schema。回傳 (欄名, 行數)，冇表頭回傳 None。
     """
+    rows = iter_report_rows(file_path)
     try:
-        all_files = [f for f in os.listdir(download_dir) 
-                     if pattern in f and (f.endswith('.csv') or f.endswith('.xlsx'))]
-        if not all_files:
+        head = list(islice(rows, HEADER_SCAN_ROWS))
+        header_at, _ = find_header_row(head)
+        if not head or not any(cell not in (None, '') for cell in head[header_at]):
             return None
-        
-        # **優先篩選：冇括號**
-        no_bracket_files = [f for f in all_files if '( ' not in f and ' (' not in f]
-        if no_bracket_files:
-            # 無括號中選最新
-            latest = max(no_bracket_files, key=lambda f: os.path.getmtime(os.path.join(download_dir, f)))
-        else:
-            # 全有括號，選最新
-            latest = max(all_files, key=lambda f: os.path.getmtime(os.path.join(download_dir, f)))
-        
-        logging.info(f"✅ 選最新 [{pattern}]: {latest} (優先無括號)")
-        return latest
-    except Exception as e:
-        logging.error(f"❌ get_latest_file ERR ({pattern}): {str(e)}")
+        names = archive_column_names(head[header_at])
+        schema = pa.schema([(name, pa.string()) for name in names])
+
+        def to_table(chunk):
+            chunk = [row for row in chunk if any(cell not in (None, '') for cell in row)]
+            columns = [[None if i >= len(row) or row[i] in (None, '') else str(row[i]) for row in chunk] for i in range(len(names))]
+            return pa.Table.from_arrays([pa.array(column, pa.string()) for column in columns], schema=schema)
+
+        tmp_path = out_path + '.tmp'
+        row_count = 0
+        writer = pq.ParquetWriter(tmp_path, schema, compression='zstd')
+        try:
+            for chunk in chain([head[header_at + 1:]], iter(lambda: list(islice(rows, PARSE_CHUNK_ROWS)), [])):
+                table = to_table(chunk)
+                if table.num_rows:
+                    writer.write_table(table)
+                    row_count += table.num_rows
+        finally:
+            writer.close()
+        os.replace(tmp_path, out_path)
+        return names, row_count
+    finally:
+        rows.close()
+
+def prune_report_archive(manifest, today):
+    cutoff = (datetime.strptime(today, '%Y-%m-%d') - timedelta(days=int(os.environ.get('ARCHIVE_RETAIN_DAYS', ARCHIVE_RETAIN_DAYS)))).strftime('%Y-%m-%d')
+    expired = sorted({entry['date'] for entry in manifest['partitions'].values() if entry['date'] < cutoff})
+    for date in expired:
+        shutil.rmtree(os.path.join(ARCHIVE_DIR, f"date={date}"), ignore_errors=True)
+    manifest['partitions'] = {key: entry for key, entry in manifest['partitions'].items() if entry['date'] >= cutoff}
+    if expired:
+        logging.info(f"🗄️ 歸檔: 刪走 {len(expired)} 日過期分區 ({expired[0]} ~ {expired[-1]})")
+
+def archive_reports(house_report_files, business_date=None, index=None):
+    """
+    成功發 Email 後將今日 CPLUS 同 Barge 報告轉做 report_archive/date=<日期>/report=<報告>/part-0.parquet，
+    manifest 記錄每個分區嘅欄位同行數，查詢時唔使 list 目錄或者開檔就揀到要讀嘅分區。內容 hash 一樣嘅分區唔會重寫。
+    """
+    if not report_archive_enabled():
+        return
+    business_date = business_date or datetime.now().strftime('%Y-%m-%d')
+    index = index or DownloadIndex.build()
+    reports = [('movement', cplus_download_dir, index.latest(cplus_download_dir, 'cntrMoveLog')),
+               ('onhand', cplus_download_dir, index.latest(cplus_download_dir, 'data_')),
+               ('barge', barge_download_dir, index.latest(barge_download_dir, 'ContainerDetailReport'))]
+    reports += [(f"house:{name}", cplus_download_dir, index.resolve(cplus_download_dir, info['file'])) for name, info in house_report_files.items()]
+
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    manifest = load_archive_manifest()
+    start_time = time.time()
+    raw_total = archived_total = written = 0
+    for report_key, dir_path, file_name in reports:
+        info = file_name and index.get(dir_path, file_name)
+        if not info:
+            continue
+        partition = archive_partition_name(report_key)
+        key = f"{business_date}/{partition}"
+        entry = manifest['partitions'].get(key)
+        if entry and entry['sha256'] == info['sha256'] and os.path.exists(os.path.join(ARCHIVE_DIR, entry['path'])):
+            continue
+        relative_path = os.path.join(f"date={business_date}", f"report={partition}", "part-0.parquet")
+        out_path = os.path.join(ARCHIVE_DIR, relative_path)
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        try:
+            result = write_report_parquet(os.path.join(dir_path, file_name), out_path)
+        except Exception as e:
+            logging.warning(f"🗄️ 歸檔 {file_name} 失敗: {str(e)}")
+            continue
+        if not result:
+            logging.warning(f"🗄️ 歸檔 {file_name}: 搵唔到表頭，跳過")
+            continue
+        names, row_count = result
+        archived_bytes = os.path.getsize(out_path)
+        manifest['partitions'][key] = {'date': business_date, 'report': partition, 'path': relative_path, 'source': file_name,
+                                       'sha256': info['sha256'], 'rows': row_count, 'columns': names, 'bytes': archived_bytes,
+                                       'archived_at': datetime.now().isoformat(timespec='seconds')}
+        raw_total += os.path.getsize(os.path.join(dir_path, file_name))
+        archived_total += archived_bytes
+        written += 1
+    prune_report_archive(manifest, business_date)
+    save_archive_manifest(manifest)
+    logging.info("🗄️ 歸檔 %s: 寫入 %s 個分區，%.2f MB → %.2f MB (Parquet zstd)，用時 %.2fs", business_date, written,
+                 raw_total / 1048576, archived_total / 1048576, time.time() - start_time)
+
+def query_archive(report_key, columns=None, since=None, until=None):
+    """
+    讀歷史報告：按 manifest 揀 [since, until] 範圍內嘅分區，每個分區只讀 columns 指定嘅欄位
+    （分區冇嗰欄就補 null），加一欄 business_date 後合併成一個 pyarrow Table；冇資料回傳 None。
+    """
+    partition = archive_partition_name(report_key)
+    entries = sorted((entry for entry in load_archive_manifest()['partitions'].values()
+                      if entry['report'] == partition and (not since or entry['date'] >= since) and (not until or entry['date'] <= until)),
+                     key=lambda entry: entry['date'])
+    tables = []
+    for entry in entries:
+        wanted = [c for c in columns if c in entry['columns']] if columns else None
+        table = pq.read_table(os.path.join(ARCHIVE_DIR, entry['path']), columns=wanted)
+        tables.append(table.append_column('business_date', pa.array([entry['date']] * table.num_rows, pa.string())))
+    if not tables:
         return None
-        
-def send_daily_email(house_report_files, house_button_count, cplus_dir, barge_dir):
+    names = list(columns or [])
+    for table in tables:
+        names += [name for name in table.column_names if name not in names and name != 'business_date']
+    names.append('business_date')
+    return pa.concat_tables([pa.table({name: table.column(name) if name in table.column_names else pa.nulls(table.num_rows, pa.string())
+                                       for name in names}) for table in tables])
+
+# ==================== 串流 MIME 同 SMTP 傳送 ====================
+MIME_CHUNK_SIZE = 57 * 1024 * 16  # 57 bytes 原始資料 = 一行 76 字元 base64，分塊後行仍然對齊
+
+def encode_attachment(file_path):
+    """分塊讀檔、base64 編碼（CRLF 行尾）寫入臨時檔，記憶體只佔一塊；回傳 (編碼檔路徑, 原始 bytes, 編碼 bytes)"""
+    fd, encoded_path = tempfile.mkstemp(suffix='.b64')
+    raw_bytes = 0
+    with os.fdopen(fd, 'wb') as out, open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(MIME_CHUNK_SIZE), b''):
+            raw_bytes += len(chunk)
+            out.write(base64.encodebytes(chunk).replace(b'\n', b'\r\n'))
+    return encoded_path, raw_bytes, os.path.getsize(encoded_path)
+
+def fold_headers(items):
+    return b''.join(email.policy.SMTP.fold(name, value).encode('ascii', 'surrogateescape') for name, value in items)
+
+def dot_stuff(data):
+    """SMTP DATA 入面以 '.' 開頭嘅行要加多一個 '.'"""
+    return re.sub(rb'(?m)^\.', b'..', data)
+
+class StreamingMessage:
     """
-    全英Email：Subject大寫 + 日誌列所有附件file。
+    multipart/mixed 郵件：頭同文字部分（細）放記憶體，附件用預先編碼好嘅臨時檔（多封郵件共用同一份），
+    chunks() 逐塊輸出成封郵件，唔會一次過喺記憶體砌出完整內容。
     """
-    load_dotenv()
+    def __init__(self, headers, text_part, attachments):
+        self.headers = headers
+        self.text_part = text_part
+        self.attachments = attachments  # [(file_name, encoded_path)]
+        self.boundary = f"===============HIT{random.getrandbits(64):016x}=="
+        self.encoded_bytes = sum(os.path.getsize(path) for _, path in attachments)
+
+    def chunks(self):
+        boundary = self.boundary.encode('ascii')
+        yield fold_headers(self.headers + [
+            ('MIME-Version', '1.0'),
+            ('Content-Type', f'multipart/mixed; boundary="{self.boundary}"'),
+        ]) + b'\r\n'
+        yield b'--' + boundary + b'\r\n' + dot_stuff(self.text_part.as_bytes(policy=email.policy.SMTP)) + b'\r\n'
+        for file_name, encoded_path in self.attachments:
+            part = MIMEBase('application', 'octet-stream')
+            part.add_header('Content-Transfer-Encoding', 'base64')
+            part.add_header('Content-Disposition', 'attachment', filename=file_name)
+            yield b'--' + boundary + b'\r\n' + fold_headers(part.items()) + b'\r\n'
+            # 每次輸出都自己開檔，幾條 thread 同時傳唔同郵件都唔會搶檔案位置
+            with open(encoded_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(MIME_CHUNK_SIZE), b''):
+                    yield chunk
+        yield b'--' + boundary + b'--\r\n'
+
+def smtp_send_streaming(server, sender, recipients, message):
+    """MAIL/RCPT/DATA 逐步做，DATA 內容由 message.chunks() 直接寫落 SMTP socket；回傳 (bytes, 被拒收件人)"""
+    server.ehlo_or_helo_if_needed()
+    code, resp = server.mail(sender)
+    if code != 250:
+        raise smtplib.SMTPSenderRefused(code, resp, sender)
+    refused = {}
+    for recipient in recipients:
+        code, resp = server.rcpt(recipient)
+        if code not in (250, 251):
+            refused[recipient] = (code, resp)
+    if len(refused) == len(recipients):
+        server.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+    code, resp = server.docmd('DATA')
+    if code != 354:
+        raise smtplib.SMTPDataError(code, resp)
+    sent_bytes = 0
+    for chunk in message.chunks():
+        server.send(chunk)
+        sent_bytes += len(chunk)
+    server.send(b'.\r\n')
+    code, resp = server.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, resp)
+    return sent_bytes, refused
+
+class SMTPConnectionPool:
+    """
+    少量已登入嘅 SMTP 連線俾幾條 thread 輪流用（唔使每封郵件都重新 STARTTLS + LOGIN），
+    連線斷咗就丟棄，下次借用時重新開。
+    """
+    def __init__(self, host, port, user, password, size=2):
+        self.host, self.port, self.user, self.password = host, port, user, password
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def connect(self):
+        server = smtplib.SMTP(self.host, self.port)
+        server.starttls()
+        server.login(self.user, self.password)
+        return server
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            create = self.created < self.size
+            if create:
+                self.created += 1
+        if not create:
+            return self.idle.get()
+        try:
+            server = self.connect()
+        except Exception:
+            with self.lock:
+                self.created -= 1
+            raise
+        with self.lock:
+            self.connections.append(server)
+        return server
+
+    def release(self, server, broken=False):
+        if not broken:
+            self.idle.put(server)
+            return
+        with self.lock:
+            self.created -= 1
+            if server in self.connections:
+                self.connections.remove(server)
+        try:
+            server.close()
+        except Exception:
+            pass
+
+    def send(self, sender, recipients, message):
+        """借一條連線傳送；連線中途斷咗就換一條新連線再試一次"""
+        for attempt in range(2):
+            server = self.acquire()
+            try:
+                result = smtp_send_streaming(server, sender, recipients, message)
+                self.release(server)
+                return result
+            except (smtplib.SMTPServerDisconnected, ConnectionError, OSError) as e:
+                self.release(server, broken=True)
+                if attempt == 1:
+                    raise
+                logging.warning("SMTP 連線中斷，換新連線再試: %s", str(e))
+            except Exception:
+                self.release(server)
+                raise
+
+    def close(self):
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for server in connections:
+            try:
+                server.quit()
+            except Exception:
+                pass
+
+# ==================== 附件打包（壓縮、估算大小、按上限分拆） ====================
+MAIL_MAX_BYTES = 20 * 1024 * 1024  # Zoho 單封郵件上限（編碼後）
+MIME_PART_OVERHEAD = 512  # 每個附件 part 嘅 boundary 同 header
+MIME_TEXT_OVERHEAD = 64 * 1024  # 郵件頭同文字/HTML 摘要
+
+def mail_compress_enabled():
+    """MAIL_COMPRESS=true 時附件先壓成 zip（壓縮後細唔到 5% 就照用原檔）"""
+    return os.environ.get('MAIL_COMPRESS', 'False').lower() == 'true'
+
+def estimate_base64_size(size):
+    """base64 編碼後大小（每 76 字元一行 CRLF）"""
+    encoded = 4 * ((size + 2) // 3)
+    return encoded + 2 * ((encoded + 75) // 76)
+
+def package_attachment(file_path, file_name, compress):
+    """壓縮（可選）後即刻分塊 base64 編碼，之後所有郵件共用呢份編碼檔"""
+    size = os.path.getsize(file_path)
+    package = {'source': file_name, 'name': file_name, 'path': file_path, 'raw_size': size, 'size': size, 'temp': False}
+    if compress:
+        fd, zip_path = tempfile.mkstemp(suffix='.zip')
+        os.close(fd)
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=6) as zf:
+            zf.write(file_path, arcname=file_name)
+        zip_size = os.path.getsize(zip_path)
+        if zip_size < size * 0.95:
+            package.update(name=f"{file_name}.zip", path=zip_path, size=zip_size, temp=True)
+        else:
+            os.remove(zip_path)
+    package['encoded_size'] = estimate_base64_size(package['size']) + MIME_PART_OVERHEAD
+    package['encoded_path'], _, package['encoded_bytes'] = encode_attachment(package['path'])
+    return package
+
+def package_attachments(files, compress=False, workers=None):
+    """每個檔案一個 worker 並行打包同編碼，順序同輸入一樣；回傳 package dict 清單"""
+    if not files:
+        return []
+    workers = workers or int(os.environ.get('MAIL_ENCODE_WORKERS', 4))
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(files))), thread_name_prefix='pack') as executor:
+        packages = list(executor.map(lambda f: package_attachment(f[0], f[1], compress), files))
+    raw_total = sum(p['raw_size'] for p in packages)
+    packed_total = sum(p['size'] for p in packages)
+    encoded_total = sum(p['encoded_bytes'] for p in packages)
+    logging.info("🗜️ 附件打包: %s 個 %.2f MB → %.2f MB (%s) → base64 %.2f MB，用時 %.2fs", len(packages), raw_total / 1048576,
+                 packed_total / 1048576, '壓縮' if compress else '不壓縮', encoded_total / 1048576, time.time() - start_time)
+    return packages
+
+def split_packages(packages, max_bytes):
+    """按次序塞入郵件，估算編碼後大小超過上限就開新一封；單一附件超過上限就自己一封"""
+    messages, current, current_size = [], [], MIME_TEXT_OVERHEAD
+    for package in packages:
+        if current and current_size + package['encoded_size'] > max_bytes:
+            messages.append(current)
+            current, current_size = [], MIME_TEXT_OVERHEAD
+        if MIME_TEXT_OVERHEAD + package['encoded_size'] > max_bytes:
+            logging.warning(f"📦 附件 {package['name']} 估算 {package['encoded_size'] / 1048576:.2f} MB，單獨一封都超過上限")
+        current.append(package)
+        current_size += package['encoded_size']
+    if current:
+        messages.append(current)
+    return messages or [[]]
+
+def cleanup_packages(packages):
+    for package in packages:
+        paths = [package.get('encoded_path')] + ([package['path']] if package['temp'] else [])
+        for path in paths:
+            try:
+                if path:
+                    os.remove(path)
+            except OSError:
+                pass
+
+# ==================== 發送記錄（按內容 hash 跳過未變附件） ====================
+DELIVERY_LEDGER_FILE = os.path.abspath("delivery_ledger.json")
+
+def skip_unchanged_enabled():
+    """SKIP_UNCHANGED=true 時，內容同上次已發送一樣嘅報告唔再夾附件，表格註明 unchanged since <日期>"""
+    return os.environ.get('SKIP_UNCHANGED', 'False').lower() == 'true'
+
+def load_delivery_ledger():
+    """{收件組: {report_key: {'sha256', 'file', 'sent_date'}}}；舊版單層格式當作 default 組"""
     try:
-        smtp_server = os.environ.get('SMTP_SERVER', 'smtp.zoho.com')
-        smtp_port = int(os.environ.get('SMTP_PORT', 587))
-        sender_email = os.environ['ZOHO_EMAIL']
-        sender_password = os.environ['ZOHO_PASSWORD']
-        receiver_emails = os.environ.get('RECEIVER_EMAILS', 'ckeqc@ckline.com.hk').split(',')
-        cc_emails = os.environ.get('CC_EMAILS', '').split(',') if os.environ.get('CC_EMAILS') else []
-        dry_run = os.environ.get('DRY_RUN', 'False').lower() == 'true'
-        gen_time = datetime.now().strftime('%d/%m/%Y %H:%M')
+        with open(DELIVERY_LEDGER_FILE, encoding='utf-8') as f:
+            ledger = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if any(isinstance(v, dict) and 'sha256' in v for v in ledger.values()):
+        ledger = {'default': ledger}
+    return ledger
 
-        # 最新file (優先無(1))
-        movement_file = get_latest_file(cplus_dir, 'cntrMoveLog')
-        onhand_file = get_latest_file(cplus_dir, 'data_')
-        barge_file = get_latest_file(barge_dir, 'ContainerDetailReport')
+def save_delivery_ledger(ledger):
+    tmp_path = DELIVERY_LEDGER_FILE + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(ledger, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, DELIVERY_LEDGER_FILE)
 
-        # House: 按mod_time排序(最新先)
-        sorted_house = sorted(house_report_files.items(), key=lambda x: x[1]['mod_time'], reverse=True)
-        house_download_count = len(sorted_house)
-
-        # 附件清單
-        attachments = []
-        if movement_file: attachments.append((cplus_dir, movement_file))
-        if onhand_file: attachments.append((cplus_dir, onhand_file))
-        if barge_file: attachments.append((barge_dir, barge_file))
-        for _, info in sorted_house:
-            attachments.append((cplus_dir, info['file']))
-
-        # **日誌：列所有附件file**
-        attach_names = [f[1] for f in attachments]
-        logging.info("📤 Email Attachments (%s files): %s", len(attach_names), ', '.join(attach_names))
-
-        # HTML (全英)
-        style = """
+def update_delivery_ledger(ledger, group_name, delivered, sent_date):
+    """delivered: [(report_key, file_name, sha256)]；內容有變先更新 sent_date，未變就保留原本日期"""
+    group_ledger = ledger.setdefault(group_name, {})
+    for report_key, file_name, sha256 in delivered:
+        entry = group_ledger.get(report_key)
+        if not entry or entry['sha256'] != sha256:
+            group_ledger[report_key] = {'sha256': sha256, 'file': file_name, 'sent_date': sent_date}
+        else:
+            entry['file'] = file_name
+
+# ==================== 收件組（每組只收指定報告） ====================
+MAIL_GROUPS_FILE = os.path.abspath("mail_groups.json")
+
+def split_addresses(value):
+    if isinstance(value, str):
+        value = value.split(',')
+    return [address.strip() for address in value or [] if address.strip()]
+
+def load_mail_groups(receiver_emails, cc_emails):
+    """
+    MAIL_GROUPS（JSON 字串）或 mail_groups.json：{"組名": {"to": [...], "cc": [...], "reports": ["movement", "house:IA17*", ...]}}。
+    reports 支援 movement / onhand / barge / house（全部 Housekeeping）/ house:<報告名稱 pattern> / *；
+    冇設定就用 RECEIVER_EMAILS / CC_EMAILS 做一個收晒全部報告嘅 default 組。
+    """
+    config = os.environ.get('MAIL_GROUPS')
+    try:
+        if config:
+            groups = json.loads(config)
+        elif os.path.exists(MAIL_GROUPS_FILE):
+            with open(MAIL_GROUPS_FILE, encoding='utf-8') as f:
+                groups = json.load(f)
+        else:
+            groups = None
+    except ValueError as e:
+        logging.error(f"收件組設定格式錯誤，改用 RECEIVER_EMAILS: {str(e)}")
+        groups = None
+    if not groups:
+        return {'default': {'to': receiver_emails, 'cc': cc_emails, 'reports': ['*']}}
+    return {name: {'to': split_addresses(group.get('to')), 'cc': split_addresses(group.get('cc')), 'reports': group.get('reports') or ['*']}
+            for name, group in groups.items()}
+
+def report_selected(report_key, selectors):
+    return any(selector == '*' or report_key == selector or (selector == 'house' and report_key.startswith('house:'))
+               or fnmatch.fnmatchcase(report_key, selector) for selector in selectors)
+
+def build_summary_bodies(gen_time, reports, house_button_count, file_cell, attached_count, unchanged_count, part_count, stats=None):
+    """按呢封郵件包含嘅報告砌 HTML 同純文字摘要（reports: [(report_key, category, label, dir, file)]，stats: 解析統計）"""
+    style = """
         <style>table{border-collapse:collapse;width:100%;font-family:Arial;font-size:14px;}
         th,td{border:1px solid #ddd;padding:10px;text-align:left;}
         th{background:#f2f2f2;font-weight:bold;}
         .sum{background:#e7f3ff;font-weight:bold;}
         </style>
         """
-        num_house = len(sorted_house)
-        body_html = f"""
+    categories = {}
+    for report in reports:
+        categories.setdefault(report[1], []).append(report)
+    house_reports = [r for r in reports if r[0].startswith('house:')]
+    stats = {key: format_report_stats(summary) for key, summary in (stats or {}).items() if key in {r[0] for r in reports}}
+    columns = 4 if stats else 3
+    body_html = f"""
         <html><head>{style}</head><body>
         <h2>HIT Daily Reports ({gen_time})</h2>
         <table>
-        <thead><tr><th>Category</th><th>Report</th><th>File</th></tr></thead>
+        <thead><tr><th>Category</th><th>Report</th><th>File</th>{'<th>Summary</th>' if stats else ''}</tr></thead>
         <tbody>
-        <tr><td rowspan="{2+num_house}">CPLUS</td><td>CONTAINER MOVEMENT</td><td>{movement_file}</td></tr>
-        <tr><td>ONHAND CONTAINER LIST</td><td>{onhand_file}</td></tr>
         """
-        for name, info in sorted_house:
-            body_html += f'<tr><td>{name}</td><td>{info["file"]}</td></tr>'
-        body_html += f"""
-        <tr><td rowspan="1">BARGE</td><td>CONTAINER DETAIL REPORT</td><td>{barge_file}</td></tr>
-        <tr class="sum"><td colspan="3">Housekeeping: {house_download_count}/{house_button_count} | Total Attachments: {len(attachments)}</td></tr>
+    for category, rows in categories.items():
+        for i, (report_key, _, label, _, file_name) in enumerate(rows):
+            category_cell = f'<td rowspan="{len(rows)}">{category}</td>' if i == 0 else ''
+            stats_cell = f'<td>{html.escape(stats.get(report_key, ""))}</td>' if stats else ''
+            body_html += f'<tr>{category_cell}<td>{label}</td><td>{file_cell(file_name)}</td>{stats_cell}</tr>'
+    summary = f"Total Attachments: {attached_count}"
+    if house_reports:
+        summary = f"Housekeeping: {len(house_reports)}/{house_button_count} | " + summary
+    if unchanged_count:
+        summary += f" | Unchanged: {unchanged_count}"
+    if part_count > 1:
+        summary += f" | Emails: {part_count}"
+    body_html += f"""
+        <tr class="sum"><td colspan="{columns}">{summary}</td></tr>
         </tbody></table></body></html>
         """
 
-        # Plain (全英)
-        house_list = '\n'.join([f"  - {name}: {info['file']}" for name, info in sorted_house])
-        plain_body = f"""HIT Daily Reports ({gen_time})
+    def plain_line(report_key, label, file_name):
+        return f"- {label}: {file_cell(file_name)}\n" + (f"    {stats[report_key]}\n" if report_key in stats else '')
+
+    plain_body = f"HIT Daily Reports ({gen_time})\n"
+    cplus_rows = [r for r in categories.get('CPLUS', []) if not r[0].startswith('house:')]
+    if cplus_rows:
+        plain_body += "\nCPLUS:\n" + ''.join(plain_line(report_key, label, file_name) for report_key, _, label, _, file_name in cplus_rows)
+    if house_reports:
+        plain_body += f"\nHousekeeping Reports ({len(house_reports)}/{house_button_count}):\n" + ''.join(f"  - {label}: {file_cell(file_name)}\n" for _, _, label, _, file_name in house_reports)
+    for category, rows in categories.items():
+        if category != 'CPLUS':
+            plain_body += f"\n{category}:\n" + ''.join(plain_line(report_key, label, file_name) for report_key, _, label, _, file_name in rows)
+    plain_body += f"\nTotal Attachments: {attached_count}"
+    if part_count > 1:
+        plain_body += f" (split into {part_count} emails)"
+    if unchanged_count:
+        plain_body += f", {unchanged_count} unchanged not attached"
+    plain_body += "\nAll files OK!\n"
+    return body_html, plain_body
+
+def send_daily_email(house_report_files, house_button_count, cplus_dir, barge_dir, index=None):
+    """
+    全英Email：Subject大寫 + 日誌列所有附件file。檔案資料由 DownloadIndex 提供，唔再掃目錄。
+    Movement / OnHand / Barge 報告會串流解析，狀態、營運商、尺寸類型、F/E 統計列喺摘要表。
+    每個收件組按自己嘅報告子集收信；子集一樣嘅組共用同一封郵件，附件只打包編碼一次，經 SMTP 連線池並行傳送。
+    回傳係咪全部發送成功。
+    """
+    load_dotenv()
+    packages = []
+    smtp_pool = None
+    try:
+        smtp_server = os.environ.get('SMTP_SERVER', 'smtp.zoho.com')
+        smtp_port = int(os.environ.get('SMTP_PORT', 587))
+        sender_email = os.environ['ZOHO_EMAIL']
+        sender_password = os.environ['ZOHO_PASSWORD']
+        receiver_emails = os.environ.get('RECEIVER_EMAILS', 'ckeqc@ckline.com.hk').split(',')
+        cc_emails = os.environ.get('CC_EMAILS', '').split(',') if os.environ.get('CC_EMAILS') else []
+        dry_run = os.environ.get('DRY_RUN', 'False').lower() == 'true'
+        gen_time = datetime.now().strftime('%d/%m/%Y %H:%M')
+
+        index = index or DownloadIndex.build([cplus_dir, barge_dir])
+        # 最新file (重複 "(1)" 副本已按 hash 合併)
+        movement_file = index.latest(cplus_dir, 'cntrMoveLog')
+        onhand_file = index.latest(cplus_dir, 'data_')
+        barge_file = index.latest(barge_dir, 'ContainerDetailReport')
+
+        # House: 檔名轉返保留嘅原檔，按mod_time排序(最新先)
+        house_report_files = {name: dict(info, file=index.resolve(cplus_dir, info['file'])) for name, info in house_report_files.items()}
+        sorted_house = sorted(house_report_files.items(), key=lambda x: x[1]['mod_time'], reverse=True)
 
-CPLUS:
-- CONTAINER MOVEMENT: {movement_file}
-- ONHAND CONTAINER LIST: {onhand_file}
+        # 報告清單 (report_key, category, label, dir, file)，report_key 用嚟揀收件組子集同對發送記錄
+        reports = [('movement', 'CPLUS', 'CONTAINER MOVEMENT', cplus_dir, movement_file),
+                   ('onhand', 'CPLUS', 'ONHAND CONTAINER LIST', cplus_dir, onhand_file)]
+        reports += [(f"house:{name}", 'CPLUS', name, cplus_dir, info['file']) for name, info in sorted_house]
+        reports.append(('barge', 'BARGE', 'CONTAINER DETAIL REPORT', barge_dir, barge_file))
+        # 串流解析 Movement / OnHand / Barge，統計放入摘要表（每份只解析一次，所有收件組共用）
+        stats = summarize_reports(reports) if report_stats_enabled() else {}
 
-Housekeeping Reports ({house_download_count}/{house_button_count}):
-{house_list}
+        # 每組揀報告子集，再按上次發送記錄剔走內容未變嘅；(子集, 未變) 一樣嘅組合併成一封
+        groups = load_mail_groups(receiver_emails, cc_emails)
+        ledger = load_delivery_ledger()
+        deliveries = {}
+        for group_name, group in groups.items():
+            selected = [r for r in reports if report_selected(r[0], group['reports'])]
+            unchanged = {}  # file_name -> 上次發送日期
+            if skip_unchanged_enabled():
+                group_ledger = ledger.get(group_name, {})
+                for report_key, _, _, dir_path, file_name in selected:
+                    entry, info = group_ledger.get(report_key), file_name and index.get(dir_path, file_name)
+                    if entry and info and entry['sha256'] == info['sha256']:
+                        unchanged[file_name] = entry['sent_date']
+            key = (tuple(r[0] for r in selected), tuple(sorted(unchanged.items())))
+            delivery = deliveries.setdefault(key, {'groups': [], 'to': [], 'cc': [], 'reports': selected, 'unchanged': unchanged})
+            delivery['groups'].append(group_name)
+            delivery['to'] += [a for a in group['to'] if a not in delivery['to']]
+            delivery['cc'] += [a for a in group['cc'] if a not in delivery['cc']]
+        for delivery in deliveries.values():
+            delivery['attachments'] = [(dir_path, file_name) for _, _, _, dir_path, file_name in delivery['reports']
+                                       if file_name and file_name not in delivery['unchanged'] and index.get(dir_path, file_name)]
+            # **日誌：列所有附件file**
+            logging.info("📤 Email [%s] Attachments (%s files): %s", ', '.join(delivery['groups']), len(delivery['attachments']),
+                         ', '.join(f for _, f in delivery['attachments']))
+            if delivery['unchanged']:
+                logging.info("♻️ [%s] 內容未變，唔再夾附件 (%s 個): %s", ', '.join(delivery['groups']), len(delivery['unchanged']),
+                             ', '.join(f"{f} (since {d})" for f, d in delivery['unchanged'].items()))
 
-BARGE:
-- CONTAINER DETAIL REPORT: {barge_file}
+        # 所有組用到嘅附件只打包同編碼一次
+        needed = []
+        for delivery in deliveries.values():
+            needed += [a for a in delivery['attachments'] if a not in needed]
+        packages = package_attachments([(os.path.join(dir_path, file_name), file_name) for dir_path, file_name in needed], mail_compress_enabled())
+        package_by_source = {package['source']: package for package in packages}
+        max_bytes = int(os.environ.get('MAIL_MAX_BYTES') or MAIL_MAX_BYTES)  # workflow 冇設 vars 時係空字串
 
-Total Attachments: {len(attachments)}
-All files OK!
-"""
+        # 每個子集：估算大小 → 超過上限分拆 → 砌郵件（附件共用編碼檔）
+        outgoing = []  # (delivery, subject, StreamingMessage)
+        for delivery in deliveries.values():
+            message_groups = split_packages([package_by_source[f] for _, f in delivery['attachments']], max_bytes)
+            part_count = len(message_groups)
+            part_of = {package['source']: (part_no, package['name']) for part_no, group in enumerate(message_groups, 1) for package in group}
+            if part_count > 1:
+                logging.info("✂️ [%s] 附件估算超過 %.1f MB 上限，分拆成 %s 封: %s", ', '.join(delivery['groups']), max_bytes / 1048576, part_count,
+                             ' | '.join(f"Part {i}: {len(g)} 個 {sum(p['encoded_size'] for p in g) / 1048576:.2f} MB" for i, g in enumerate(message_groups, 1)))
 
-        # Email (Subject **全大寫**)
-        msg = MIMEMultipart('alternative')
-        msg['From'] = sender_email
-        msg['To'] = ', '.join(receiver_emails)
-        if cc_emails: msg['Cc'] = ', '.join(cc_emails)
-        msg['Subject'] = f"HIT DAILY REPORTS - {gen_time.upper()}"
-        msg.attach(MIMEText(body_html, 'html'))
-        msg.attach(MIMEText(plain_body, 'plain'))
-
-        # 加附件
-        for dir_path, file_name in attachments:
-            file_path = os.path.join(dir_path, file_name)
-            if os.path.exists(file_path):
-                part = MIMEBase('application', 'octet-stream')
-                with open(file_path, 'rb') as f:
-                    part.set_payload(f.read())
-                encoders.encode_base64(part)
-                part.add_header(f'Content-Disposition', f'attachment; filename="{file_name}"')
-                msg.attach(part)
+            def file_cell(file_name, part_of=part_of, part_count=part_count, unchanged=delivery['unchanged']):
+                """每封郵件嘅摘要表都一樣：列晒呢組嘅報告，分拆時註明喺邊一封，未變嘅註明上次發送日期"""
+                if file_name in unchanged:
+                    return f"{file_name} (unchanged since {unchanged[file_name]})"
+                if file_name not in part_of:
+                    return f"{file_name}"
+                part_no, package_name = part_of[file_name]
+                return package_name + (f" (Part {part_no}/{part_count})" if part_count > 1 else '')
+
+            body_html, plain_body = build_summary_bodies(gen_time, delivery['reports'], house_button_count, file_cell,
+                                                         len(delivery['attachments']), len(delivery['unchanged']), part_count, stats)
+            for part_no, group in enumerate(message_groups, 1):
+                # Email (Subject **全大寫**)
+                subject = f"HIT DAILY REPORTS - {gen_time.upper()}" + (f" (PART {part_no}/{part_count})" if part_count > 1 else '')
+                headers = [('From', sender_email), ('To', ', '.join(delivery['to']))]
+                if delivery['cc']: headers.append(('Cc', ', '.join(delivery['cc'])))
+                headers += [('Subject', subject), ('Date', formatdate(localtime=True)), ('Message-ID', make_msgid())]
+                text_part = MIMEMultipart('alternative')
+                text_part.attach(MIMEText(plain_body, 'plain'))
+                text_part.attach(MIMEText(body_html, 'html'))
+                message = StreamingMessage(headers, text_part, [(p['name'], p['encoded_path']) for p in group])
+                logging.info("📦 MIME [%s] %s/%s: %s 個附件 base64 %.2f MB (估算 %.2f MB)", ', '.join(delivery['groups']), part_no, part_count,
+                             len(group), message.encoded_bytes / 1048576, sum(p['encoded_size'] for p in group) / 1048576)
+                outgoing.append((delivery, subject, message))
 
         if dry_run:
-            logging.info("🧪 DRY RUN: Subject=%s | Files listed above", msg['Subject'])
-            return
+            for delivery, subject, message in outgoing:
+                rendered_bytes = sum(len(chunk) for chunk in message.chunks())
+                logging.info("🧪 DRY RUN: [%s] Subject=%s | 收件人 %s | 郵件 %s bytes | Files listed above",
+                             ', '.join(delivery['groups']), subject, len(delivery['to']) + len(delivery['cc']), rendered_bytes)
+            return True
 
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(sender_email, sender_password)
-        server.sendmail(sender_email, receiver_emails + cc_emails, msg.as_string())
-        server.quit()
-        logging.info("✅ Email Sent: %s files (listed above)", len(attachments))
+        # SMTP 連線池並行傳送
+        start_time = time.time()
+        pool_size = max(1, min(int(os.environ.get('SMTP_POOL_SIZE') or 2), len(outgoing)))
+        smtp_pool = SMTPConnectionPool(smtp_server, smtp_port, sender_email, sender_password, pool_size)
+
+        def deliver(item):
+            delivery, subject, message = item
+            sent_bytes, refused = smtp_pool.send(sender_email, delivery['to'] + delivery['cc'], message)
+            if refused:
+                logging.warning("⚠️ [%s] 部分收件人被拒: %s", ', '.join(delivery['groups']), ', '.join(refused))
+            logging.info("✉️ [%s] %s | 傳送 %s bytes", ', '.join(delivery['groups']), subject, sent_bytes)
+            return sent_bytes
+
+        with ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='smtp') as executor:
+            futures = [(item, executor.submit(deliver, item)) for item in outgoing]
+        failed_groups = set()
+        total_sent = 0
+        for (delivery, subject, _), future in futures:
+            try:
+                total_sent += future.result()
+            except Exception as e:
+                logging.error("❌ [%s] %s 發送失敗: %s", ', '.join(delivery['groups']), subject, str(e))
+                failed_groups.update(delivery['groups'])
+        logging.info("✅ Email Sent: %s 封 (%s 個收件組，%s 條 SMTP 連線) | 傳送 %s bytes，SMTP 用時 %.2fs",
+                     len(outgoing) - sum(1 for d, _, _ in outgoing if set(d['groups']) & failed_groups), len(groups), pool_size,
+                     total_sent, time.time() - start_time)
+
+        # 全部 part 都發送成功嘅組先更新記錄；未變嘅保留原本發送日期
+        sent_date = datetime.now().strftime('%Y-%m-%d')
+        for delivery in deliveries.values():
+            delivered = [(report_key, file_name, index.get(dir_path, file_name)['sha256'])
+                         for report_key, _, _, dir_path, file_name in delivery['reports'] if file_name and index.get(dir_path, file_name)]
+            for group_name in delivery['groups']:
+                if group_name not in failed_groups:
+                    update_delivery_ledger(ledger, group_name, delivered, sent_date)
+        save_delivery_ledger(ledger)
+        return not failed_groups
 
     except Exception as e:
         logging.error("❌ Email ERR: %s", str(e))
-        
-def main():
-    load_dotenv()
-    clear_download_dirs()
-    cplus_files = set()
-    house_file_count = 0
-    house_button_count = 0
-    barge_files = set()
-    cplus_driver = None
-    house_report_files = {}
-    # Process CPLUS
-    cplus_files, house_file_count, house_button_count, cplus_driver, house_report_files = process_cplus()
-    if cplus_driver:
-        cplus_driver.quit()
-        logging.info("CPLUS WebDriver 關閉")
-    # Process Barge
-    barge_files, barge_driver = process_barge()
-    if barge_driver:
-        barge_driver.quit()
-        logging.info("Barge WebDriver 關閉")
-    # Check all downloaded files
-    # **嚴格檢查：全齊才發**
-    movement_file = get_latest_file(cplus_download_dir, 'cntrMoveLog')
-    onhand_file = get_latest_file(cplus_download_dir, 'data_')
-    barge_file = get_latest_file(barge_download_dir, 'ContainerDetailReport')
+        return False
+    finally:
+        if smtp_pool:
+            smtp_pool.close()
+        cleanup_packages(packages)
+
+def run_sites_concurrently(pool=None, manifest=None):
+    """
+    CPLUS 同 Barge 各自用獨立 driver（或共用 Chrome 嘅獨立 context）同下載目錄，兩條 pipeline 並行跑，等齊結果先返回。
+    """
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix='site') as executor:
+        cplus_future = executor.submit(process_cplus, pool, manifest)
+        barge_future = executor.submit(process_barge, pool, manifest)
+        cplus_files, house_file_count, house_button_count, cplus_driver, house_report_files = cplus_future.result()
+        barge_files, barge_driver = barge_future.result()
+    for name, driver in (('CPLUS', cplus_driver), ('Barge', barge_driver)):
+        if driver:
+            log_browser_metrics(driver, name)
+            try:
+                driver.quit()
+                logging.info(f"{name} WebDriver 關閉")
+            except Exception as e:
+                logging.warning(f"{name} WebDriver 關閉失敗: {str(e)}")
+    return cplus_files, house_file_count, house_button_count, house_report_files, barge_files
+
+def check_and_send_email(house_report_files, house_button_count):
+    """
+    檢查所有報告是否齊全，全齊先發 Email；回傳 (有冇發, DownloadIndex)，索引俾之後歸檔沿用，唔使再掃磁碟。
+    """
+    # **嚴格檢查：全齊才發**（一次 scandir 建索引，Email 階段沿用）
+    index = DownloadIndex.build()
+    movement_file = index.latest(cplus_download_dir, 'cntrMoveLog')
+    onhand_file = index.latest(cplus_download_dir, 'data_')
+    barge_file = index.latest(barge_download_dir, 'ContainerDetailReport')
     
     movement_ok = movement_file is not None
     onhand_ok = onhand_file is not None
     barge_ok = barge_file is not None
-    house_download_count = len(house_report_files)
+    house_download_count = sum(1 for info in house_report_files.values() if index.get(cplus_download_dir, info['file']))
     house_ok = (house_download_count == house_button_count)
 
     total_ok = int(movement_ok) + int(onhand_ok) + house_download_count + int(barge_ok)
@@ -1119,19 +3801,322 @@ def main():
                  '✓' if barge_ok else '✗', house_download_count, house_button_count, total_ok, total_exp)
 
     # **總日誌：列** **所有** **下載file**（即使唔發）
-    all_cplus_files = [f for f in os.listdir(cplus_download_dir) if f.endswith(('.csv', '.xlsx'))]
-    all_barge_files = [f for f in os.listdir(barge_download_dir) if f.endswith(('.csv', '.xlsx'))]
-    all_files = all_cplus_files + all_barge_files
-    logging.info("📋 **所有** 下載 File (%s 個): %s", len(all_files), ', '.join(sorted(all_files)))
+    all_files = index.files()
+    logging.info("📋 **所有** 下載 File (%s 個): %s", len(all_files), ', '.join(all_files))
 
     if movement_ok and onhand_ok and barge_ok and house_ok:
         logging.info("🚀 全齊！發Email...")
-        send_daily_email(house_report_files, house_button_count, cplus_download_dir, barge_download_dir)
+        return send_daily_email(house_report_files, house_button_count, cplus_download_dir, barge_download_dir, index), index
+    logging.warning("⚠️ 唔齊file，跳過Email！(需全✓)")
+    return False, index
+
+def main(pool=None):
+    load_dotenv()
+    # 有 DAEMON_URL 就交俾常駐 daemon 做，本身只係一個 client
+    daemon_url = os.environ.get('DAEMON_URL')
+    if daemon_url:
+        try:
+            result = request_daemon_daily(daemon_url)
+            logging.info(f"✅ Daemon 完成每日任務: {result}")
+            return
+        except Exception as e:
+            logging.warning(f"Daemon 無回應，改為本地執行: {str(e)}")
+    # 每個業務日一份清單；resume 模式沿用今日清單，只補返未完成嘅報告
+    if resume_requested():
+        manifest = RunManifest.load()
+        manifest.verify()
+        if manifest.email_sent():
+            logging.info(f"✅ Resume: {manifest.business_date} 嘅 Email 已於 {manifest.email_sent()} 發送，唔使再跑")
+            if pool:
+                pool.close()
+            return
+        prepare_download_dirs_for_resume(manifest)
     else:
-        logging.warning("⚠️ 唔齊file，跳過Email！(需全✓)")
+        manifest = RunManifest()
+        clear_download_dirs()
+    manifest.save()
+    pacer.reset()
+    if manifest.is_complete():
+        # 上次已經下載齊（只係 Email 未發），唔使開瀏覽器
+        logging.info("Resume: 清單顯示所有報告已完成，直接發 Email")
+        if pool:
+            pool.close()
+        house_report_files, house_button_count = manifest.house_report_files(), manifest.house_button_count()
+    else:
+        # CPLUS 同 Barge 並行處理，總時間由兩者相加變成取較長者
+        start_time = time.time()
+        try:
+            cplus_files, house_file_count, house_button_count, house_report_files, barge_files = run_sites_concurrently(pool, manifest)
+        finally:
+            if pool:
+                pool.close()
+        logging.info(f"⏱️ CPLUS + Barge 並行完成，用時 {time.time() - start_time:.1f} 秒")
+        pacer.log_summary()
+    sent, index = check_and_send_email(house_report_files, house_button_count)
+    if sent:
+        manifest.mark_email_sent()
+        archive_reports(house_report_files, manifest.business_date, index)
 
+    # Session 快取生效時 preflight 預熱嘅 IMAP 連線可能用唔著
+    warm_listener = take_warm_imap_listener()
+    if warm_listener:
+        warm_listener.close()
     logging.info("✅ 腳本完成")
 
+# ==================== 常駐 Daemon（保持登入、本地報告 API） ====================
+DAEMON_REPORTS = {
+    'movement': ('cplus', cplus_download_dir, ['cntrMoveLog']),
+    'onhand': ('cplus', cplus_download_dir, ['data_']),
+    'house': ('cplus', cplus_download_dir, HOUSEKEEP_PREFIXES),
+    'barge': ('barge', barge_download_dir, ['ContainerDetailReport']),
+}
+
+class ReportDaemon:
+    """
+    保持 CPLUS 同 Barge 兩個已登入 driver，keepalive 定時檢查 session（失效就用 cplus_login/barge_login 重登），
+    報告請求經 TTL 快取，同一 site 嘅請求用鎖排隊（WebDriver 唔係 thread-safe）。
+    """
+    def __init__(self):
+        self.ttl = int(os.environ.get('REPORT_CACHE_TTL', 600))
+        self.keepalive_interval = int(os.environ.get('KEEPALIVE_SECONDS', 300))
+        self.sites = {
+            'cplus': {'driver': None, 'wait': None, 'lock': threading.Lock(), 'dir': cplus_download_dir,
+                      'login': cplus_login, 'probe': probe_cplus_session, 'origin': CPLUS_HOME_URL},
+            'barge': {'driver': None, 'wait': None, 'lock': threading.Lock(), 'dir': barge_download_dir,
+                      'login': barge_login, 'probe': probe_barge_session, 'origin': BARGE_LOGIN_URL},
+        }
+        self.cache = {}
+        self.cache_lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def ensure_site(self, site_name):
+        """確保 site 有已登入 driver（呼叫者要持有 site 鎖）"""
+        site = self.sites[site_name]
+        if site['driver'] is None:
+            site['driver'] = start_site_driver(site['dir'])
+            site['wait'] = WebDriverWait(site['driver'], 10)
+            if not (session_cache_enabled() and restore_browser_session(site['driver'], site_name, site['origin'], site['probe'])):
+                site['login'](site['driver'], site['wait'])
+            logging.info(f"Daemon: {site_name} 已登入")
+        return site['driver'], site['wait']
+
+    def relogin(self, site_name):
+        site = self.sites[site_name]
+        logging.warning(f"Daemon: {site_name} session 失效，重新登入...")
+        try:
+            site['login'](site['driver'], site['wait'])
+        except Exception as e:
+            # 登入都失敗就重開 driver
+            logging.error(f"Daemon: {site_name} 重新登入失敗，重開 driver: {str(e)}")
+            self.close_site(site_name)
+            self.ensure_site(site_name)
+
+    def close_site(self, site_name):
+        site = self.sites[site_name]
+        if site['driver']:
+            try:
+                site['driver'].quit()
+            except Exception as e:
+                logging.debug(f"Daemon: {site_name} driver 關閉失敗: {str(e)}")
+        site['driver'] = None
+        site['wait'] = None
+
+    def keepalive_loop(self):
+        while not self.stop_event.wait(self.keepalive_interval):
+            for site_name, site in self.sites.items():
+                with site['lock']:
+                    if site['driver'] is None:
+                        continue
+                    try:
+                        if not site['probe'](site['driver']):
+                            self.relogin(site_name)
+                        else:
+                            logging.debug(f"Daemon: {site_name} keepalive OK")
+                    except Exception as e:
+                        logging.warning(f"Daemon: {site_name} keepalive 失敗: {str(e)}")
+                        self.close_site(site_name)
+
+    def clear_report_files(self, report):
+        """同名重下載會變 (1) 檔，先刪走舊檔確保攞到最新"""
+        _, download_dir, patterns = DAEMON_REPORTS[report]
+        for f in os.listdir(download_dir):
+            if any(p in f for p in patterns):
+                os.remove(os.path.join(download_dir, f))
+
+    def download_report(self, report, driver, wait):
+        site_name, download_dir, _ = DAEMON_REPORTS[report]
+        initial_files = set(os.listdir(download_dir))
+        if report == 'movement':
+            return {'files': sorted(process_cplus_movement(driver, wait, initial_files))}
+        if report == 'onhand':
+            return {'files': sorted(process_cplus_onhand(driver, wait, initial_files))}
+        if report == 'barge':
+            return {'files': sorted(process_barge_download(driver, wait, initial_files))}
+        new_files, _, button_count, report_files = process_cplus_house(driver, wait, initial_files)
+        return {'files': sorted(new_files), 'button_count': button_count, 'report_files': report_files}
+
+    def get_report(self, report, fresh=False):
+        """TTL 內直接回快取，否則喺對應 site 鎖內下載（失敗按類別重試，session 失效先重登）"""
+        if report not in DAEMON_REPORTS:
+            raise KeyError(report)
+        with self.cache_lock:
+            cached = self.cache.get(report)
+        if cached and not fresh and time.time() - cached['fetched_at'] < self.ttl:
+            return dict(cached, cached=True)
+        site_name = DAEMON_REPORTS[report][0]
+        with self.sites[site_name]['lock']:
+            self.ensure_site(site_name)
+            self.clear_report_files(report)
+            current_driver = lambda: self.sites[site_name]['driver']
+
+            def attempt():
+                # 重登後 driver 可能換咗，每次都由 site 攞返最新
+                return self.download_report(report, current_driver(), self.sites[site_name]['wait'])
+
+            # 只有 session 失效先重登（可能要 2FA），其他失敗刷新頁面就夠
+            result = run_with_retry(
+                f"Daemon {report}", current_driver, attempt,
+                recoveries={
+                    'session': lambda e: self.relogin(site_name),
+                    'popup': lambda e: handle_popup(current_driver(), self.sites[site_name]['wait']),
+                    'stale': lambda e: current_driver().refresh(),
+                    'other': lambda e: current_driver().refresh(),
+                },
+                session_lost=cplus_session_lost if site_name == 'cplus' else barge_session_lost)
+        result.update({'report': report, 'dir': DAEMON_REPORTS[report][1], 'fetched_at': time.time()})
+        with self.cache_lock:
+            self.cache[report] = result
+        logging.info(f"Daemon: {report} 已下載 {result['files']}")
+        return dict(result, cached=False)
+
+    def run_daily(self):
+        """每日任務：四份報告（CPLUS 同 Barge 並行）齊就發 Email，發送成功後歸檔"""
+        pacer.reset()
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix='daily') as executor:
+            barge_future = executor.submit(self.get_report, 'barge', True)
+            cplus_results = {report: self.get_report(report, True) for report in ('movement', 'onhand', 'house')}
+            barge_result = barge_future.result()
+        pacer.log_summary()
+        house = cplus_results['house']
+        sent, index = check_and_send_email(house['report_files'], house['button_count'])
+        if sent:
+            archive_reports(house['report_files'], index=index)
+        return {'email_sent': sent, 'files': {k: v['files'] for k, v in dict(cplus_results, barge=barge_result).items()}}
+
+    def status(self):
+        with self.cache_lock:
+            cache = {k: {'files': v['files'], 'age_seconds': int(time.time() - v['fetched_at'])} for k, v in self.cache.items()}
+        return {'sites': {k: v['driver'] is not None for k, v in self.sites.items()}, 'cache': cache, 'ttl': self.ttl}
+
+    def shutdown(self):
+        self.stop_event.set()
+        for site_name in self.sites:
+            with self.sites[site_name]['lock']:
+                self.close_site(site_name)
+
+def make_daemon_handler(daemon):
+    class DaemonRequestHandler(BaseHTTPRequestHandler):
+        def send_json(self, code, payload):
+            body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            try:
+                if url.path == '/health':
+                    self.send_json(200, daemon.status())
+                elif url.path.startswith('/report/'):
+                    fresh = urllib.parse.parse_qs(url.query).get('fresh', ['0'])[0] == '1'
+                    self.send_json(200, daemon.get_report(url.path[len('/report/'):], fresh))
+                else:
+                    self.send_json(404, {'error': 'not found'})
+            except KeyError as e:
+                self.send_json(404, {'error': f"unknown report {e}"})
+            except Exception as e:
+                logging.error(f"Daemon API 錯誤: {str(e)}")
+                self.send_json(500, {'error': str(e)})
+
+        def do_POST(self):
+            try:
+                if self.path == '/daily':
+                    self.send_json(200, daemon.run_daily())
+                else:
+                    self.send_json(404, {'error': 'not found'})
+            except Exception as e:
+                logging.error(f"Daemon 每日任務錯誤: {str(e)}")
+                self.send_json(500, {'error': str(e)})
+
+        def log_message(self, format, *args):
+            logging.info("Daemon API: " + format % args)
+
+    return DaemonRequestHandler
+
+def run_daemon(host='127.0.0.1', port=8765):
+    """
+    常駐模式：預先登入兩個網站，開本地 HTTP API（GET /health、GET /report/<movement|onhand|house|barge>[?fresh=1]、POST /daily）。
+    """
+    load_dotenv()
+    for dir_path in [cplus_download_dir, barge_download_dir]:
+        os.makedirs(dir_path, exist_ok=True)
+    daemon = ReportDaemon()
+    for site_name in daemon.sites:
+        with daemon.sites[site_name]['lock']:
+            try:
+                daemon.ensure_site(site_name)
+            except Exception as e:
+                logging.error(f"Daemon: {site_name} 預先登入失敗，之後請求再試: {str(e)}")
+                daemon.close_site(site_name)
+    threading.Thread(target=daemon.keepalive_loop, name='keepalive', daemon=True).start()
+    server = ThreadingHTTPServer((host, port), make_daemon_handler(daemon))
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    logging.info(f"🟢 Daemon 已啟動: http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.shutdown()
+        logging.info("Daemon 已停止")
+
+def request_daemon_daily(daemon_url):
+    """叫 daemon 行每日任務（daemon 本身會檢查同發 Email）"""
+    http_pool = urllib3.PoolManager()
+    response = http_pool.request('POST', daemon_url.rstrip('/') + '/daily', timeout=urllib3.Timeout(connect=5, read=1800), retries=False)
+    if response.status != 200:
+        raise Exception(f"HTTP {response.status}: {response.data[:200]}")
+    return json.loads(response.data.decode('utf-8'))
+
 if __name__ == "__main__":
-    setup_environment()
-    main()
+    parser = argparse.ArgumentParser(description="HIT CPLUS & Barge daily reports")
+    parser.add_argument('--daemon', action='store_true', help="常駐模式，保持登入並開本地報告 API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--resume', action='store_true', help="沿用今日運行清單，只補返未完成嘅報告")
+    parser.add_argument('--query-archive', metavar='REPORT', help="由歷史歸檔讀報告（movement / onhand / barge / house:<名稱>），CSV 輸出到 stdout")
+    parser.add_argument('--columns', help="--query-archive 只讀呢啲欄位（逗號分隔）")
+    parser.add_argument('--since', help="--query-archive 開始日期 YYYY-MM-DD")
+    parser.add_argument('--until', help="--query-archive 結束日期 YYYY-MM-DD")
+    args = parser.parse_args()
+    if args.query_archive:
+        # 唔使開瀏覽器，直接讀歸檔
+        result = query_archive(args.query_archive, args.columns.split(',') if args.columns else None, args.since, args.until)
+        if result is None:
+            logging.warning(f"🗄️ 歸檔冇 {args.query_archive} 喺指定日期範圍嘅資料")
+            sys.exit(1)
+        pa_csv.write_csv(result, sys.stdout.buffer)
+        sys.exit(0)
+    load_dotenv()
+    if args.resume:
+        os.environ['RESUME'] = 'true'
+    # 共用 Chrome 模式：環境檢查期間背景預熱 Chrome
+    browser_pool = BrowserPool().prewarm() if browser_pool_enabled() and not args.daemon else None
+    setup_environment(browser_pool)
+    if args.daemon:
+        run_daemon(args.host, args.port)
+    else:
+        main(browser_pool)